@@ -0,0 +1,140 @@
+"""
+Run the backend with local stand-ins for Alibaba OCR, OSS and the FLUX
+model, for load testing. Started by bench/load_test.py; can also be run on
+its own to poke at the app by hand.
+
+Postgres is not faked: point DB_HOST/DB_PORT/DB_NAME/DB_USER/DB_PASSWORD
+at a local, disposable instance. With --init-schema the plans, documents
+and tasks tables are created there if they don't exist.
+
+All state (uploads, SQLite caches and journals, image cache, the fake
+bucket) is kept under --workdir.
+
+Usage (from backend/):
+    python bench/bench_server.py --port 8765 --workdir /tmp/aplus-bench [--ocr-latency 0.8]
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from contextlib import asynccontextmanager
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS public.plans (
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS public.documents (
+    id SERIAL PRIMARY KEY,
+    plan_id INTEGER,
+    title TEXT,
+    content TEXT,
+    metadata JSONB,
+    summary TEXT,
+    type TEXT,
+    tag TEXT,
+    image TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS public.tasks (
+    id SERIAL PRIMARY KEY,
+    title TEXT,
+    plan_id INTEGER,
+    start_time TIME,
+    start_date DATE,
+    duration INTEGER,
+    status TEXT DEFAULT 'pending',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+def init_schema() -> None:
+    import psycopg2
+
+    conn = psycopg2.connect(
+        host=os.environ.get("DB_HOST", ""),
+        port=os.environ.get("DB_PORT", "5432"),
+        dbname=os.environ.get("DB_NAME", ""),
+        user=os.environ.get("DB_USER", ""),
+        password=os.environ.get("DB_PASSWORD", ""),
+    )
+    with conn, conn.cursor() as cursor:
+        cursor.execute(SCHEMA)
+    conn.close()
+
+
+def install_fakes(args) -> None:
+    """Patch the app module so its lifespan wires in the fakes instead of Alibaba Cloud."""
+    import main
+    from fakes import FakeOcrClient, FilesystemBucket, StubFluxPipeline
+    from model_loader import STATE_READY
+
+    bucket = FilesystemBucket(os.path.join(args.workdir, "oss"), latency=args.oss_latency)
+    ocr_client = FakeOcrClient(latency=args.ocr_latency, error_rate=args.ocr_error_rate)
+    pipeline = StubFluxPipeline(step_seconds=args.step_seconds)
+
+    main.ALIBABA_ACCESS_KEY_ID = main.ALIBABA_ACCESS_KEY_SECRET = "bench"
+    main.ALIBABA_OSS_ENDPOINT = "oss.bench.invalid"
+    main.oss2.Bucket = lambda *a, **kw: bucket
+
+    if importlib.util.find_spec("torch") is None:
+        # run_flux_batch needs torch for its seeded generators; call the stub directly
+        def run_stub_batch(key, prompts, seeds):
+            with main.app.state.metrics.span("diffusion"):
+                return pipeline(
+                    prompts,
+                    num_inference_steps=key.num_inference_steps,
+                    callback_on_step_end=lambda pipe, step, timestep, kwargs: kwargs,
+                ).images
+        main.run_flux_batch = run_stub_batch
+
+    app_lifespan = main.app.router.lifespan_context
+
+    @asynccontextmanager
+    async def bench_lifespan(app):
+        async with app_lifespan(app):
+            app.state.ocr_client = ocr_client
+            app.state.model_loader.pipeline = pipeline
+            app.state.model_loader.state = STATE_READY
+            yield
+
+    main.app.router.lifespan_context = bench_lifespan
+
+
+def serve():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workdir", default="/tmp/aplus-bench")
+    parser.add_argument("--ocr-latency", type=float, default=0.8, help="Seconds per fake OCR call")
+    parser.add_argument("--ocr-error-rate", type=float, default=0.0)
+    parser.add_argument("--oss-latency", type=float, default=0.05, help="Seconds per fake OSS put")
+    parser.add_argument("--step-seconds", type=float, default=0.05, help="Seconds per fake diffusion step")
+    parser.add_argument("--init-schema", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    # The model is replaced by the stub once the app has started
+    os.environ["IMAGE_MODEL_ENABLED"] = "false"
+    if args.init_schema:
+        init_schema()
+
+    install_fakes(args)
+
+    import uvicorn
+    import main
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    serve()
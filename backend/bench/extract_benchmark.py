@@ -0,0 +1,96 @@
+"""
+Compare HTML-to-text extractor backends on the saved pages in bench/corpus.
+
+For each backend this reports throughput (MB/s and pages/s) and whether its
+output matches the legacy BeautifulSoup extractor exactly, with boilerplate
+removal off (the legacy behaviour) and on. It also reports how much text
+boilerplate removal drops. void_roles.html puts boilerplate roles on void
+elements, which must not hide the rest of the page.
+
+Usage (from backend/):
+    python bench/extract_benchmark.py [--repeat 20] [--backends stream,lxml,legacy]
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors import EXTRACTORS, legacy_html_to_text  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def load_corpus():
+    pages = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                pages[name] = f.read()
+    # A large page, the case that used to stall the event loop
+    pages["combined_x20.html"] = "\n".join(pages.values()) * 20
+    return pages
+
+
+def available_backends(names):
+    backends = {}
+    for name in names:
+        if name == "lxml":
+            try:
+                import lxml.html  # noqa: F401
+            except ImportError:
+                print("lxml not installed, skipping", file=sys.stderr)
+                continue
+        backends[name] = EXTRACTORS[name]
+    return backends
+
+
+def time_backend(extract, html, repeat, strip_boilerplate):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        extract(html, strip_boilerplate)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--backends", default="legacy,stream,lxml")
+    args = parser.parse_args()
+
+    pages = load_corpus()
+    backends = available_backends(args.backends.split(","))
+    report = {}
+
+    for page, html in pages.items():
+        reference = legacy_html_to_text(html)
+        stripped_reference = legacy_html_to_text(html, True)
+        size_mb = len(html.encode()) / 1e6
+        report[page] = {"bytes": len(html.encode()), "backends": {}}
+        for name, extract in backends.items():
+            output = extract(html, False)
+            stripped = extract(html, True)
+            seconds = time_backend(extract, html, args.repeat, True)
+            result = {
+                "ms_per_page": round(seconds * 1000, 3),
+                "mb_per_s": round(size_mb / seconds, 2),
+                "matches_legacy": output == reference,
+                "matches_legacy_stripped": stripped == stripped_reference,
+                "boilerplate_removed_chars": len(output) - len(stripped),
+            }
+            if output != reference:
+                diff = difflib.unified_diff(reference.splitlines(), output.splitlines(), lineterm="", n=0)
+                result["first_diff"] = list(diff)[2:8]
+            if stripped != stripped_reference:
+                diff = difflib.unified_diff(stripped_reference.splitlines(), stripped.splitlines(), lineterm="", n=0)
+                result["first_stripped_diff"] = list(diff)[2:8]
+            report[page]["backends"][name] = result
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
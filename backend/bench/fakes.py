@@ -0,0 +1,164 @@
+"""
+Local stand-ins for the external services the backend talks to, used by
+the load-test harness. Each one injects configurable latency so runs
+exercise the same waiting and concurrency paths as production.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def _sleep(latency: float, jitter: float) -> None:
+    if latency > 0:
+        time.sleep(max(0.0, random.gauss(latency, latency * jitter)))
+
+
+class FakeOcrClient:
+    """
+    Mimics ``alibabacloud_ocr20191230``'s client for ``recognize_pdf_advance``.
+
+    The request's file object is read in full (the SDK uploads it) and the
+    call blocks for ``latency`` seconds, like the remote service would.
+    ``error_rate`` of calls fail, to exercise retries.
+    """
+
+    def __init__(self, latency: float = 0.8, jitter: float = 0.2, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def recognize_pdf_advance(self, request, runtime) -> Any:
+        data = request.file_urlobject.read()
+        with self._lock:
+            self.calls += 1
+        _sleep(self.latency, self.jitter)
+        if random.random() < self.error_rate:
+            raise RuntimeError("Injected OCR failure")
+        content = f"Recognized text of a {len(data)} byte page ({hashlib.sha256(data).hexdigest()[:12]})."
+        return SimpleNamespace(body=SimpleNamespace(data=SimpleNamespace(content=content, words_info=None)))
+
+
+class FilesystemBucket:
+    """
+    Subset of ``oss2.Bucket`` used by the backend, storing objects under ``root``.
+    """
+
+    def __init__(self, root: str, latency: float = 0.05, jitter: float = 0.2):
+        self.root = root
+        self.latency = latency
+        self.jitter = jitter
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def object_exists(self, key: str) -> bool:
+        _sleep(self.latency / 2, self.jitter)
+        return os.path.exists(os.path.join(self.root, key))
+
+    def put_object(self, key: str, data) -> None:
+        _sleep(self.latency, self.jitter)
+        with open(self._path(key), "wb") as f:
+            f.write(data if isinstance(data, bytes) else data.encode())
+
+    def put_object_from_file(self, key: str, filename: str) -> None:
+        _sleep(self.latency, self.jitter)
+        shutil.copyfile(filename, self._path(key))
+
+    def get_object_to_file(self, key: str, filename: str) -> None:
+        _sleep(self.latency, self.jitter)
+        shutil.copyfile(os.path.join(self.root, key), filename)
+
+
+class StubFluxPipeline:
+    """
+    Stands in for ``FluxPipeline``: sleeps ``step_seconds`` per inference
+    step (plus ``per_image_seconds`` per image in the batch), calls
+    ``callback_on_step_end`` like diffusers does, and returns flat images.
+    """
+
+    def __init__(self, step_seconds: float = 0.05, per_image_seconds: float = 0.01, size: int = 512):
+        self.step_seconds = step_seconds
+        self.per_image_seconds = per_image_seconds
+        self.size = size
+
+    def __call__(self, prompt, num_inference_steps: int = 4, callback_on_step_end=None, **kwargs) -> Any:
+        from PIL import Image
+
+        prompts: List[str] = [prompt] if isinstance(prompt, str) else list(prompt)
+        for step in range(num_inference_steps):
+            time.sleep(self.step_seconds + self.per_image_seconds * len(prompts))
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, step, {})
+        images = []
+        for text in prompts:
+            shade = hashlib.sha256(text.encode()).digest()
+            images.append(Image.new("RGB", (self.size, self.size), tuple(shade[:3])))
+        return SimpleNamespace(images=images)
+
+
+def corpus_pages() -> Dict[str, str]:
+    pages = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                pages[name] = f.read()
+    return pages
+
+
+def scrape_target_app(latency: float = 0.1, jitter: float = 0.2) -> web.Application:
+    """
+    Serve the saved pages in ``bench/corpus`` as ``/pages/<name>``, with
+    ETags so the scraper's conditional GETs get 304s.
+    """
+    pages = corpus_pages()
+    etags = {name: f'"{hashlib.sha256(html.encode()).hexdigest()[:16]}"' for name, html in pages.items()}
+
+    async def page(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        if name not in pages:
+            raise web.HTTPNotFound()
+        if latency > 0:
+            await asyncio.sleep(max(0.0, random.gauss(latency, latency * jitter)))
+        if request.headers.get("If-None-Match") == etags[name]:
+            return web.Response(status=304, headers={"ETag": etags[name]})
+        return web.Response(text=pages[name], content_type="text/html", headers={"ETag": etags[name]})
+
+    app = web.Application()
+    app.router.add_get("/pages/{name}", page)
+    return app
+
+
+def make_scanned_pdf(path: str, pages: int = 2, seed: Optional[int] = None) -> str:
+    """
+    Write an image-only PDF (no text layer), so every page goes to OCR.
+    ``seed`` varies the content, and with it the hash the extraction cache keys on.
+    """
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    images = []
+    for index in range(pages):
+        image = Image.new("RGB", (620, 877), "white")
+        draw = ImageDraw.Draw(image)
+        for line in range(30):
+            y = 40 + line * 26
+            draw.rectangle((40, y, 40 + rng.randint(200, 540), y + 10), fill=(20, 20, 20))
+        draw.text((40, 840), f"page {index + 1}", fill=(0, 0, 0))
+        images.append(image)
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:], resolution=72)
+    return path
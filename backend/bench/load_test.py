@@ -0,0 +1,386 @@
+"""
+Load-test the backend offline and report throughput, latency percentiles
+and peak server RSS as JSON.
+
+The app is started by bench/bench_server.py with local stand-ins for OCR,
+OSS and the FLUX model; scrape targets are the saved pages in bench/corpus,
+served from this process. Postgres must be a local, disposable instance
+configured through the usual DB_* variables (--init-schema creates the
+tables). Each workload sends --requests requests with --concurrency in
+flight; /trigger-workflow latency is measured until the job finishes.
+While each workload runs, /health is probed every --health-interval
+seconds; its latency percentiles show how far OCR, upload and encoding
+work stalls the event loop for everything else (the trigger_workflow
+workload is the OCR/upload-heavy one).
+
+With --baseline, the run is compared to an earlier report and the exit
+status is 1 if any workload's p95 or throughput regressed beyond
+--tolerance.
+
+Usage (from backend/):
+    python bench/load_test.py --requests 40 --concurrency 8 --output run.json [--baseline before.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import corpus_pages, make_scanned_pdf, scrape_target_app  # noqa: E402
+
+WORKLOADS = ("create_study_plan", "get_all_data", "trigger_workflow", "generate_image")
+
+
+@dataclass
+class RunContext:
+    session: aiohttp.ClientSession
+    base_url: str
+    scrape_url: str
+    pdfs: List[str]
+    pages: List[str]
+    plan_id: int = 1
+    steps: int = 4
+    run_id: str = field(default_factory=lambda: str(int(time.time())))
+
+
+class RequestFailed(Exception):
+    pass
+
+
+async def create_study_plan(ctx: RunContext, i: int) -> int:
+    body = {"plan_name": f"bench-{ctx.run_id}-{i}", "plan_description": "Created by bench/load_test.py"}
+    async with ctx.session.post(f"{ctx.base_url}/create-study-plan", json=body) as response:
+        payload = await response.json()
+        if response.status != 200:
+            raise RequestFailed(f"HTTP {response.status}")
+    return payload["plan"]["id"]
+
+
+async def get_all_data(ctx: RunContext, i: int) -> None:
+    async with ctx.session.get(f"{ctx.base_url}/get-all-data") as response:
+        await response.read()
+        if response.status != 200:
+            raise RequestFailed(f"HTTP {response.status}")
+
+
+async def generate_image(ctx: RunContext, i: int) -> None:
+    form = {"prompt": f"bench {ctx.run_id} prompt {i}", "num_inference_steps": str(ctx.steps)}
+    async with ctx.session.post(f"{ctx.base_url}/generate-image", data=form) as response:
+        await response.read()
+        if response.status != 200:
+            raise RequestFailed(f"HTTP {response.status}")
+
+
+async def trigger_workflow(ctx: RunContext, i: int) -> None:
+    form = aiohttp.FormData()
+    form.add_field("plan_id", str(ctx.plan_id))
+    links = [f"{ctx.scrape_url}/pages/{ctx.pages[(i + k) % len(ctx.pages)]}" for k in range(2)]
+    form.add_field("links", json.dumps(links))
+    pdf = ctx.pdfs[i % len(ctx.pdfs)]
+    with open(pdf, "rb") as f:
+        form.add_field("files", f.read(), filename=os.path.basename(pdf), content_type="application/pdf")
+
+    async with ctx.session.post(f"{ctx.base_url}/trigger-workflow", data=form) as response:
+        payload = await response.json()
+        if response.status != 202:
+            raise RequestFailed(f"HTTP {response.status}")
+    status_url = f"{ctx.base_url}{payload['data']['status_url']}"
+
+    while True:
+        await asyncio.sleep(0.1)
+        async with ctx.session.get(status_url) as response:
+            job = (await response.json())["data"]
+        if job["status"] == "succeeded":
+            return
+        if job["status"] == "failed":
+            raise RequestFailed(f"Job failed: {job['error']}")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def probe_health(ctx: RunContext, interval: float, stop: asyncio.Event) -> Dict[str, Any]:
+    """Time GET /health every ``interval`` seconds until ``stop`` is set."""
+    latencies: List[float] = []
+    errors = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            async with ctx.session.get(f"{ctx.base_url}/health") as response:
+                await response.read()
+                if response.status != 200:
+                    raise RequestFailed(f"HTTP {response.status}")
+            latencies.append(time.perf_counter() - started)
+        except Exception:
+            errors += 1
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+    latencies.sort()
+    return {
+        "probes": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def run_workload(
+    ctx: RunContext,
+    request: Callable[[RunContext, int], Awaitable[Any]],
+    requests: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                await request(ctx, i)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                key = str(e)[:120] or type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak resident set size of a process so far (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def stage_summary(metrics_text: str) -> Dict[str, Dict[str, float]]:
+    """Mean duration and count per stage from the app's /metrics output."""
+    sums, counts = {}, {}
+    pattern = re.compile(r'^stage_duration_seconds_(sum|count)\{stage="([^"]+)",outcome="ok"\} (\S+)$')
+    for line in metrics_text.splitlines():
+        match = pattern.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            (sums if kind == "sum" else counts)[stage] = float(value)
+    return {
+        stage: {"count": int(counts[stage]), "mean_ms": round(1000 * sums.get(stage, 0.0) / counts[stage], 2)}
+        for stage in sorted(counts)
+        if counts[stage]
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    comparison = {}
+    for name, current in report["workloads"].items():
+        previous = baseline.get("workloads", {}).get(name)
+        if not previous or not previous["p95_ms"] or not previous["throughput_rps"]:
+            continue
+        p95_ratio = current["p95_ms"] / previous["p95_ms"]
+        throughput_ratio = current["throughput_rps"] / previous["throughput_rps"]
+        comparison[name] = {
+            "p95_ratio": round(p95_ratio, 3),
+            "throughput_ratio": round(throughput_ratio, 3),
+            "regressed": p95_ratio > 1 + tolerance or throughput_ratio < 1 - tolerance,
+        }
+    return comparison
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=BENCH_DIR, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(args) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "bench_server.py"),
+        "--port", str(args.port),
+        "--workdir", args.workdir,
+        "--ocr-latency", str(args.ocr_latency),
+        "--ocr-error-rate", str(args.ocr_error_rate),
+        "--oss-latency", str(args.oss_latency),
+        "--step-seconds", str(args.step_seconds),
+    ]
+    if args.init_schema:
+        command.append("--init-schema")
+    os.makedirs(args.workdir, exist_ok=True)
+    log = open(os.path.join(args.workdir, "server.log"), "ab")
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until_up(session: aiohttp.ClientSession, base_url: str, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Bench server exited with status {server.returncode}, see server.log")
+        try:
+            async with session.get(f"{base_url}/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"Bench server not ready after {timeout}s")
+
+
+async def run(args) -> Dict[str, Any]:
+    scrape_runner = web.AppRunner(scrape_target_app(latency=args.scrape_latency))
+    await scrape_runner.setup()
+    await web.TCPSite(scrape_runner, "127.0.0.1", args.scrape_port).start()
+
+    pdf_dir = os.path.join(args.workdir, "pdfs")
+    os.makedirs(pdf_dir, exist_ok=True)
+    pdfs = [
+        make_scanned_pdf(os.path.join(pdf_dir, f"scan-{i}.pdf"), pages=args.pdf_pages, seed=i)
+        for i in range(args.distinct_pdfs)
+    ]
+
+    server = start_server(args)
+    base_url = f"http://127.0.0.1:{args.port}"
+    report: Dict[str, Any] = {
+        "git_revision": git_revision(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "workloads": {},
+    }
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_until_up(session, base_url, server, args.startup_timeout)
+            report["baseline_rss_mb"] = peak_rss_mb(server.pid)
+            ctx = RunContext(
+                session,
+                base_url,
+                f"http://127.0.0.1:{args.scrape_port}",
+                pdfs,
+                sorted(corpus_pages()),
+                steps=args.image_steps,
+            )
+            # A plan for the workflows to attach to
+            ctx.plan_id = await create_study_plan(ctx, -1)
+
+            workloads = {
+                "create_study_plan": create_study_plan,
+                "get_all_data": get_all_data,
+                "trigger_workflow": trigger_workflow,
+                "generate_image": generate_image,
+            }
+            for name in args.workloads.split(","):
+                stop_probe = asyncio.Event()
+                probe = asyncio.create_task(probe_health(ctx, args.health_interval, stop_probe))
+                try:
+                    result = await run_workload(ctx, workloads[name], args.requests, args.concurrency)
+                finally:
+                    stop_probe.set()
+                    health = await probe
+                result["health"] = health
+                result["peak_rss_mb"] = peak_rss_mb(server.pid)
+                report["workloads"][name] = result
+                print(
+                    f"{name}: {result['throughput_rps']} req/s, p95 {result['p95_ms']} ms, "
+                    f"/health p50 {health['p50_ms']} ms p99 {health['p99_ms']} ms",
+                    file=sys.stderr,
+                )
+
+            async with session.get(f"{base_url}/metrics") as response:
+                report["stages"] = stage_summary(await response.text())
+            report["peak_rss_mb"] = peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        await scrape_runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--requests", type=int, default=40, help="Requests per workload")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scrape-port", type=int, default=8766)
+    parser.add_argument("--workdir", default="/tmp/aplus-bench")
+    parser.add_argument("--ocr-latency", type=float, default=0.8)
+    parser.add_argument("--ocr-error-rate", type=float, default=0.0)
+    parser.add_argument("--oss-latency", type=float, default=0.05)
+    parser.add_argument("--scrape-latency", type=float, default=0.1)
+    parser.add_argument("--step-seconds", type=float, default=0.05)
+    parser.add_argument("--image-steps", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=2)
+    parser.add_argument("--distinct-pdfs", type=int, default=4, help="Fewer than --requests means extraction cache hits")
+    parser.add_argument("--health-interval", type=float, default=0.05, help="Seconds between /health probes")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--init-schema", action="store_true")
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative p95/throughput change")
+    args = parser.parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+
+    report = asyncio.run(run(args))
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+        regressed = any(entry["regressed"] for entry in report["comparison"].values())
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
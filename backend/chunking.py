@@ -0,0 +1,91 @@
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+# Roughly one token per word (long words count once per 10 characters),
+# punctuation mark or CJK character, which tracks the embedding model's
+# tokenizer closely enough to size chunks
+TOKEN_PATTERN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]|\w{1,10}|[^\w\s]"
+)
+SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def count_tokens(text: str) -> int:
+    return len(TOKEN_PATTERN.findall(text))
+
+
+@dataclass(frozen=True)
+class Chunk:
+    index: int
+    text: str
+    tokens: int
+    sha256: str
+
+
+def _split_long(text: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """Cut a single oversized sentence at token boundaries."""
+    spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+    pieces = []
+    for start in range(0, len(spans), max_tokens):
+        window = spans[start:start + max_tokens]
+        pieces.append((text[window[0][0]:window[-1][1]], len(window)))
+    return pieces
+
+
+def _units(text: str, max_tokens: int) -> List[Tuple[str, int, str]]:
+    """Split text into sentences no longer than ``max_tokens``, with the separator preceding each."""
+    units = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        separator = "\n\n"
+        for sentence in SENTENCE_END.split(paragraph.strip()):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            tokens = count_tokens(sentence)
+            pieces = _split_long(sentence, max_tokens) if tokens > max_tokens else [(sentence, tokens)]
+            for piece, piece_tokens in pieces:
+                units.append((piece, piece_tokens, separator))
+                separator = " "
+    return units
+
+
+def chunk_text(text: str, max_tokens: int = 400, overlap_tokens: int = 50) -> List[Chunk]:
+    """
+    Split text into chunks of at most ``max_tokens`` tokens along sentence boundaries.
+
+    Consecutive chunks share up to ``overlap_tokens`` tokens of trailing
+    sentences so a passage cut at a boundary is still found whole. Each
+    chunk carries the SHA-256 of its text, used to skip re-embedding
+    unchanged chunks.
+    """
+    max_tokens = max(1, max_tokens)
+    overlap_tokens = min(max(0, overlap_tokens), max_tokens // 2)
+
+    chunks: List[Chunk] = []
+    current: List[Tuple[str, int, str]] = []
+    current_tokens = 0
+
+    def emit():
+        body = "".join((separator if i else "") + unit for i, (unit, _, separator) in enumerate(current))
+        chunks.append(Chunk(len(chunks), body, current_tokens, hashlib.sha256(body.encode()).hexdigest()))
+
+    for unit in _units(text, max_tokens):
+        if current and current_tokens + unit[1] > max_tokens:
+            emit()
+            # Carry trailing sentences over as overlap
+            carried, carried_tokens = [], 0
+            for previous in reversed(current):
+                if carried_tokens + previous[1] > overlap_tokens or carried_tokens + previous[1] + unit[1] > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[1]
+            current, current_tokens = carried, carried_tokens
+        current.append(unit)
+        current_tokens += unit[1]
+
+    if current:
+        emit()
+    return chunks
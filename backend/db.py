@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseUnavailableError(Exception):
+    """Raised when a connection can't be acquired or established."""
+
+
+class PoolTimeoutError(DatabaseUnavailableError):
+    """Raised when no pooled connection becomes free within the acquire timeout."""
+
+
+# Called with (stage, seconds, outcome) after every call run on a connection
+QueryObserver = Callable[[str, float, str], None]
+
+
+class AsyncConnection:
+    """
+    Async facade over one pooled psycopg2 connection.
+
+    Each query runs on the pool's thread executor so the event loop is never
+    blocked. Rows come back as dicts (``RealDictCursor``), same as before.
+    """
+
+    def __init__(self, conn, executor: ThreadPoolExecutor, observer: Optional[QueryObserver] = None):
+        self.raw = conn
+        self._executor = executor
+        self._observer = observer
+        self._cursor_count = 0
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` against this connection on the database executor."""
+        loop = asyncio.get_running_loop()
+        if self._observer is None:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await loop.run_in_executor(self._executor, fn, *args)
+            outcome = "ok"
+            return result
+        finally:
+            self._observer("db_query", time.perf_counter() - started, outcome)
+
+    def _execute(self, sql: str, params: Any, fetch: Optional[str]) -> Any:
+        with self.raw.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(sql, params)
+            if fetch == "one":
+                return cursor.fetchone()
+            if fetch == "all":
+                return cursor.fetchall()
+            return cursor.rowcount
+
+    async def execute(self, sql: str, params: Any = None) -> int:
+        """Execute a statement and return the affected row count."""
+        return await self.run(self._execute, sql, params, None)
+
+    async def fetchone(self, sql: str, params: Any = None) -> Optional[Dict[str, Any]]:
+        return await self.run(self._execute, sql, params, "one")
+
+    async def fetchall(self, sql: str, params: Any = None) -> List[Dict[str, Any]]:
+        return await self.run(self._execute, sql, params, "all")
+
+    async def stream(
+        self, sql: str, params: Any = None, batch_size: int = 500
+    ) -> AsyncGenerator[List[Dict[str, Any]], None]:
+        """
+        Yield result rows in batches from a server-side cursor, so only
+        ``batch_size`` rows are held in memory at a time. Must be used inside
+        a transaction (the pool's connections are not autocommit).
+        """
+        self._cursor_count += 1
+        cursor = self.raw.cursor(name=f"stream_{self._cursor_count}", cursor_factory=RealDictCursor)
+        cursor.itersize = batch_size
+        try:
+            await self.run(cursor.execute, sql, params)
+            while True:
+                rows = await self.run(cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            if not self.raw.closed:
+                await self.run(cursor.close)
+
+
+class DatabasePool:
+    """
+    Bounded pool of psycopg2 connections for async handlers.
+
+    Every request acquires its own connection, so transactions never share a
+    socket. Connections idle for longer than ``health_check_interval`` are
+    pinged before reuse and replaced if dead; connections that break during a
+    request are discarded on release and reopened on demand.
+    """
+
+    def __init__(
+        self,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 10.0,
+        health_check_interval: float = 30.0,
+        observer: Optional[QueryObserver] = None,
+        **connect_kwargs: Any,
+    ):
+        self.min_size = max(0, min_size)
+        self.observer = observer
+        self.max_size = max(1, max_size, self.min_size)
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix="db")
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._slots = asyncio.Semaphore(self.max_size)
+        self._size = 0
+        self._closed = False
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _connect(self):
+        try:
+            conn = await self._run(lambda: psycopg2.connect(**self._connect_kwargs))
+        except psycopg2.Error as e:
+            raise DatabaseUnavailableError(str(e)) from e
+        self._size += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _ping(conn) -> None:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+
+    async def open(self) -> None:
+        """Open ``min_size`` connections up front; failures are retried lazily on acquire."""
+        for _ in range(self.min_size):
+            conn = await self._connect()
+            self._idle.append((conn, time.monotonic()))
+        logger.info(f"Database pool opened (min_size={self.min_size}, max_size={self.max_size})")
+
+    async def close(self) -> None:
+        self._closed = True
+        while self._idle:
+            conn, _ = self._idle.popleft()
+            self._discard(conn)
+        self._executor.shutdown(wait=False)
+        logger.info("Database pool closed")
+
+    async def _acquire(self):
+        if self.observer is None:
+            return await self._checkout()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            conn = await self._checkout()
+            outcome = "ok"
+            return conn
+        finally:
+            # Time spent waiting for a free connection, including any reconnect
+            self.observer("db_acquire", time.perf_counter() - started, outcome)
+
+    async def _checkout(self):
+        if self._closed:
+            raise DatabaseUnavailableError("Database pool is closed")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(
+                f"No database connection available within {self.acquire_timeout}s"
+            ) from None
+
+        try:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if conn.closed:
+                    self._discard(conn)
+                    continue
+                if time.monotonic() - last_used > self.health_check_interval:
+                    try:
+                        await self._run(self._ping, conn)
+                    except psycopg2.Error as e:
+                        logger.warning(f"Dropping dead database connection: {str(e)}")
+                        self._discard(conn)
+                        continue
+                return conn
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _release(self, conn) -> None:
+        try:
+            if conn.closed:
+                self._discard(conn)
+            elif self._closed:
+                self._discard(conn)
+            else:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    await self._run(conn.rollback)
+                self._idle.append((conn, time.monotonic()))
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding database connection after release error: {str(e)}")
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncConnection]:
+        """
+        Acquire a connection for read-only work. Any implicit transaction is
+        rolled back when the block exits.
+        """
+        conn = await self._acquire()
+        try:
+            yield AsyncConnection(conn, self._executor, self.observer)
+        finally:
+            await self._release(conn)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[AsyncConnection]:
+        """
+        Acquire a connection and run the block in one transaction, committed on
+        success and rolled back on any exception.
+        """
+        conn = await self._acquire()
+        try:
+            async_conn = AsyncConnection(conn, self._executor, self.observer)
+            try:
+                yield async_conn
+            except BaseException:
+                if not conn.closed:
+                    try:
+                        await async_conn.run(conn.rollback)
+                    except psycopg2.Error:
+                        pass
+                raise
+            await async_conn.run(conn.commit)
+        finally:
+            await self._release(conn)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._size - len(self._idle),
+            "max_size": self.max_size,
+        }
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from typing import List
+
+import aiohttp
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DASHSCOPE_EMBEDDING_ENDPOINT = "https://dashscope-intl.aliyuncs.com/compatible-mode/v1/embeddings"
+
+
+class EmbeddingError(Exception):
+    """Raised when the embedding API fails or returns an unexpected response."""
+
+
+class EmbeddingClient:
+    """
+    Batched client for the DashScope (OpenAI-compatible) embeddings API.
+
+    Texts are sent ``batch_size`` at a time with up to ``max_concurrency``
+    requests in flight. Returned vectors are L2-normalized float32, so a
+    dot product is cosine similarity.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        api_key: str,
+        model: str = "text-embedding-v3",
+        dimensions: int = 1024,
+        endpoint: str = DASHSCOPE_EMBEDDING_ENDPOINT,
+        batch_size: int = 10,
+        max_concurrency: int = 4,
+    ):
+        self.session = session
+        self.api_key = api_key
+        self.model = model
+        self.dimensions = dimensions
+        self.endpoint = endpoint
+        self.batch_size = max(1, batch_size)
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self.requests = 0
+        self.texts = 0
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        body = {
+            "model": self.model,
+            "input": texts,
+            "dimensions": self.dimensions,
+            "encoding_format": "float",
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        async with self._slots:
+            async with self.session.post(self.endpoint, json=body, headers=headers) as response:
+                if response.status != 200:
+                    detail = (await response.text())[:200]
+                    raise EmbeddingError(f"Embedding API returned HTTP {response.status}: {detail}")
+                payload = await response.json()
+        self.requests += 1
+        self.texts += len(texts)
+
+        data = payload.get("data") if isinstance(payload, dict) else None
+        if not data or len(data) != len(texts):
+            raise EmbeddingError("Invalid response format from the embedding API")
+        # Results carry their input index; don't rely on response order
+        data = sorted(data, key=lambda item: item.get("index", 0))
+        return np.asarray([item["embedding"] for item in data], dtype=np.float32)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed ``texts`` and return a ``(len(texts), dimensions)`` matrix of unit vectors.
+
+        Raises:
+            EmbeddingError: If any batch fails
+        """
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        matrix = np.concatenate(await asyncio.gather(*(self._embed_batch(batch) for batch in batches)))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
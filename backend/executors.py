@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """
+    Named thread pool for one class of blocking work, with queue-wait metrics.
+
+    Queue wait is the time between ``run`` being awaited and a worker thread
+    picking the call up; a growing wait means the pool is undersized for
+    its load.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    def _call(self, submitted_at: float, fn: Callable[[], T]) -> T:
+        started = time.perf_counter()
+        wait = started - submitted_at
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        try:
+            return fn()
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_seconds_total += time.perf_counter() - started
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(*args, **kwargs)`` on this pool and await its result."""
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(self._call, time.perf_counter(), partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A call that never started won't decrement the queue itself
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = self.completed
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(1000 * self.wait_seconds_total / completed, 3) if completed else 0.0,
+                "max_wait_ms": round(1000 * self.wait_seconds_max, 3),
+                "avg_run_ms": round(1000 * self.run_seconds_total / completed, 3) if completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Executors:
+    """
+    The app's blocking-work pools, sized separately so slow network calls
+    (OCR, OSS) can't starve local disk and CPU work (image encoding, file
+    writes), and neither can starve the default executor.
+    """
+
+    def __init__(self, network_workers: int = 16, disk_workers: int = 4):
+        self.network = BlockingExecutor("network", network_workers)
+        self.disk = BlockingExecutor("disk", disk_workers)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {"network": self.network.stats(), "disk": self.disk.stats()}
+
+    def shutdown(self) -> None:
+        self.network.shutdown()
+        self.disk.shutdown()
+        logger.info("Blocking executors shut down")
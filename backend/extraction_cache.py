@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """
+    Index of extracted PDF text keyed by the PDF's SHA-256.
+
+    Each entry holds the OCR text and the OSS URL it was stored at, plus the
+    set of plans referencing it, kept in step with each plan's documents by
+    ``set_plan_refs``. Re-uploading a known PDF reuses the entry
+    instead of paying for OCR and another OSS object. When the cache grows
+    past ``max_entries``, least recently used entries are evicted, entries
+    no plan references first; entries unused for ``max_age_seconds`` are
+    dropped regardless. Sync methods are blocking; use the async wrappers
+    from handlers.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_age_seconds: float = 90 * 24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+
+        self._lock = threading.Lock()
+        # Wait for other processes' write locks instead of failing straight away
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS extractions (
+                    sha256 TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    oss_url TEXT,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS extraction_refs (
+                    sha256 TEXT NOT NULL REFERENCES extractions (sha256) ON DELETE CASCADE,
+                    plan_id INTEGER NOT NULL,
+                    PRIMARY KEY (sha256, plan_id)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used_at)"
+            )
+            # Per-page OCR results of documents still being extracted
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS page_texts (
+                    sha256 TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (sha256, page)
+                )
+                """
+            )
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT sha256, text, oss_url FROM extractions WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE extractions SET last_used_at = ? WHERE sha256 = ?", (time.time(), sha256)
+            )
+        return dict(row)
+
+    def put(self, sha256: str, text: str, oss_url: Optional[str]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO extractions (sha256, text, oss_url, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (sha256) DO UPDATE SET
+                    text = excluded.text, oss_url = excluded.oss_url, last_used_at = excluded.last_used_at
+                """,
+                (sha256, text, oss_url, now, now),
+            )
+            # The whole document is cached now, so its pages aren't needed
+            self._conn.execute("DELETE FROM page_texts WHERE sha256 = ?", (sha256,))
+            self._evict()
+
+    def get_pages(self, sha256: str) -> Dict[int, str]:
+        """Return the OCR'd pages cached for a document that hasn't finished extracting."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, text FROM page_texts WHERE sha256 = ?", (sha256,)
+            ).fetchall()
+        return {row["page"]: row["text"] for row in rows}
+
+    def put_page(self, sha256: str, page: int, text: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page_texts (sha256, page, text, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, page, text, time.time()),
+            )
+
+    def add_ref(self, sha256: str, plan_id: int) -> int:
+        """
+        Record that ``plan_id`` uses this extraction.
+
+        Returns:
+            The number of plans now referencing it
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO extraction_refs (sha256, plan_id) VALUES (?, ?)", (sha256, plan_id)
+            )
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS refs FROM extraction_refs WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        return row["refs"]
+
+    def set_plan_refs(self, plan_id: int, sha256s: Iterable[str]) -> int:
+        """
+        Make ``sha256s`` the only extractions ``plan_id`` references, e.g.
+        after its documents were replaced. Extractions no plan references
+        any more are evicted first.
+
+        Returns:
+            The number of references dropped
+        """
+        sha256s = sorted(set(sha256s))
+        placeholders = ", ".join("?" for _ in sha256s)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"DELETE FROM extraction_refs WHERE plan_id = ? AND sha256 NOT IN ({placeholders})",
+                (plan_id, *sha256s),
+            )
+            # Only cached extractions can be referenced
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO extraction_refs (sha256, plan_id) SELECT sha256, ? FROM extractions WHERE sha256 = ?",
+                [(plan_id, sha256) for sha256 in sha256s],
+            )
+        return cursor.rowcount
+
+    def _evict(self) -> None:
+        if self.max_age_seconds > 0:
+            cutoff = time.time() - self.max_age_seconds
+            self._conn.execute("DELETE FROM extractions WHERE last_used_at < ?", (cutoff,))
+            # Pages of documents whose extraction never completed
+            self._conn.execute("DELETE FROM page_texts WHERE created_at < ?", (cutoff,))
+        count = self._conn.execute("SELECT COUNT(*) AS n FROM extractions").fetchone()["n"]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                """
+                DELETE FROM extractions WHERE sha256 IN (
+                    SELECT e.sha256 FROM extractions e
+                    ORDER BY EXISTS (SELECT 1 FROM extraction_refs r WHERE r.sha256 = e.sha256),
+                             e.last_used_at
+                    LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+            logger.info(f"Evicted {excess} entries from the extraction cache")
+
+    async def get_or_extract(
+        self,
+        sha256: str,
+        plan_id: int,
+        extract: Callable[[], Awaitable[Tuple[str, Optional[str]]]],
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Return the cached extraction for ``sha256``, running ``extract`` on a miss.
+
+        Concurrent calls for the same hash share one extraction. ``extract``
+        returns the text and its OSS URL; failures are not cached.
+
+        Returns:
+            The entry (text and oss_url) and whether it came from the cache
+        """
+        cached = await asyncio.to_thread(self.get, sha256)
+        if cached is None and sha256 in self._inflight:
+            cached = await asyncio.shield(self._inflight[sha256])
+
+        if cached is not None:
+            self.hits += 1
+            await asyncio.to_thread(self.add_ref, sha256, plan_id)
+            return cached, True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[sha256] = future
+        try:
+            text, oss_url = await extract()
+            entry = {"sha256": sha256, "text": text, "oss_url": oss_url}
+            await asyncio.to_thread(self.put, sha256, text, oss_url)
+            await asyncio.to_thread(self.add_ref, sha256, plan_id)
+            future.set_result(entry)
+            return entry, False
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters get the exception; make sure it isn't reported as never retrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[sha256]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) AS n FROM extractions").fetchone()["n"]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Elements whose content is never page text
+SKIPPED_TAGS = frozenset({"script", "style"})
+# Site chrome and fallbacks dropped when boilerplate removal is on
+BOILERPLATE_TAGS = frozenset({"nav", "footer", "aside", "noscript", "template"})
+BOILERPLATE_ROLES = frozenset({"navigation", "contentinfo", "banner"})
+# Elements that never have an end tag, so they can't open a skipped region
+VOID_TAGS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr",
+})
+
+
+def clean_text(strings: Iterable[str]) -> str:
+    """
+    Join text nodes one per line and drop blank lines and runs of spaces.
+
+    This is the cleanup the scraper has always applied after BeautifulSoup's
+    ``get_text(separator='\\n')``; every backend shares it so outputs match.
+    """
+    lines = (line.strip() for line in "\n".join(strings).splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(chunk for chunk in chunks if chunk)
+
+
+def legacy_html_to_text(html: str, strip_boilerplate: bool = False) -> str:
+    """Original BeautifulSoup ``html.parser`` extraction, kept as the reference backend."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    if strip_boilerplate:
+        for element in soup(list(BOILERPLATE_TAGS)):
+            element.decompose()
+        for element in soup(attrs={"role": list(BOILERPLATE_ROLES)}):
+            element.decompose()
+    return clean_text([soup.get_text(separator="\n")])
+
+
+class _TextCollector(HTMLParser):
+    def __init__(self, strip_boilerplate: bool):
+        super().__init__(convert_charrefs=True)
+        self.strip_boilerplate = strip_boilerplate
+        self.strings: List[str] = []
+        # Open skipped elements, innermost last; text is kept only while this is empty
+        self._skipping: List[str] = []
+
+    def _skips(self, tag: str, attrs) -> bool:
+        if tag in SKIPPED_TAGS:
+            return True
+        if not self.strip_boilerplate:
+            return False
+        if tag in BOILERPLATE_TAGS:
+            return True
+        return any(name == "role" and value in BOILERPLATE_ROLES for name, value in attrs)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        if self._skipping or self._skips(tag, attrs):
+            # Track every nested tag of the same name so the matching end tag is found
+            if not self._skipping or tag == self._skipping[0]:
+                self._skipping.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        if self._skipping and tag == self._skipping[-1]:
+            self._skipping.pop()
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.strings.append(data)
+
+
+def stream_html_to_text(html: str, strip_boilerplate: bool = False) -> str:
+    """
+    Extract text in a single pass with the standard library's HTML tokenizer.
+
+    No tree is built: text nodes are collected as they are parsed and skipped
+    regions are tracked with a small stack, so memory stays proportional to
+    the output.
+    """
+    collector = _TextCollector(strip_boilerplate)
+    collector.feed(html)
+    collector.close()
+    return clean_text(collector.strings)
+
+
+def lxml_html_to_text(html: str, strip_boilerplate: bool = False) -> str:
+    """Extract text with lxml's C parser. Requires the optional ``lxml`` package."""
+    import lxml.html
+    from lxml import etree
+
+    if not html.strip():
+        return ""
+    document = lxml.html.document_fromstring(html)
+    removed = [*SKIPPED_TAGS, *(BOILERPLATE_TAGS if strip_boilerplate else ())]
+    for element in list(document.iter(*removed, etree.Comment, etree.ProcessingInstruction)):
+        # drop_tree keeps the element's tail text, which belongs to its parent
+        element.drop_tree()
+    if strip_boilerplate:
+        for element in list(document.iter()):
+            if element.get("role") in BOILERPLATE_ROLES and element.getparent() is not None:
+                element.drop_tree()
+    return clean_text(document.itertext())
+
+
+EXTRACTORS: Dict[str, Callable[..., str]] = {
+    "legacy": legacy_html_to_text,
+    "stream": stream_html_to_text,
+    "lxml": lxml_html_to_text,
+}
+
+
+def get_extractor(name: str) -> Callable[..., str]:
+    """
+    Look up an extractor backend by name, falling back to ``stream`` when lxml is missing.
+
+    Raises:
+        ValueError: If ``name`` isn't a known backend
+    """
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor '{name}'; expected one of {', '.join(EXTRACTORS)}")
+    if name == "lxml":
+        try:
+            import lxml.html  # noqa: F401
+        except ImportError:
+            logger.warning("lxml is not installed, using the stream HTML extractor")
+            return EXTRACTORS["stream"]
+    return EXTRACTORS[name]
+
+
+def extract_text(html: str, backend: str = "stream", strip_boilerplate: bool = True) -> str:
+    """Module-level entry point so worker processes can unpickle the call."""
+    return get_extractor(backend)(html, strip_boilerplate)
+
+
+class ExtractorPool:
+    """
+    Runs HTML-to-text extraction in worker processes, off the event loop.
+
+    Parsing is CPU-bound and holds the GIL, so a thread would still stall
+    other requests on a large page. With ``workers=0`` extraction runs in a
+    thread instead, for environments where extra processes aren't wanted.
+    """
+
+    def __init__(self, backend: str = "stream", strip_boilerplate: bool = True, workers: int = 2):
+        # Resolve once here so an unknown backend fails at startup
+        self.backend = backend if get_extractor(backend) is EXTRACTORS[backend] else "stream"
+        self.strip_boilerplate = strip_boilerplate
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if workers > 0:
+            # Spawn, not fork: the server process already runs threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    async def extract(self, html: str) -> str:
+        call = partial(extract_text, html, self.backend, self.strip_boilerplate)
+        if self._executor is None:
+            return await asyncio.to_thread(call)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from image_encoding import MEDIA_TYPES_BY_EXTENSION
+from storage import STALE_TMP_SECONDS, walk_files
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CacheEntry:
+    path: str
+    size: int
+    created_at: float
+
+
+def image_cache_key(
+    prompt: str,
+    guidance_scale: float,
+    num_inference_steps: int,
+    max_sequence_length: int,
+    seed: int,
+    image_format: str = "png",
+    quality: Optional[int] = None,
+) -> str:
+    """
+    Hash the parameters that fully determine a seeded FluxPipeline output
+    and its encoding.
+    """
+    params = [prompt, float(guidance_scale), int(num_inference_steps), int(max_sequence_length), int(seed)]
+    # Lossless PNG keeps the original key, so entries cached before formats were selectable stay valid
+    if image_format != "png":
+        params += [image_format, quality]
+    payload = json.dumps(params, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """
+    Content-addressed cache of generated images.
+
+    Encoded images live on disk under ``directory/<key[:2]>/<key>.<ext>`` with an
+    in-memory LRU index over them. The index is bounded by total bytes and
+    entry age; evicted entries are deleted from disk. Objects known to be in
+    OSS are tracked so they are never uploaded twice. When an OSS bucket is
+    given and ``oss_tier`` is on, local misses are looked up in OSS and
+    pulled back into the local store. All methods are blocking and safe to
+    call from worker threads.
+
+    Unlike ``storage.LocalFileStore``, entries can be evicted before their
+    OSS upload is confirmed: images are queued with ``enqueue_bytes``, so
+    the upload journal holds its own copy.
+    """
+
+    name = "image_cache"
+    # The LRU index lives in this process, so every process compacts its own
+    shared_index = False
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        max_age_seconds: float,
+        bucket=None,
+        oss_tier: bool = True,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bucket = bucket
+        self.oss_tier = oss_tier
+
+        self._lock = threading.Lock()
+        self._scan = None
+        self._index: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._known_objects = set()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "oss_hits": 0,
+            "evictions": 0,
+            "oss_uploads": 0,
+            "oss_upload_dedups": 0,
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path_for(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{extension}")
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU index from disk, least recently used first."""
+        entries = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                key, extension = os.path.splitext(filename)
+                if extension[1:] not in MEDIA_TYPES_BY_EXTENSION:
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_atime, key, _CacheEntry(path, stat.st_size, stat.st_mtime)))
+
+        for _, key, entry in sorted(entries):
+            self._index[key] = entry
+            self._total_bytes += entry.size
+        self._evict()
+        logger.info(f"Image cache loaded {len(self._index)} entries ({self._total_bytes} bytes) from {self.directory}")
+
+    def _remove(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry.size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove cached image {entry.path}: {str(e)}")
+
+    def _evict(self, limit: Optional[int] = None) -> int:
+        """
+        Drop expired entries, then least recently used ones until under the
+        size limit, at most ``limit`` in total.
+
+        Returns:
+            The number of entries evicted
+        """
+        now = time.time()
+        evicted = 0
+        if self.max_age_seconds > 0:
+            expired = [key for key, entry in self._index.items() if now - entry.created_at > self.max_age_seconds]
+            for key in expired[:limit]:
+                self._remove(key)
+                evicted += 1
+
+        # Always keep the most recent entry so a just-stored image stays readable
+        while len(self._index) > 1 and self._total_bytes > self.max_bytes and (limit is None or evicted < limit):
+            key = next(iter(self._index))
+            self._remove(key)
+            evicted += 1
+        self._stats["evictions"] += evicted
+        return evicted
+
+    def _add(self, key: str, path: str) -> str:
+        size = os.path.getsize(path)
+        self._remove_from_index_only(key)
+        self._index[key] = _CacheEntry(path, size, time.time())
+        self._total_bytes += size
+        self._evict()
+        return path
+
+    def _remove_from_index_only(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def get(self, key: str, object_path: Optional[str] = None) -> Optional[str]:
+        """
+        Look up a cached image.
+
+        Args:
+            key: Cache key from ``image_cache_key``
+            object_path: OSS object to fall back to on a local miss (optional)
+
+        Returns:
+            Local path of the cached image, or None on a miss
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                expired = self.max_age_seconds > 0 and time.time() - entry.created_at > self.max_age_seconds
+                if not expired and os.path.exists(entry.path):
+                    self._index.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry.path
+                self._remove(key)
+
+        # Second tier: pull the object back from OSS without holding the lock
+        if self.oss_tier and self.bucket is not None and object_path:
+            path = self._path_for(key, os.path.splitext(object_path)[1][1:])
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                if self.bucket.object_exists(object_path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    self.bucket.get_object_to_file(object_path, tmp_path)
+                    os.replace(tmp_path, path)
+                    with self._lock:
+                        self._known_objects.add(object_path)
+                        self._stats["oss_hits"] += 1
+                        return self._add(key, path)
+            except Exception as e:
+                logger.warning(f"Image cache OSS lookup failed for {object_path}: {str(e)}")
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, data: bytes, extension: str) -> str:
+        """
+        Store an encoded image under ``key``.
+
+        Args:
+            key: Cache key from ``image_cache_key``
+            data: Encoded image bytes
+            extension: File extension matching the encoding
+
+        Returns:
+            Local path of the stored image
+        """
+        path = self._path_for(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary name so readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            return self._add(key, path)
+
+    def evict_batch(self, max_files: int) -> Dict[str, Any]:
+        """Evict up to ``max_files`` expired or over-quota entries, for periodic compaction."""
+        with self._lock:
+            total_bytes = self._total_bytes
+            evicted = self._evict(max_files)
+            return {"evicted": evicted, "freed_bytes": total_bytes - self._total_bytes, "more": int(evicted == max_files)}
+
+    def sweep_batch(self, max_files: int) -> Dict[str, Any]:
+        """Delete temporary files left by interrupted writes, checking up to ``max_files`` files."""
+        if self._scan is None:
+            self._scan = walk_files(self.directory)
+        now = time.time()
+        scanned = removed = 0
+        while scanned < max_files:
+            entry = next(self._scan, None)
+            if entry is None:
+                self._scan = None
+                return {"scanned": scanned, "removed": removed, "finished": 1}
+            scanned += 1
+            try:
+                if entry.name.endswith(".tmp") and now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return {"scanned": scanned, "removed": removed, "finished": 0}
+
+    def needs_upload(self, object_path: str) -> bool:
+        """
+        Check whether a cached image still has to be uploaded to OSS.
+
+        Object names are content-addressed, so one already known to be in OSS
+        is identical and is never uploaded again.
+        """
+        with self._lock:
+            if object_path in self._known_objects:
+                self._stats["oss_upload_dedups"] += 1
+                return False
+            return True
+
+    def mark_uploaded(self, object_path: str) -> None:
+        """Record that ``object_path`` is now in OSS."""
+        with self._lock:
+            if object_path not in self._known_objects:
+                self._known_objects.add(object_path)
+                self._stats["oss_uploads"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current cache size."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["oss_hits"] + self._stats["misses"]
+            hit_rate = (self._stats["hits"] + self._stats["oss_hits"]) / lookups if lookups else 0.0
+            return {
+                **self._stats,
+                "hit_rate": round(hit_rate, 4),
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
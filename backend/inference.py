@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue has reached its configured depth."""
+
+
+@dataclass(frozen=True)
+class BatchKey:
+    """Pipeline parameters that must match for prompts to share a batch."""
+    num_inference_steps: int
+    guidance_scale: float
+    max_sequence_length: int
+
+
+@dataclass
+class _PendingRequest:
+    key: BatchKey
+    prompt: str
+    seed: int
+    future: asyncio.Future
+
+
+# Signature of the blocking batch runner: (key, prompts, seeds) -> images
+BatchRunner = Callable[[BatchKey, List[str], List[int]], List[Any]]
+
+
+class InferenceScheduler:
+    """
+    Queue image generation requests and run compatible ones as a single batch.
+
+    A single worker task drains the queue. It takes the oldest request, then
+    waits up to ``max_wait_ms`` for more requests with the same ``BatchKey``
+    until ``max_batch_size`` is reached. Incompatible requests are held back
+    for the next batch so ordering is preserved per key. The blocking pipeline
+    call runs in a worker thread, so the event loop keeps serving other
+    endpoints while the model is busy.
+    """
+
+    def __init__(
+        self,
+        run_batch: BatchRunner,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 50,
+        max_queue_depth: int = 32,
+    ):
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue_depth = max(1, max_queue_depth)
+
+        self._queue: "asyncio.Queue[_PendingRequest]" = asyncio.Queue()
+        self._deferred: Deque[_PendingRequest] = deque()
+        self._depth = 0
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """Number of requests waiting to be dispatched."""
+        return self._depth
+
+    async def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), name="inference-scheduler")
+            logger.info(
+                f"Inference scheduler started (max_batch_size={self.max_batch_size}, "
+                f"max_wait_ms={self.max_wait * 1000:.0f}, max_queue_depth={self.max_queue_depth})"
+            )
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        # Fail anything still waiting so callers don't hang on shutdown
+        while self._deferred or not self._queue.empty():
+            request = self._deferred.popleft() if self._deferred else self._queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Inference scheduler stopped"))
+        self._depth = 0
+        logger.info("Inference scheduler stopped")
+
+    async def submit(
+        self,
+        prompt: str,
+        seed: int,
+        num_inference_steps: int,
+        guidance_scale: float,
+        max_sequence_length: int,
+    ) -> Any:
+        """
+        Enqueue a prompt and wait for its generated image.
+
+        Raises:
+            QueueFullError: If ``max_queue_depth`` requests are already waiting
+        """
+        if self._depth >= self.max_queue_depth:
+            raise QueueFullError(f"Inference queue is full ({self._depth} requests waiting)")
+
+        key = BatchKey(num_inference_steps, guidance_scale, max_sequence_length)
+        future = asyncio.get_running_loop().create_future()
+        self._depth += 1
+        self._queue.put_nowait(_PendingRequest(key, prompt, seed, future))
+        return await future
+
+    async def _next_request(self) -> _PendingRequest:
+        if self._deferred:
+            return self._deferred.popleft()
+        return await self._queue.get()
+
+    async def _collect_batch(self, batch: List[_PendingRequest]) -> None:
+        """Fill ``batch`` in place, so requests taken so far are known if this fails."""
+        first = await self._next_request()
+        batch.append(first)
+
+        # Requests held back from earlier rounds are older, so take them first
+        remaining: Deque[_PendingRequest] = deque()
+        while self._deferred and len(batch) < self.max_batch_size:
+            request = self._deferred.popleft()
+            (batch if request.key == first.key else remaining).append(request)
+        self._deferred.extendleft(reversed(remaining))
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if request.key == first.key:
+                batch.append(request)
+            else:
+                self._deferred.append(request)
+
+    async def _dispatch(self, batch: List[_PendingRequest]) -> None:
+        # Skip callers that went away while waiting in the queue
+        batch = [request for request in batch if not request.future.done()]
+        if not batch:
+            return
+
+        key = batch[0].key
+        prompts = [request.prompt for request in batch]
+        seeds = [request.seed for request in batch]
+        images = await asyncio.to_thread(self._run_batch, key, prompts, seeds)
+
+        for request, image in zip(batch, images):
+            if not request.future.done():
+                request.future.set_result(image)
+        if len(images) < len(batch):
+            raise RuntimeError(f"Pipeline returned {len(images)} images for {len(batch)} prompts")
+
+    async def _run(self) -> None:
+        while True:
+            batch: List[_PendingRequest] = []
+            try:
+                try:
+                    await self._collect_batch(batch)
+                finally:
+                    self._depth -= len(batch)
+                await self._dispatch(batch)
+            except asyncio.CancelledError:
+                _fail(batch, RuntimeError("Inference scheduler stopped"))
+                raise
+            except Exception as e:
+                # Keep the scheduler alive; only this batch's callers see the error
+                logger.error(f"Batch of {len(batch)} image requests failed: {str(e)}")
+                _fail(batch, e)
+
+
+def _fail(batch: List[_PendingRequest], error: BaseException) -> None:
+    """Resolve the requests of ``batch`` that are still waiting with ``error``."""
+    for request in batch:
+        if not request.future.done():
+            request.future.set_exception(error)
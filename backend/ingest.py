@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestItem:
+    """One unit of ingestion work: a PDF to OCR or a link to scrape."""
+    kind: str
+    key: str
+    host: str  # Concurrency group; remote host for links, the OCR service for PDFs
+    run: Callable[[], Awaitable[Any]]
+
+
+@dataclass
+class IngestResult:
+    kind: str
+    key: str
+    ok: bool
+    value: Any = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+
+def host_of(url: str) -> str:
+    return (urlparse(url).hostname or url).lower()
+
+
+@dataclass
+class IngestLimits:
+    max_concurrency: int = 8
+    per_host_concurrency: int = 2
+    item_timeout: float = 120.0
+
+
+async def run_ingestion(items: List[IngestItem], limits: IngestLimits) -> List[IngestResult]:
+    """
+    Run all items concurrently under global and per-host limits.
+
+    Each item gets its own timeout; a failure or timeout is recorded in its
+    result instead of cancelling the others. Results are returned in input
+    order regardless of completion order.
+    """
+    global_slots = asyncio.Semaphore(max(1, limits.max_concurrency))
+    host_slots: Dict[str, asyncio.Semaphore] = defaultdict(
+        lambda: asyncio.Semaphore(max(1, limits.per_host_concurrency))
+    )
+
+    async def run_one(item: IngestItem) -> IngestResult:
+        # Take the host slot first so one slow host can't hold global slots while queued
+        async with host_slots[item.host], global_slots:
+            started = time.perf_counter()
+            try:
+                value = await asyncio.wait_for(item.run(), limits.item_timeout)
+                return IngestResult(item.kind, item.key, True, value, elapsed=time.perf_counter() - started)
+            except asyncio.TimeoutError:
+                error = f"Timed out after {limits.item_timeout:.0f}s"
+            except Exception as e:
+                error = str(e)
+            logger.error(f"Ingestion of {item.kind} {item.key} failed: {error}")
+            return IngestResult(item.kind, item.key, False, error=error, elapsed=time.perf_counter() - started)
+
+    return list(await asyncio.gather(*(run_one(item) for item in items)))
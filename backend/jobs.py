@@ -0,0 +1,396 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class RetryableJobError(Exception):
+    """Raised by a job handler when some work failed and the job should be retried."""
+
+    def __init__(self, message: str, result: Any = None):
+        super().__init__(message)
+        self.result = result
+
+
+class JobStore:
+    """
+    SQLite-backed store of workflow jobs, so queued work survives a restart.
+
+    Several processes can share the file. A claimed job records its
+    ``owner`` and holds a lease that the owner renews while the job runs;
+    only jobs whose lease has expired (their process died or hung) are put
+    back on the queue. All methods are blocking; ``JobQueue`` calls them
+    from worker threads.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 60.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        # Wait for other processes' write locks instead of failing straight away
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    idempotency_key TEXT UNIQUE,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_run_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    lease_expires_at REAL
+                )
+                """
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, next_run_at)"
+            )
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for column in ("payload", "progress", "result"):
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        return job
+
+    def create(
+        self, kind: str, payload: Dict[str, Any], idempotency_key: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Insert a queued job, or return the existing one for ``idempotency_key``.
+
+        Returns:
+            The job and whether it was newly created
+        """
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        with self._lock, self._conn:
+            if idempotency_key:
+                existing = self._conn.execute(
+                    "SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if existing is not None:
+                    return self._to_dict(existing), False
+            self._conn.execute(
+                """
+                INSERT INTO jobs (id, idempotency_key, kind, status, payload, next_run_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job_id, idempotency_key, kind, JOB_QUEUED, json.dumps(payload), now, now, now),
+            )
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row), True
+
+    def find_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        return self._to_dict(row)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically mark the oldest runnable job as running under this store's lease and return it."""
+        now = time.time()
+        # A single statement, so two processes can't claim the same job
+        with self._lock, self._conn:
+            claimed = self._conn.execute(
+                """
+                UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, lease_expires_at = ?, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = ? AND next_run_at <= ?
+                    ORDER BY next_run_at, created_at
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                (JOB_RUNNING, self.owner, now + self.lease_seconds, now, JOB_QUEUED, now),
+            ).fetchone()
+        return self._to_dict(claimed)
+
+    def next_run_delay(self) -> Optional[float]:
+        """Seconds until the next queued job becomes runnable, or None if none are queued."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_run_at) AS next_run_at FROM jobs WHERE status = ?", (JOB_QUEUED,)
+            ).fetchone()
+        if row is None or row["next_run_at"] is None:
+            return None
+        return max(0.0, row["next_run_at"] - time.time())
+
+    def update(self, job_id: str, **fields: Any) -> bool:
+        """
+        Update a job claimed by this store.
+
+        Returns:
+            False if the job is no longer running under this store's claim,
+            e.g. after its lease expired and it was requeued
+        """
+        for column in ("payload", "progress", "result"):
+            if column in fields and fields[column] is not None:
+                fields[column] = json.dumps(fields[column])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND owner = ? AND status = ?",
+                (*fields.values(), job_id, self.owner, JOB_RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def renew_leases(self, job_ids: Iterable[str]) -> None:
+        """Extend the leases of running jobs claimed by this store."""
+        expires_at = time.time() + self.lease_seconds
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                [(expires_at, job_id, self.owner, JOB_RUNNING) for job_id in job_ids],
+            )
+
+    def requeue_expired(self) -> int:
+        """Put running jobs whose lease has expired back on the queue."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                UPDATE jobs SET status = ?, next_run_at = ?, updated_at = ?
+                WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                """,
+                (JOB_QUEUED, now, now, JOB_RUNNING, now),
+            )
+        return cursor.rowcount
+
+    def release(self) -> int:
+        """Put jobs this store still has running back on the queue, for a clean shutdown."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, next_run_at = ?, updated_at = ? WHERE owner = ? AND status = ?",
+                (JOB_QUEUED, now, now, self.owner, JOB_RUNNING),
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Handler signature: (job, report_progress) -> result
+JobHandler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], Awaitable[None]]], Awaitable[Any]]
+
+
+class JobQueue:
+    """
+    Pool of async workers that run jobs from a ``JobStore``.
+
+    A handler that raises is retried with exponential backoff and jitter up
+    to ``max_attempts`` times; it can raise ``RetryableJobError`` with a
+    partial result to keep progress visible between attempts. Progress
+    updates are persisted and pushed to subscribers (used for SSE).
+
+    Leases of running jobs are renewed every ``lease_seconds / 3``, and jobs
+    whose lease expired in any process sharing the store are requeued. A
+    failing store call is logged and retried after ``error_backoff``
+    seconds rather than ending the worker.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: JobHandler,
+        workers: int = 2,
+        max_attempts: int = 3,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0,
+        error_backoff: float = 1.0,
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.error_backoff = error_backoff
+
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._running: Set[str] = set()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._keep_leases(), name="job-leases"))
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs cancelled mid-run go back on the queue for any process to pick up
+        try:
+            released = await asyncio.to_thread(self.store.release)
+            if released:
+                logger.info(f"Released {released} unfinished workflow jobs")
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release workflow jobs, they are requeued when their lease expires: {str(e)}")
+        logger.info("Job queue stopped")
+
+    async def submit(
+        self, kind: str, payload: Dict[str, Any], idempotency_key: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        job, created = await asyncio.to_thread(self.store.create, kind, payload, idempotency_key)
+        if created:
+            self._wakeup.set()
+        return job, created
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def runs_locally(self, job_id: str) -> bool:
+        """Whether this process is running the job, so its updates reach ``subscribe`` queues."""
+        return job_id in self._running
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        self._subscribers[job_id].add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job_id: str, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers.get(job_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumers only need the latest state
+                pass
+
+    async def _update(self, job_id: str, **fields: Any) -> None:
+        if not await asyncio.to_thread(self.store.update, job_id, **dict(fields)):
+            logger.warning(f"Workflow job {job_id} is no longer claimed by this process, dropping update")
+            return
+        # Results can be large; subscribers fetch them from the job once it finishes
+        event = {key: value for key, value in fields.items() if key != "result"}
+        self._publish(job_id, {"id": job_id, **event})
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _keep_leases(self) -> None:
+        while True:
+            try:
+                if self._running:
+                    await asyncio.to_thread(self.store.renew_leases, list(self._running))
+                requeued = await asyncio.to_thread(self.store.requeue_expired)
+                if requeued:
+                    logger.info(f"Requeued {requeued} workflow jobs with expired leases")
+                    self._wakeup.set()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew workflow job leases: {str(e)}")
+            await asyncio.sleep(self.store.lease_seconds / 3)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                # Clear before claiming so a submit during the claim still wakes us
+                self._wakeup.clear()
+                job = await asyncio.to_thread(self.store.claim_next)
+                if job is None:
+                    delay = await asyncio.to_thread(self.store.next_run_delay)
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay or 5.0, 5.0))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self._running.add(job["id"])
+                try:
+                    await self._run(job)
+                finally:
+                    # An unfinished job's lease then runs out and the job is requeued
+                    self._running.discard(job["id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Workflow job worker error, retrying in {self.error_backoff:.1f}s: {str(e)}")
+                await asyncio.sleep(self.error_backoff)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        self._publish(job_id, {"id": job_id, "status": JOB_RUNNING, "attempts": job["attempts"]})
+
+        async def report_progress(progress: Dict[str, Any]) -> None:
+            await self._update(job_id, progress=progress)
+
+        try:
+            result = await self.handler(job, report_progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            partial = e.result if isinstance(e, RetryableJobError) else None
+            if job["attempts"] < self.max_attempts:
+                delay = self._backoff(job["attempts"])
+                logger.warning(
+                    f"Workflow job {job_id} attempt {job['attempts']} failed, retrying in {delay:.1f}s: {str(e)}"
+                )
+                await self._update(
+                    job_id, status=JOB_QUEUED, error=str(e), result=partial, next_run_at=time.time() + delay
+                )
+                self._wakeup.set()
+            else:
+                logger.error(f"Workflow job {job_id} failed after {job['attempts']} attempts: {str(e)}")
+                await self._update(job_id, status=JOB_FAILED, error=str(e), result=partial)
+            return
+
+        await self._update(job_id, status=JOB_SUCCEEDED, result=result, error=None)
+        logger.info(f"Workflow job {job_id} succeeded")
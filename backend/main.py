@@ -1,45 +1,86 @@
-from typing import Union, Dict, Any, List
-from fastapi import FastAPI, HTTPException, status, Form, Body, File, UploadFile
+from typing import Dict, Any, List, Tuple, Callable, Awaitable
+from fastapi import FastAPI, HTTPException, status, Form, Body, File, UploadFile, Query, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from diffusers import FluxPipeline
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from typing import Optional
 from dotenv import load_dotenv
-import torch
 import uuid
 import os
+import random
+import secrets
+from functools import partial
 import logging
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from datetime import date, datetime, time as clock_time, timezone
 import json
+import time
+import psycopg2
 # Add Alibaba Cloud OSS imports
 import oss2
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
 
-import requests
 import base64
-import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-# Add Alibaba Cloud OCR imports
-from alibabacloud_ocr20191230.client import Client as OcrClient
-from alibabacloud_ocr20191230.models import RecognizePdfRequest
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_tea_util import models as util_models
-from alibabacloud_tea_util.client import Client as UtilClient
+
+from inference import InferenceScheduler, BatchKey, QueueFullError
+from image_cache import ImageCache, image_cache_key
+from image_encoding import (
+    IMAGE_FORMATS,
+    MEDIA_TYPES_BY_EXTENSION,
+    EncodedImage,
+    decode_image,
+    effective_quality,
+    encode_variants,
+    normalize_format,
+    parse_variants,
+)
+from db import AsyncConnection, DatabasePool, DatabaseUnavailableError
+from repository import (
+    TABLES,
+    InvalidCursorError,
+    SearchUnsupportedError,
+    ensure_document_search,
+    existing_plan_ids,
+    fetch_all,
+    fetch_page,
+    insert_rows,
+    plan_document_hashes,
+    search_documents,
+    stream_table,
+    table_versions,
+)
+from table_versions import TableVersion, TableVersionCache, as_utc, combined_etag, etag_matches
+from ingest import IngestItem, IngestLimits, host_of, run_ingestion
+from jobs import JobQueue, JobStore, RetryableJobError, TERMINAL_STATES
+from uploads import RequestSizeLimitMiddleware, UploadTooLargeError, save_upload
+from storage import LocalFileStore, StorageCompactor
+from extraction_cache import ExtractionCache
+from scraper import Scraper, ScrapeCache, create_http_session
+from extractors import ExtractorPool
+from executors import Executors
+from uploader import OssUploader, UploadJournal
+from pdf_pages import PageParallelOcr, RateLimiter, UnreadablePdfError, pypdf_available
+from chunking import chunk_text
+from embeddings import EmbeddingClient, DASHSCOPE_EMBEDDING_ENDPOINT
+from vector_index import VectorIndex
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, MetricsMiddleware, preview
+from model_loader import ModelLoader, STATE_DISABLED, STATE_LOADING, STATE_READY, run_pipeline
+from model_server import RemoteModel, start_model_server
 
 
 load_dotenv()
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 logger = logging.getLogger(__name__)
 
+# Extracted texts and other payloads are cut to this many characters in debug logs
+DEBUG_LOG_MAX_CHARS = int(os.environ.get("DEBUG_LOG_MAX_CHARS", "200"))
+
 # Alibaba Cloud OSS configuration
 ALIBABA_ACCESS_KEY_ID = os.environ.get("ALIBABA_ACCESS_KEY_ID", "")
 ALIBABA_ACCESS_KEY_SECRET = os.environ.get("ALIBABA_ACCESS_KEY_SECRET", "")
@@ -52,6 +93,204 @@ DB_PORT = os.environ.get("DB_PORT", "5432")
 DB_NAME = os.environ.get("DB_NAME", "")
 DB_USER = os.environ.get("DB_USER", "")
 DB_PASSWORD = os.environ.get("DB_PASSWORD", "")
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", "10"))
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+DB_STREAM_BATCH_SIZE = int(os.environ.get("DB_STREAM_BATCH_SIZE", "500"))
+DATA_VERSION_TTL_SECONDS = float(os.environ.get("DATA_VERSION_TTL_SECONDS", "5"))
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", "5000"))
+BULK_INSERT_PAGE_SIZE = int(os.environ.get("BULK_INSERT_PAGE_SIZE", "500"))
+
+# Alibaba Cloud OCR configuration
+ALIBABA_OCR_ENDPOINT = os.environ.get("ALIBABA_OCR_ENDPOINT", "ocr.cn-shanghai.aliyuncs.com")
+ALIBABA_OCR_REGION = os.environ.get("ALIBABA_OCR_REGION", "cn-shanghai")
+
+# Thread pools for blocking SDK calls (OCR, OSS) and local disk/CPU work (image saves)
+EXECUTOR_NETWORK_WORKERS = int(os.environ.get("EXECUTOR_NETWORK_WORKERS", "16"))
+EXECUTOR_DISK_WORKERS = int(os.environ.get("EXECUTOR_DISK_WORKERS", "4"))
+
+# Background OSS uploads, journaled so a restart doesn't lose them
+OSS_UPLOAD_JOURNAL = os.environ.get("OSS_UPLOAD_JOURNAL", "data/oss_uploads.sqlite3")
+OSS_UPLOAD_WORKERS = int(os.environ.get("OSS_UPLOAD_WORKERS", "4"))
+OSS_UPLOAD_MAX_ATTEMPTS = int(os.environ.get("OSS_UPLOAD_MAX_ATTEMPTS", "8"))
+OSS_UPLOAD_RETRY_BACKOFF_SECONDS = float(os.environ.get("OSS_UPLOAD_RETRY_BACKOFF_SECONDS", "2"))
+# Uploads of a process that stops renewing their lease (it died or hung) are requeued after this
+OSS_UPLOAD_LEASE_SECONDS = float(os.environ.get("OSS_UPLOAD_LEASE_SECONDS", "120"))
+OSS_MULTIPART_THRESHOLD_BYTES = int(os.environ.get("OSS_MULTIPART_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
+OSS_MULTIPART_PART_SIZE_BYTES = int(os.environ.get("OSS_MULTIPART_PART_SIZE_BYTES", str(2 * 1024 * 1024)))
+OSS_MULTIPART_THREADS = int(os.environ.get("OSS_MULTIPART_THREADS", "4"))
+
+# Page-parallel PDF extraction; pages with a text layer skip OCR
+PDF_PAGE_OCR_ENABLED = os.environ.get("PDF_PAGE_OCR_ENABLED", "true").lower() == "true"
+PDF_NATIVE_TEXT_MIN_CHARS = int(os.environ.get("PDF_NATIVE_TEXT_MIN_CHARS", "20"))
+OCR_PAGE_CONCURRENCY = int(os.environ.get("OCR_PAGE_CONCURRENCY", "4"))
+OCR_RATE_LIMIT_PER_SECOND = float(os.environ.get("OCR_RATE_LIMIT_PER_SECOND", "2"))
+
+# Per-plan search index over extracted texts, embedded with DashScope
+DASHSCOPE_API_KEY = os.environ.get("DASHSCOPE_API_KEY", "")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-v3")
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", "1024"))
+EMBEDDING_ENDPOINT = os.environ.get("EMBEDDING_ENDPOINT", DASHSCOPE_EMBEDDING_ENDPOINT)
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "10"))
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "50"))
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "data/vector_index")
+
+# Postgres full-text search over the documents table
+# Off by default: the first run adds a column to documents under an exclusive lock
+DOCUMENT_SEARCH_MIGRATE = os.environ.get("DOCUMENT_SEARCH_MIGRATE", "false").lower() == "true"
+SEARCH_TEXT_CONFIG = os.environ.get("SEARCH_TEXT_CONFIG", "english")
+SEARCH_HEADLINE_OPTIONS = os.environ.get(
+    "SEARCH_HEADLINE_OPTIONS", "MaxFragments=2, MinWords=10, MaxWords=30, StartSel=<mark>, StopSel=</mark>"
+)
+
+# Maximum size of a single uploaded PDF
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+# Whole multipart request to upload endpoints, enforced while the body streams in
+UPLOAD_MAX_REQUEST_BYTES = int(os.environ.get("UPLOAD_MAX_REQUEST_BYTES", str(500 * 1024 * 1024)))
+
+# Workflow ingestion limits
+INGEST_MAX_CONCURRENCY = int(os.environ.get("INGEST_MAX_CONCURRENCY", "8"))
+INGEST_PER_HOST_CONCURRENCY = int(os.environ.get("INGEST_PER_HOST_CONCURRENCY", "2"))
+INGEST_ITEM_TIMEOUT_SECONDS = float(os.environ.get("INGEST_ITEM_TIMEOUT_SECONDS", "120"))
+
+# Background workflow jobs
+WORKFLOW_JOBS_DB = os.environ.get("WORKFLOW_JOBS_DB", "data/workflow_jobs.sqlite3")
+WORKFLOW_WORKERS = int(os.environ.get("WORKFLOW_WORKERS", "2"))
+WORKFLOW_MAX_ATTEMPTS = int(os.environ.get("WORKFLOW_MAX_ATTEMPTS", "3"))
+WORKFLOW_RETRY_BACKOFF_SECONDS = float(os.environ.get("WORKFLOW_RETRY_BACKOFF_SECONDS", "5"))
+# How often an event stream re-reads a job run by another API worker, whose updates only reach the store
+WORKFLOW_EVENTS_POLL_SECONDS = float(os.environ.get("WORKFLOW_EVENTS_POLL_SECONDS", "2"))
+# Running jobs of a process that stops renewing their lease (it died or hung) are requeued after this
+WORKFLOW_JOB_LEASE_SECONDS = float(os.environ.get("WORKFLOW_JOB_LEASE_SECONDS", "60"))
+
+# Shared outbound HTTP client used for link scraping
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "8"))
+HTTP_DNS_CACHE_TTL_SECONDS = int(os.environ.get("HTTP_DNS_CACHE_TTL_SECONDS", "300"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "30"))
+
+# Scrape cache; pages are revalidated with conditional GETs once no longer fresh
+SCRAPE_CACHE_ENABLED = os.environ.get("SCRAPE_CACHE_ENABLED", "true").lower() == "true"
+SCRAPE_CACHE_DB = os.environ.get("SCRAPE_CACHE_DB", "data/scrape_cache.sqlite3")
+SCRAPE_CACHE_MAX_ENTRIES = int(os.environ.get("SCRAPE_CACHE_MAX_ENTRIES", "5000"))
+SCRAPE_CACHE_FRESH_SECONDS = float(os.environ.get("SCRAPE_CACHE_FRESH_SECONDS", "300"))
+SCRAPE_MAX_RESPONSE_BYTES = int(os.environ.get("SCRAPE_MAX_RESPONSE_BYTES", str(10 * 1024 * 1024)))
+
+# HTML-to-text extraction for scraped pages: "stream", "lxml" or "legacy" (BeautifulSoup)
+HTML_EXTRACTOR = os.environ.get("HTML_EXTRACTOR", "stream")
+HTML_STRIP_BOILERPLATE = os.environ.get("HTML_STRIP_BOILERPLATE", "true").lower() == "true"
+HTML_EXTRACT_WORKERS = int(os.environ.get("HTML_EXTRACT_WORKERS", "2"))
+
+# PDF extraction cache keyed by content hash
+EXTRACTION_CACHE_ENABLED = os.environ.get("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_DB = os.environ.get("EXTRACTION_CACHE_DB", "data/extraction_cache.sqlite3")
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", "10000"))
+EXTRACTION_CACHE_MAX_AGE_SECONDS = float(os.environ.get("EXTRACTION_CACHE_MAX_AGE_SECONDS", str(90 * 24 * 3600)))
+
+# Image generation scheduler configuration
+IMAGE_BATCH_MAX_SIZE = int(os.environ.get("IMAGE_BATCH_MAX_SIZE", "4"))
+IMAGE_BATCH_MAX_WAIT_MS = float(os.environ.get("IMAGE_BATCH_MAX_WAIT_MS", "50"))
+IMAGE_QUEUE_MAX_DEPTH = int(os.environ.get("IMAGE_QUEUE_MAX_DEPTH", "32"))
+
+# Uploaded PDFs are kept locally as a bounded cache; OSS holds the originals
+PDF_STORE_DIR = os.environ.get("PDF_STORE_DIR", "uploaded_pdfs")
+PDF_STORE_INDEX = os.environ.get("PDF_STORE_INDEX", "data/pdf_store.sqlite3")
+PDF_STORE_MAX_BYTES = int(os.environ.get("PDF_STORE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+PDF_STORE_MAX_AGE_SECONDS = float(os.environ.get("PDF_STORE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+PDF_OBJECT_PREFIX = os.environ.get("PDF_OBJECT_PREFIX", "uploaded_pdfs/")
+# Images written to generated_images/ by earlier versions; not all of them reached OSS,
+# so they are only swept past this age when it is set (0 keeps them)
+LEGACY_IMAGES_DIR = os.environ.get("LEGACY_IMAGES_DIR", "generated_images")
+LEGACY_IMAGES_MAX_AGE_SECONDS = float(os.environ.get("LEGACY_IMAGES_MAX_AGE_SECONDS", "0"))
+# Background compaction applying the quotas and TTLs of the local stores
+STORAGE_COMPACTION_INTERVAL_SECONDS = float(os.environ.get("STORAGE_COMPACTION_INTERVAL_SECONDS", "600"))
+STORAGE_COMPACTION_BATCH_SIZE = int(os.environ.get("STORAGE_COMPACTION_BATCH_SIZE", "100"))
+STORAGE_COMPACTION_PAUSE_SECONDS = float(os.environ.get("STORAGE_COMPACTION_PAUSE_SECONDS", "0.5"))
+
+# Content-addressed cache for seeded image generation
+IMAGE_CACHE_ENABLED = os.environ.get("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+IMAGE_CACHE_MAX_AGE_SECONDS = float(os.environ.get("IMAGE_CACHE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+IMAGE_CACHE_OSS_TIER = os.environ.get("IMAGE_CACHE_OSS_TIER", "true").lower() == "true"
+
+# Encoding of generated images; clients can override format and quality per request
+IMAGE_DEFAULT_FORMAT = normalize_format(os.environ.get("IMAGE_DEFAULT_FORMAT", "png"))
+IMAGE_DEFAULT_QUALITY = int(os.environ.get("IMAGE_DEFAULT_QUALITY", "90"))
+# Downscaled variants encoded alongside each image, as name:longest edge in pixels
+IMAGE_VARIANTS = parse_variants(os.environ.get("IMAGE_VARIANTS", "thumb:256,preview:768"))
+
+# FluxPipeline model loading
+IMAGE_MODEL_ENABLED = os.environ.get("IMAGE_MODEL_ENABLED", "true").lower() == "true"
+FLUX_MODEL_ID = os.environ.get("FLUX_MODEL_ID", "black-forest-labs/FLUX.1-schnell")
+FLUX_TORCH_DTYPE = os.environ.get("FLUX_TORCH_DTYPE", "bfloat16")
+FLUX_CPU_OFFLOAD = os.environ.get("FLUX_CPU_OFFLOAD", "true").lower() == "true"
+FLUX_ATTENTION_SLICING = os.environ.get("FLUX_ATTENTION_SLICING", "false").lower() == "true"
+FLUX_WARMUP = os.environ.get("FLUX_WARMUP", "true").lower() == "true"
+# Prompt embeddings cached in CPU memory per model copy, so repeated prompts skip the text encoders
+PROMPT_CACHE_MAX_BYTES = int(os.environ.get("PROMPT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Where the model runs: "local" loads it in this process; "process" uses a model
+# server so several API workers share one loaded copy per model process
+MODEL_SERVER_MODE = os.environ.get("MODEL_SERVER_MODE", "local").lower()
+MODEL_SERVER_SOCKET = os.environ.get("MODEL_SERVER_SOCKET", "/tmp/aplus-model-server.sock")
+# Generated per launch by python main.py when empty; must be set when the model server is started separately
+MODEL_SERVER_AUTHKEY = os.environ.get("MODEL_SERVER_AUTHKEY", "")
+MODEL_SERVER_PROCESSES = int(os.environ.get("MODEL_SERVER_PROCESSES", "1"))
+MODEL_SERVER_AUTOSTART = os.environ.get("MODEL_SERVER_AUTOSTART", "true").lower() == "true"
+MODEL_SERVER_TIMEOUT_SECONDS = float(os.environ.get("MODEL_SERVER_TIMEOUT_SECONDS", "600"))
+API_WORKERS = int(os.environ.get("API_WORKERS", "1"))
+
+
+def model_loader_kwargs() -> Dict[str, Any]:
+    """FluxPipeline loading options, shared by the local loader and model server workers."""
+    return {
+        "model_id": FLUX_MODEL_ID,
+        "torch_dtype": FLUX_TORCH_DTYPE,
+        "cpu_offload": FLUX_CPU_OFFLOAD,
+        "attention_slicing": FLUX_ATTENTION_SLICING,
+        "warmup": FLUX_WARMUP,
+        "enabled": IMAGE_MODEL_ENABLED,
+        "prompt_cache_max_bytes": PROMPT_CACHE_MAX_BYTES,
+    }
+
+
+def run_flux_batch(key: BatchKey, prompts: List[str], seeds: List[int]) -> List[Any]:
+    """
+    Run one batched FluxPipeline call. Blocking; called from the scheduler's worker thread.
+
+    Args:
+        key: Pipeline parameters shared by every prompt in the batch
+        prompts: Prompts to generate, one image each
+        seeds: Per-prompt seeds, so batching does not change each caller's output
+
+    Returns:
+        The generated images in prompt order
+    """
+    metrics = app.state.metrics
+    step_started = time.perf_counter()
+    
+    def on_step_end(pipeline, step, timestep, callback_kwargs):
+        nonlocal step_started
+        now = time.perf_counter()
+        metrics.observe_stage("diffusion_step", now - step_started)
+        step_started = now
+        return callback_kwargs
+    
+    with metrics.span("diffusion"):
+        return run_pipeline(
+            app.state.model_loader.pipeline,
+            prompts,
+            seeds,
+            key.guidance_scale,
+            key.num_inference_steps,
+            key.max_sequence_length,
+            on_step_end,
+            app.state.model_loader.prompt_cache
+        )
 
 # Define lifespan context manager
 @asynccontextmanager
@@ -60,6 +299,9 @@ async def lifespan(app: FastAPI):
     port = os.environ.get("BACKEND_PORT", "8000")
     logger.info(f"Starting API server on port {port}")
     
+    # Request and stage timings, exported on /metrics
+    app.state.metrics = Metrics()
+    
     # Initialize OSS client
     if ALIBABA_ACCESS_KEY_ID and ALIBABA_ACCESS_KEY_SECRET and ALIBABA_OSS_ENDPOINT:
         auth = oss2.Auth(ALIBABA_ACCESS_KEY_ID, ALIBABA_ACCESS_KEY_SECRET)
@@ -69,28 +311,267 @@ async def lifespan(app: FastAPI):
         app.state.bucket = None
         logger.warning("Alibaba Cloud OSS credentials not found, storage functionality will be disabled")
     
-    # Initialize database connection
-    try:
-        app.state.db_conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
+    # Blocking calls run on these pools instead of the event loop
+    app.state.executors = Executors(
+        network_workers=EXECUTOR_NETWORK_WORKERS,
+        disk_workers=EXECUTOR_DISK_WORKERS,
+    )
+    
+    # Write-behind OSS uploads; pending ones from a previous run resume here
+    if app.state.bucket:
+        app.state.uploader = OssUploader(
+            app.state.bucket,
+            UploadJournal(OSS_UPLOAD_JOURNAL, lease_seconds=OSS_UPLOAD_LEASE_SECONDS),
+            f"https://{ALIBABA_OSS_BUCKET}.{ALIBABA_OSS_ENDPOINT}",
+            app.state.metrics.timed("oss_put", app.state.executors.network.run),
+            workers=OSS_UPLOAD_WORKERS,
+            max_attempts=OSS_UPLOAD_MAX_ATTEMPTS,
+            backoff_base=OSS_UPLOAD_RETRY_BACKOFF_SECONDS,
+            multipart_threshold=OSS_MULTIPART_THRESHOLD_BYTES,
+            part_size=OSS_MULTIPART_PART_SIZE_BYTES,
+            num_threads=OSS_MULTIPART_THREADS,
+            checkpoint_dir=os.path.dirname(OSS_UPLOAD_JOURNAL) or ".",
         )
+        await app.state.uploader.start()
+    else:
+        app.state.uploader = None
+    
+    # Initialize the database connection pool
+    app.state.db = DatabasePool(
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+        health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+        observer=app.state.metrics.observe_stage,
+        host=DB_HOST,
+        port=DB_PORT,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        connect_timeout=DB_CONNECT_TIMEOUT
+    )
+    try:
+        await app.state.db.open()
         logger.info("Database connection established")
     except Exception as e:
-        app.state.db_conn = None
+        # The pool keeps retrying on demand, so endpoints recover once the database is reachable
         logger.error(f"Failed to connect to database: {str(e)}")
         # Print more detailed connection information for debugging
         logger.error(f"Connection details: host={DB_HOST}, port={DB_PORT}, dbname={DB_NAME}, user={DB_USER}")
     
+    # Add the documents full-text column and GIN index if missing; Postgres maintains them from then on
+    if DOCUMENT_SEARCH_MIGRATE:
+        try:
+            async with app.state.db.transaction() as conn:
+                created = await ensure_document_search(conn, SEARCH_TEXT_CONFIG)
+            if created:
+                logger.info(f"Document full-text search set up (created {', '.join(created)})")
+            else:
+                logger.info("Document full-text search index is in place")
+        except SearchUnsupportedError as e:
+            logger.warning(f"Document full-text search is not supported by this database, lexical search is disabled: {str(e)}")
+        except Exception as e:
+            logger.error(f"Could not set up document full-text search: {str(e)}")
+    
+    # Concurrency limits for /trigger-workflow ingestion
+    app.state.ingest_limits = IngestLimits(
+        max_concurrency=INGEST_MAX_CONCURRENCY,
+        per_host_concurrency=INGEST_PER_HOST_CONCURRENCY,
+        item_timeout=INGEST_ITEM_TIMEOUT_SECONDS,
+    )
+    
+    # One HTTP session for the app's lifetime, so scrapes reuse connections and DNS lookups
+    app.state.http_session = create_http_session(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        dns_cache_ttl=HTTP_DNS_CACHE_TTL_SECONDS,
+        timeout=HTTP_TIMEOUT_SECONDS,
+    )
+    # Pages are parsed in worker processes so large ones don't stall the event loop
+    app.state.html_extractor = ExtractorPool(
+        HTML_EXTRACTOR,
+        strip_boilerplate=HTML_STRIP_BOILERPLATE,
+        workers=HTML_EXTRACT_WORKERS,
+    )
+    app.state.scraper = Scraper(
+        app.state.http_session,
+        app.state.metrics.timed("parse", app.state.html_extractor.extract),
+        cache=ScrapeCache(SCRAPE_CACHE_DB, max_entries=SCRAPE_CACHE_MAX_ENTRIES) if SCRAPE_CACHE_ENABLED else None,
+        max_bytes=SCRAPE_MAX_RESPONSE_BYTES,
+        fresh_seconds=SCRAPE_CACHE_FRESH_SECONDS,
+    )
+    
+    # Plan search index; texts are only embedded when an API key is configured
+    app.state.vector_index = VectorIndex(VECTOR_INDEX_DIR, EMBEDDING_DIMENSIONS)
+    if DASHSCOPE_API_KEY:
+        app.state.embedding_client = EmbeddingClient(
+            app.state.http_session,
+            DASHSCOPE_API_KEY,
+            model=EMBEDDING_MODEL,
+            dimensions=EMBEDDING_DIMENSIONS,
+            endpoint=EMBEDDING_ENDPOINT,
+            batch_size=EMBEDDING_BATCH_SIZE,
+        )
+    else:
+        app.state.embedding_client = None
+        logger.warning("DASHSCOPE_API_KEY not found, plan search indexing will be disabled")
+    
+    # Cache of PDF extractions so repeated uploads skip OCR
+    if EXTRACTION_CACHE_ENABLED:
+        app.state.extraction_cache = ExtractionCache(
+            EXTRACTION_CACHE_DB,
+            max_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+            max_age_seconds=EXTRACTION_CACHE_MAX_AGE_SECONDS,
+        )
+    else:
+        app.state.extraction_cache = None
+    
+    # Page-wise PDF extraction, with OCR calls limited across all documents
+    if PDF_PAGE_OCR_ENABLED and pypdf_available():
+        app.state.page_ocr = PageParallelOcr(
+            lambda page_path: recognize_pdf_file(page_path, get_ocr_client()),
+            app.state.executors.disk.run,
+            RateLimiter(OCR_RATE_LIMIT_PER_SECOND, burst=OCR_PAGE_CONCURRENCY),
+            max_concurrency=OCR_PAGE_CONCURRENCY,
+            min_native_chars=PDF_NATIVE_TEXT_MIN_CHARS,
+            page_cache=app.state.extraction_cache,
+        )
+    else:
+        if PDF_PAGE_OCR_ENABLED:
+            logger.warning("pypdf is not installed, PDFs will be sent to OCR whole")
+        app.state.page_ocr = None
+    
+    # Start the workflow job workers; jobs whose process died are requeued once their lease expires
+    app.state.job_queue = JobQueue(
+        JobStore(WORKFLOW_JOBS_DB, lease_seconds=WORKFLOW_JOB_LEASE_SECONDS),
+        run_workflow_job,
+        workers=WORKFLOW_WORKERS,
+        max_attempts=WORKFLOW_MAX_ATTEMPTS,
+        backoff_base=WORKFLOW_RETRY_BACKOFF_SECONDS,
+    )
+    await app.state.job_queue.start()
+    
+    # Row counts and latest versions behind /get-all-data's ETag, invalidated on writes
+    app.state.table_versions = TableVersionCache(ttl_seconds=DATA_VERSION_TTL_SECONDS)
+    
+    # Initialize the image cache, with OSS as a second tier when available
+    if IMAGE_CACHE_ENABLED:
+        app.state.image_cache = ImageCache(
+            IMAGE_CACHE_DIR,
+            max_bytes=IMAGE_CACHE_MAX_BYTES,
+            max_age_seconds=IMAGE_CACHE_MAX_AGE_SECONDS,
+            bucket=app.state.bucket,
+            oss_tier=IMAGE_CACHE_OSS_TIER,
+        )
+    else:
+        app.state.image_cache = None
+    
+    # Remember which cached images have reached OSS so they aren't queued again
+    if app.state.image_cache is not None and app.state.uploader is not None:
+        image_cache = app.state.image_cache
+        app.state.uploader.add_listener(
+            lambda object_path: (
+                os.path.splitext(object_path)[1][1:] in MEDIA_TYPES_BY_EXTENSION
+                and image_cache.mark_uploaded(object_path)
+            )
+        )
+    
+    # Uploaded PDFs live in a sharded local store; once confirmed in OSS they may be evicted
+    oss_bucket = app.state.bucket if app.state.uploader is not None else None
+    # Files the store adopts (legacy uploads, crash leftovers) are queued for OSS like new uploads
+    upload_adopted = None
+    if app.state.uploader is not None:
+        upload_adopted = partial(app.state.uploader.journal.add, skip_existing=True)
+    app.state.pdf_store = LocalFileStore(
+        "uploaded_pdfs",
+        PDF_STORE_DIR,
+        PDF_STORE_INDEX,
+        max_bytes=PDF_STORE_MAX_BYTES,
+        max_age_seconds=PDF_STORE_MAX_AGE_SECONDS,
+        bucket=oss_bucket,
+        object_prefix=PDF_OBJECT_PREFIX,
+        upload=upload_adopted,
+    )
+    if app.state.uploader is not None:
+        pdf_store = app.state.pdf_store
+        app.state.uploader.add_listener(
+            lambda object_path: object_path.startswith(PDF_OBJECT_PREFIX) and pdf_store.mark_uploaded(object_path)
+        )
+    
+    # Apply quotas and TTLs in the background, in small batches on the disk pool
+    stores = [app.state.pdf_store]
+    if app.state.image_cache is not None:
+        stores.append(app.state.image_cache)
+    if LEGACY_IMAGES_MAX_AGE_SECONDS > 0 and os.path.isdir(LEGACY_IMAGES_DIR):
+        # Opt-in: nothing new is written here, and files are deleted past the TTL without an OSS check
+        stores.append(LocalFileStore(
+            "generated_images",
+            LEGACY_IMAGES_DIR,
+            os.path.join(os.path.dirname(PDF_STORE_INDEX), "generated_images.sqlite3"),
+            max_bytes=0,
+            max_age_seconds=LEGACY_IMAGES_MAX_AGE_SECONDS,
+        ))
+    app.state.storage_compactor = StorageCompactor(
+        stores,
+        app.state.executors.disk.run,
+        interval_seconds=STORAGE_COMPACTION_INTERVAL_SECONDS,
+        batch_size=STORAGE_COMPACTION_BATCH_SIZE,
+        pause_seconds=STORAGE_COMPACTION_PAUSE_SECONDS,
+        # Stores indexed in SQLite are compacted by one API worker at a time
+        lock_dir=os.path.dirname(PDF_STORE_INDEX) or ".",
+    )
+    await app.state.storage_compactor.start()
+    
+    if MODEL_SERVER_MODE == "process":
+        if not MODEL_SERVER_AUTHKEY:
+            raise RuntimeError("MODEL_SERVER_AUTHKEY must be set when MODEL_SERVER_MODE=process")
+        # The model lives in the model server; batches are sent there and images come back in shared memory
+        app.state.model_loader = RemoteModel(
+            MODEL_SERVER_SOCKET,
+            MODEL_SERVER_AUTHKEY.encode(),
+            timeout=MODEL_SERVER_TIMEOUT_SECONDS,
+            observe=app.state.metrics.observe_stage,
+        )
+        run_batch = app.state.model_loader.run_batch
+    else:
+        # Load the FluxPipeline model in the background so startup isn't blocked
+        app.state.model_loader = ModelLoader(**model_loader_kwargs())
+        run_batch = run_flux_batch
+    app.state.model_loader.start()
+    
+    # Start the image generation scheduler
+    app.state.inference_scheduler = InferenceScheduler(
+        run_batch,
+        max_batch_size=IMAGE_BATCH_MAX_SIZE,
+        max_wait_ms=IMAGE_BATCH_MAX_WAIT_MS,
+        max_queue_depth=IMAGE_QUEUE_MAX_DEPTH,
+    )
+    await app.state.inference_scheduler.start()
+    
+    register_gauges(app.state.metrics)
+    
     yield
     
     # Shutdown code
-    if hasattr(app.state, 'db_conn') and app.state.db_conn:
-        app.state.db_conn.close()
-        logger.info("Database connection closed")
+    await app.state.job_queue.stop()
+    app.state.job_queue.store.close()
+    await app.state.storage_compactor.stop()
+    for store in app.state.storage_compactor.stores:
+        if isinstance(store, LocalFileStore):
+            store.close()
+    if app.state.extraction_cache is not None:
+        app.state.extraction_cache.close()
+    app.state.scraper.close()
+    await app.state.http_session.close()
+    app.state.html_extractor.close()
+    await app.state.inference_scheduler.stop()
+    await app.state.model_loader.stop()
+    
+    await app.state.db.close()
+    if app.state.uploader is not None:
+        await app.state.uploader.stop()
+        app.state.uploader.close()
+    app.state.executors.shutdown()
     
     logger.info("Shutting down API server")
 
@@ -111,10 +592,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Bound upload bodies before Starlette spools them to disk
+app.add_middleware(RequestSizeLimitMiddleware, max_bytes=UPLOAD_MAX_REQUEST_BYTES, paths=["/trigger-workflow"])
+
+# Time every request by route
+app.add_middleware(MetricsMiddleware)
+
 # Response model for image generation
 class ImageGenerationResponse(BaseModel):
-    local_path: str
+    local_path: Optional[str] = None
     storage_url: Optional[str] = None
+    variant_urls: Dict[str, str] = {}
     space_id: Optional[str] = None
 
 
@@ -134,16 +622,38 @@ def health_check() -> Dict[str, str]:
     return {"status": "healthy"}
 
 
+@app.get("/ready", tags=["health"])
+def readiness_check() -> JSONResponse:
+    """
+    Readiness endpoint reporting whether the image model is loading, ready or failed.
+    
+    Returns 503 until the model is ready, unless image generation is disabled.
+    """
+    model_status = app.state.model_loader.status()
+    is_ready = model_status["state"] in (STATE_READY, STATE_DISABLED)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if is_ready else "not_ready", "model": model_status}
+    )
+
+
 @app.post("/generate-image", tags=["image-generation"], response_model=ImageGenerationResponse)
 async def generate_image(prompt: str = Form(...), 
                         guidance_scale: float = Form(0.0),
                         num_inference_steps: int = Form(4),
                         max_sequence_length: int = Form(256),
                         seed: Optional[int] = Form(None),
-                        space_id: Optional[str] = Form(None)):
+                        space_id: Optional[str] = Form(None),
+                        image_format: str = Form(IMAGE_DEFAULT_FORMAT, alias="format"),
+                        quality: int = Form(IMAGE_DEFAULT_QUALITY)):
     """
     Generate an image using the FluxPipeline based on the provided prompt.
     
+    The image is encoded once in memory, together with its downscaled
+    variants (IMAGE_VARIANTS); the same bytes are returned in the response
+    and uploaded to OSS. Variant URLs are returned in X-Variant-<Name>-URL
+    headers.
+    
     Args:
         prompt: The text prompt to generate an image from
         guidance_scale: Guidance scale for the generation (default: 0.0)
@@ -151,73 +661,108 @@ async def generate_image(prompt: str = Form(...),
         max_sequence_length: Maximum sequence length (default: 256)
         seed: Random seed for reproducibility (optional)
         space_id: ID of the space to store the image in (optional)
+        image_format: Output format, png (default), webp or jpeg (form field "format")
+        quality: Encoding quality from 1 to 100, ignored for png
         
     Returns:
         The generated image along with storage information
     """
-    global flux_pipeline
+    try:
+        image_format = normalize_format(image_format)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    quality = effective_quality(image_format, quality)
+    _, media_type, extension = IMAGE_FORMATS[image_format]
+    
+    # Seeded requests are deterministic and can be served from the image cache
+    cache_key = None
+    if seed is not None and app.state.image_cache is not None:
+        cache_key = image_cache_key(
+            prompt, guidance_scale, num_inference_steps, max_sequence_length, seed, image_format, quality
+        )
+        object_path = image_object_path(space_id, cache_key, extension)
+        
+        cached_path = await app.state.executors.disk.run(
+            app.state.image_cache.get,
+            cache_key,
+            object_path
+        )
+        if cached_path:
+            data = await app.state.executors.disk.run(read_file_bytes, cached_path)
+            storage_urls = await upload_cached_image(object_path, data, image_format, quality)
+            return Response(
+                data,
+                media_type=media_type,
+                headers={**storage_headers(storage_urls), "X-Cache": "HIT"}
+            )
     
-    if flux_pipeline is None:
+    model_loader = app.state.model_loader
+    if not model_loader.ready:
+        detail = f"FluxPipeline model is not available (state: {model_loader.state})"
+        if model_loader.error:
+            detail += f": {model_loader.error}"
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="FluxPipeline model is not available"
+            detail=detail,
+            headers={"Retry-After": "10"} if model_loader.state == STATE_LOADING else None
+        )
+    
+    # Use the provided seed or a random one
+    if seed is None:
+        seed = random.randint(0, 2**32 - 1)
+    
+    try:
+        # Wait for the scheduler to run this prompt, possibly batched with others
+        with app.state.metrics.span("inference"):
+            image = await app.state.inference_scheduler.submit(
+                prompt,
+                seed,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                max_sequence_length=max_sequence_length
+            )
+    except QueueFullError as e:
+        logger.warning(f"Rejecting image request: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Image generation queue is full, please retry later",
+            headers={"Retry-After": "1"}
+        )
+    except Exception as e:
+        logger.error(f"Error generating image: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to generate image: {str(e)}"
         )
     
     try:
-        # Create a generator with the provided seed or a random one
-        if seed is not None:
-            generator = torch.Generator("cpu").manual_seed(seed)
+        # Encode the image and its variants once, off the event loop
+        with app.state.metrics.span("image_encode"):
+            encoded = await app.state.executors.disk.run(
+                encode_variants, image, image_format, quality, IMAGE_VARIANTS
+            )
+        
+        if cache_key:
+            # Store under the content-addressed key; the OSS object name is derived from it too
+            with app.state.metrics.span("image_save"):
+                await app.state.executors.disk.run(
+                    app.state.image_cache.put, cache_key, encoded["full"].data, extension
+                )
+            storage_urls = await upload_image_variants(object_path, encoded, skip_existing=True)
         else:
-            generator = torch.Generator("cpu").manual_seed(torch.randint(0, 2**32 - 1, (1,)).item())
-        
-        # Generate the image
-        image = flux_pipeline(
-            prompt,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-            max_sequence_length=max_sequence_length,
-            generator=generator
-        ).images[0]
-        
-        # Create unique filename and save locally
-        image_id = str(uuid.uuid4())
-        image_filename = f"{image_id}.png"
-        
-        # Create local path structure
-        os.makedirs("generated_images", exist_ok=True)
-        local_filepath = f"generated_images/{image_filename}"
-        image.save(local_filepath)
-        
-        storage_url = None
-        
-        # Upload to Alibaba Cloud OSS if available
-        if app.state.bucket:
-            try:
-                # Determine object path based on space_id
-                object_path = f"{space_id}/{image_filename}" if space_id else image_filename
-                
-                # Upload the object
-                app.state.bucket.put_object_from_file(object_path, local_filepath)
-                
-                # Construct the URL for the uploaded object
-                storage_url = f"https://{ALIBABA_OSS_BUCKET}.{ALIBABA_OSS_ENDPOINT}/{object_path}"
-                logger.info(f"Image uploaded to Alibaba Cloud OSS: {storage_url}")
-            except Exception as storage_error:
-                logger.error(f"Error uploading to storage: {str(storage_error)}")
-                # Continue execution even if storage upload fails
-        
-        # Create response with file and storage information
-        response = ImageGenerationResponse(
-            local_path=local_filepath,
-            storage_url=storage_url,
-            space_id=space_id
-        )
-        
-        # Return the FileResponse with additional headers
-        return FileResponse(
-            local_filepath, 
-            media_type="image/png",
-            headers={"X-Storage-URL": storage_url or ""}
+            # Name the objects uniquely; the URLs are known before the uploads finish
+            object_path = image_object_path(space_id, str(uuid.uuid4()), extension)
+            storage_urls = await upload_image_variants(object_path, encoded)
+        
+        headers = storage_headers(storage_urls)
+        if cache_key:
+            headers["X-Cache"] = "MISS"
+        
+        # Return the encoded bytes with the storage information in headers
+        return Response(
+            encoded["full"].data,
+            media_type=media_type,
+            headers=headers
         )
     
     except Exception as e:
@@ -228,10 +773,289 @@ async def generate_image(prompt: str = Form(...),
         )
 
 
+def image_object_path(space_id: Optional[str], name: str, extension: str) -> str:
+    """Build the OSS object name of a generated image."""
+    return f"{space_id}/{name}.{extension}" if space_id else f"{name}.{extension}"
+
+
+def variant_object_path(object_path: str, variant: str) -> str:
+    """Object name of ``variant`` next to the full-size image at ``object_path``."""
+    stem, extension = os.path.splitext(object_path)
+    return f"{stem}_{variant}{extension}"
+
+
+def read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def storage_headers(storage_urls: Dict[str, str]) -> Dict[str, str]:
+    """
+    Response headers carrying the OSS URLs of an image and its variants.
+    """
+    headers = {"X-Storage-URL": storage_urls.get("full", "")}
+    for variant, url in storage_urls.items():
+        if variant != "full":
+            headers[f"X-Variant-{variant.capitalize()}-URL"] = url
+    return headers
+
+
+async def upload_image_variants(
+    object_path: str,
+    encoded: Dict[str, EncodedImage],
+    skip_existing: bool = False
+) -> Dict[str, str]:
+    """
+    Queue an encoded image and its variants for upload to OSS.
+    
+    Args:
+        object_path: OSS object name of the full-size image
+        encoded: Variant name -> encoded image, as returned by ``encode_variants``
+        skip_existing: Skip objects already in OSS (content-addressed names)
+        
+    Returns:
+        Variant name -> OSS URL, empty if storage is unavailable
+    """
+    if app.state.uploader is None:
+        return {}
+    
+    storage_urls = {}
+    for variant, image in encoded.items():
+        path = object_path if variant == "full" else variant_object_path(object_path, variant)
+        storage_urls[variant] = await app.state.uploader.enqueue_bytes(path, image.data, skip_existing)
+    return storage_urls
+
+
+async def upload_cached_image(
+    object_path: str,
+    data: bytes,
+    image_format: str,
+    quality: Optional[int]
+) -> Dict[str, str]:
+    """
+    Queue a cached image and its variants for upload to OSS unless they are already there.
+    
+    Args:
+        object_path: Content-addressed OSS object name
+        data: Encoded bytes of the cached image
+        image_format: Format the image was encoded in
+        quality: Quality the image was encoded with
+        
+    Returns:
+        Variant name -> OSS URL, empty if storage is unavailable
+    """
+    if app.state.uploader is None:
+        return {}
+    
+    if not app.state.image_cache.needs_upload(object_path):
+        # Variants are always uploaded together with the full-size image
+        storage_urls = {"full": app.state.uploader.url_for(object_path)}
+        for variant in IMAGE_VARIANTS:
+            storage_urls[variant] = app.state.uploader.url_for(variant_object_path(object_path, variant))
+        return storage_urls
+    
+    # Re-derive the variants from the cached image; uploads of objects already in OSS are skipped
+    def encode_cached() -> Dict[str, EncodedImage]:
+        image = decode_image(data)
+        encoded = encode_variants(image, image_format, quality, IMAGE_VARIANTS, include_full=False)
+        _, media_type, extension = IMAGE_FORMATS[image_format]
+        encoded["full"] = EncodedImage(data, media_type, extension, image.width, image.height)
+        return encoded
+    
+    with app.state.metrics.span("image_encode"):
+        encoded = await app.state.executors.disk.run(encode_cached)
+    return await upload_image_variants(object_path, encoded, skip_existing=True)
+
+
+@app.get("/image-cache/stats", tags=["image-generation"])
+def image_cache_stats() -> Dict[str, Any]:
+    """
+    Report image cache hit/miss counters and current size.
+    """
+    if app.state.image_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **app.state.image_cache.stats()}
+
+
+@app.get("/prompt-cache/stats", tags=["image-generation"])
+def prompt_cache_stats() -> Dict[str, Any]:
+    """
+    Report prompt embedding cache hit/miss counters, text encoder time and current size.
+    """
+    stats = app.state.model_loader.status().get("prompt_cache")
+    if stats is None:
+        return {"enabled": False}
+    return {"enabled": True, **stats}
+
+
+@app.get("/uploads/stats", tags=["storage"])
+async def upload_stats() -> Dict[str, Any]:
+    """
+    Report background OSS upload counters and the journal backlog.
+    """
+    if app.state.uploader is None:
+        return {"enabled": False}
+    return {"enabled": True, **await app.state.uploader.stats()}
+
+
+@app.get("/storage/stats", tags=["storage"])
+def storage_stats() -> Dict[str, Any]:
+    """
+    Report the size, quota and eviction counters of the local file stores.
+    """
+    compactor = app.state.storage_compactor
+    return {
+        "stores": {store.name: store.stats() for store in compactor.stores},
+        "compaction": {"passes": compactor.passes, "last_pass": compactor.last_pass}
+    }
+
+
+@app.get("/executors/stats", tags=["health"])
+def executor_stats() -> Dict[str, Any]:
+    """
+    Report queue depth, queue wait and run time of the blocking-call pools.
+    """
+    return app.state.executors.stats()
+
+
+@app.get("/scrape-cache/stats", tags=["workflow"])
+def scrape_cache_stats() -> Dict[str, Any]:
+    """
+    Report scrape cache hits, conditional revalidations and full fetches.
+    """
+    return {"enabled": app.state.scraper.cache is not None, **app.state.scraper.stats()}
+
+
+@app.get("/extraction-cache/stats", tags=["workflow"])
+async def extraction_cache_stats() -> Dict[str, Any]:
+    """
+    Report PDF extraction cache hit/miss counters and entry count, and
+    page-wise extraction counters (text-layer, OCR'd and cached pages, OCR
+    rate limiting) under "pages".
+    """
+    pages = app.state.page_ocr.stats() if app.state.page_ocr is not None else None
+    if app.state.extraction_cache is None:
+        return {"enabled": False, "pages": pages}
+    return {"enabled": True, **await asyncio.to_thread(app.state.extraction_cache.stats), "pages": pages}
+
+
+def register_gauges(metrics: Metrics) -> None:
+    """
+    Export queue depths and pool usage alongside the timing histograms.
+    """
+    executors = app.state.executors
+    metrics.add_gauge(
+        "executor_queued_calls",
+        "Blocking calls waiting for a pool thread.",
+        ("pool",),
+        lambda: {(pool.name,): pool.queued for pool in (executors.network, executors.disk)},
+    )
+    metrics.add_gauge(
+        "executor_running_calls",
+        "Blocking calls running on a pool thread.",
+        ("pool",),
+        lambda: {(pool.name,): pool.running for pool in (executors.network, executors.disk)},
+    )
+    metrics.add_gauge(
+        "db_pool_connections",
+        "Database connections by state.",
+        ("state",),
+        lambda: {(key,): value for key, value in app.state.db.stats().items() if key in ("idle", "in_use")},
+    )
+    metrics.add_gauge(
+        "local_store_bytes",
+        "Bytes held by each local file store.",
+        ("store",),
+        lambda: {(store.name,): store.stats()["bytes"] for store in app.state.storage_compactor.stores},
+    )
+    
+    def prompt_cache_values(*keys: str) -> Dict[Tuple[str, ...], float]:
+        stats = prompt_cache_stats()
+        return {(key,): stats[key] for key in keys} if stats["enabled"] else {}
+    
+    metrics.add_gauge(
+        "prompt_embedding_cache_lookups",
+        "Prompt embedding cache lookups by result, since the model loaded.",
+        ("result",),
+        lambda: prompt_cache_values("hits", "misses"),
+    )
+    metrics.add_gauge(
+        "prompt_embedding_cache_bytes",
+        "Bytes of prompt embeddings held, and the limit.",
+        ("kind",),
+        lambda: prompt_cache_values("bytes", "max_bytes"),
+    )
+    metrics.add_gauge(
+        "pdf_pages_extracted",
+        "PDF pages extracted by source: text layer, OCR or the page cache.",
+        ("source",),
+        lambda: {
+            (source,): app.state.page_ocr.stats()[f"{source}_pages"] for source in ("native", "ocr", "cached")
+        } if app.state.page_ocr is not None else {},
+    )
+    metrics.add_gauge(
+        "inference_queue_depth",
+        "Image generation requests waiting for a batch.",
+        (),
+        lambda: {(): app.state.inference_scheduler.depth},
+    )
+
+
+@app.get("/metrics", tags=["health"])
+def export_metrics() -> Response:
+    """
+    Export request latency and per-stage timing histograms in the Prometheus text format.
+    """
+    return Response(content=app.state.metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 class StudyPlanCreate(BaseModel):
     plan_name: str = Field(..., description="Name of the study plan")
     plan_description: str = Field(None, description="Description of the study plan")
 
+class BulkRow(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    
+    @field_validator("*")
+    @classmethod
+    def reject_nul(cls, value: Any) -> Any:
+        # Postgres text columns can't store NUL characters
+        if isinstance(value, str) and "\x00" in value:
+            raise ValueError("must not contain NUL characters")
+        return value
+
+class PlanRow(BulkRow):
+    name: str = Field(..., min_length=1, description="Name of the study plan")
+    description: Optional[str] = Field(None, description="Description of the study plan")
+
+class DocumentRow(BulkRow):
+    plan_id: int = Field(..., description="ID of the study plan")
+    title: str = Field(..., min_length=1)
+    content: Optional[str] = None
+    metadata: Optional[Dict[str, Any]] = None
+    summary: Optional[str] = None
+    type: Optional[str] = None
+    tag: Optional[str] = None
+    image: Optional[str] = None
+
+class TaskRow(BulkRow):
+    title: str = Field(..., min_length=1)
+    plan_id: int = Field(..., description="ID of the study plan")
+    start_time: Optional[clock_time] = None
+    start_date: Optional[date] = None
+    duration: Optional[int] = Field(None, ge=0, description="Duration in minutes")
+    status: str = "pending"
+
+# Row model validating each entry of a bulk write, per table
+BULK_ROW_MODELS = {"plans": PlanRow, "documents": DocumentRow, "tasks": TaskRow}
+
+class BulkValidationError(Exception):
+    """Raised when rows of a bulk write are invalid and partial writes weren't allowed."""
+    
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
 class WorkflowTrigger(BaseModel):
     plan_id: int = Field(..., description="ID of the study plan")
     links: List[str] = Field(default=[], description="List of links for the workflow")
@@ -248,22 +1072,11 @@ async def create_study_plan(study_plan: StudyPlanCreate):
     Returns:
         The created study plan ID and success message
     """
-    if not hasattr(app.state, 'db_conn') or app.state.db_conn is None:
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Database connection is not available"
-        )
-    
     try:
-        # Create a cursor for database operations
-        cursor = app.state.db_conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Begin transaction
-        app.state.db_conn.autocommit = False
-        
-        try:
+        # Each request gets its own pooled connection and transaction
+        async with app.state.db.transaction() as conn:
             # Insert the study plan into the plans table
-            cursor.execute(
+            created_plan = await conn.fetchone(
                 """
                 INSERT INTO public.plans (name, description)
                 VALUES (%s, %s)
@@ -271,194 +1084,1097 @@ async def create_study_plan(study_plan: StudyPlanCreate):
                 """,
                 (study_plan.plan_name, study_plan.plan_description)
             )
-            
-            # Get the created study plan
-            created_plan = cursor.fetchone()
-            
-            # Commit the transaction
-            app.state.db_conn.commit()
-            
-            return {
-                "status": "success",
-                "message": "Study plan created successfully",
-                "plan": created_plan
-            }
-            
-        except Exception as e:
-            # Rollback in case of error
-            app.state.db_conn.rollback()
-            logger.error(f"Error creating study plan: {str(e)}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to create study plan: {str(e)}"
-            )
-        finally:
-            # Reset autocommit and close cursor
-            app.state.db_conn.autocommit = True
-            cursor.close()
-            
+        app.state.table_versions.invalidate()
+        
+        return {
+            "status": "success",
+            "message": "Study plan created successfully",
+            "plan": created_plan
+        }
+    
+    except DatabaseUnavailableError as e:
+        logger.error(f"Database unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database connection is not available"
+        )
     except Exception as e:
-        logger.error(f"Database error: {str(e)}")
+        logger.error(f"Error creating study plan: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Database error: {str(e)}"
+            detail=f"Failed to create study plan: {str(e)}"
         )
 
+async def fetch_table(
+    table: str,
+    plan_id: Optional[int] = None,
+    updated_since: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """
+    Read the rows of one table, optionally filtered by plan and version, on its own pooled connection.
+    """
+    async with app.state.db.connection() as conn:
+        return await fetch_all(conn, table, plan_id, updated_since)
+
+
+async def load_table_versions(plan_id: Optional[int] = None) -> List[TableVersion]:
+    """
+    Compute the row count and latest version of each data table, scoped to a plan if given.
+    """
+    async with app.state.db.connection() as conn:
+        versions = await table_versions(conn, plan_id)
+    return [TableVersion(table, *versions[table]) for table in TABLES]
+
+
+async def stream_all_data(plan_id: Optional[int] = None):
+    """
+    Yield NDJSON lines for every row of plans, documents and tasks.
+    
+    Rows are read from server-side cursors in batches, so memory stays flat
+    regardless of table size.
+    """
+    async with app.state.db.connection() as conn:
+        for table in TABLES:
+            async for rows in stream_table(conn, table, plan_id, batch_size=DB_STREAM_BATCH_SIZE):
+                yield "".join(
+                    json.dumps({"table": table, "row": row}) + "\n"
+                    for row in jsonable_encoder(rows)
+                )
+
+
 @app.get("/get-all-data", tags=["data"])
-async def get_all_data():
+async def get_all_data(
+    format: str = Query("json", pattern="^(json|ndjson)$", description="Response format: json or ndjson"),
+    plan_id: Optional[int] = Query(None, description="Only return rows belonging to this plan"),
+    updated_since: Optional[datetime] = Query(None, description="Only return rows changed after this timestamp"),
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Retrieve all data from plans, documents, and tasks tables.
     
+    JSON responses carry an ETag derived from each table's row count and
+    latest version within the requested scope; sending it back in
+    If-None-Match returns 304 without reading any rows. Pass the previous response's last_updated_at as
+    updated_since to receive only rows created or updated after it.
+    
+    Args:
+        format: "json" for a single body, "ndjson" to stream one row per line
+        plan_id: Only return rows belonging to this plan (optional)
+        updated_since: Only return rows changed after this timestamp (optional, json only)
+        if_none_match: ETag from a previous response (optional)
+    
     Returns:
         A dictionary containing all data from the three tables
     """
-    if not hasattr(app.state, 'db_conn') or app.state.db_conn is None:
+    if format == "ndjson":
+        return StreamingResponse(stream_all_data(plan_id), media_type="application/x-ndjson")
+    
+    try:
+        # Cheap aggregates decide whether anything changed before any rows are read
+        versions = await app.state.table_versions.get(plan_id, load_table_versions)
+        etag = combined_etag(versions, plan_id, updated_since.isoformat() if updated_since else "")
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        
+        plans, documents, tasks = await asyncio.gather(
+            *(fetch_table(table, plan_id, updated_since) for table in TABLES)
+        )
+    except DatabaseUnavailableError as e:
+        logger.error(f"Database unavailable: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Database connection is not available"
         )
-    
-    try:
-        # Create a cursor for database operations
-        cursor = app.state.db_conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get all plans
-        cursor.execute("SELECT * FROM public.plans")
-        plans = cursor.fetchall()
-        print(plans)
-        
-        # Get all documents
-        cursor.execute("SELECT * FROM public.documents")
-        documents = cursor.fetchall()
-        print(documents)
-        
-        # Get all tasks
-        cursor.execute("SELECT * FROM public.tasks")
-        tasks = cursor.fetchall()
-        print(tasks)
-        
-        # Close the cursor
-        cursor.close()
-        
-        # Return all data
-        return {
-            "status": "success",
-            "data": {
-                "plans": plans,
-                "documents": documents,
-                "tasks": tasks
-            }
-        }
-        
     except Exception as e:
         logger.error(f"Database error when retrieving all data: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to retrieve data: {str(e)}"
         )
+    
+    logger.debug(f"Returning {len(plans)} plans, {len(documents)} documents, {len(tasks)} tasks")
+    
+    # Taken before the rows were read, so a row written in between is sent again on the next poll rather than missed
+    latest = [as_utc(version.max_version) for version in versions if version.max_version]
+    content = {
+        "status": "success",
+        "data": {
+            "plans": plans,
+            "documents": documents,
+            "tasks": tasks
+        },
+        # Use as updated_since on the next poll
+        "last_updated_at": max(latest) if latest else None
+    }
+    if updated_since is not None:
+        content["updated_since"] = updated_since
+    
+    return JSONResponse(content=jsonable_encoder(content), headers=headers)
 
-async def extract_text_from_url(url: str) -> str:
+
+@app.get("/data/{table}", tags=["data"])
+async def get_table_page(
+    table: str,
+    cursor: Optional[str] = Query(None, description="Cursor from the previous page's next_cursor"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of rows to return"),
+    plan_id: Optional[int] = Query(None, description="Only return rows belonging to this plan")
+):
     """
-    Scrape text content from a URL
+    Retrieve one keyset-paginated page of plans, documents or tasks, ordered by id.
     
     Args:
-        url: The URL to scrape
-        
+        table: One of plans, documents or tasks
+        cursor: Opaque cursor returned as next_cursor by the previous page (optional)
+        limit: Page size (default: 100)
+        plan_id: Only return rows belonging to this plan (optional)
+    
     Returns:
-        The extracted text content
+        The page of rows and the cursor for the next page, or null on the last page
     """
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+    if table not in TABLES:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown table: {table}"
+        )
+    
+    try:
+        async with app.state.db.connection() as conn:
+            rows, next_cursor = await fetch_page(conn, table, limit, cursor=cursor, plan_id=plan_id)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=30) as response:
-                if response.status != 200:
-                    logger.warning(f"Failed to fetch URL {url}: HTTP {response.status}")
-                    return f"Failed to fetch content from {url}"
-                
-                html = await response.text()
-                
-                # Parse HTML with BeautifulSoup
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                # Remove script and style elements
-                for script_or_style in soup(["script", "style"]):
-                    script_or_style.decompose()
-                
-                # Get text content
-                text = soup.get_text(separator='\n')
-                
-                # Clean up text: remove multiple newlines and whitespace
-                lines = (line.strip() for line in text.splitlines())
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                text = '\n'.join(chunk for chunk in chunks if chunk)
-                
-                return text
+        return {
+            "status": "success",
+            "data": rows,
+            "next_cursor": next_cursor
+        }
+    
+    except InvalidCursorError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except DatabaseUnavailableError as e:
+        logger.error(f"Database unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database connection is not available"
+        )
     except Exception as e:
-        logger.error(f"Error scraping URL {url}: {str(e)}")
-        return f"Error extracting content from {url}: {str(e)}"
+        logger.error(f"Database error when retrieving {table}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve {table}: {str(e)}"
+        )
+
+
+def validate_bulk_rows(table: str, rows: List[Any]) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Validate each row of a bulk write against the table's row model.
+    
+    Returns:
+        The valid rows with their input index, and per-row errors for the rest
+    """
+    model = BULK_ROW_MODELS[table]
+    valid = []
+    errors = []
+    for index, row in enumerate(rows):
+        try:
+            valid.append((index, model.model_validate(row).model_dump()))
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "errors": [
+                    {"field": ".".join(str(part) for part in error["loc"]), "message": error["msg"]}
+                    for error in e.errors()
+                ]
+            })
+    return valid, errors
+
+
+async def bulk_write(
+    table: str,
+    rows: List[Any],
+    allow_partial: bool = False,
+    before_insert: Optional[Callable[[AsyncConnection], Awaitable[Any]]] = None
+) -> Dict[str, Any]:
+    """
+    Validate rows and insert them into a data table in one transaction.
+    
+    Rows of documents and tasks must reference an existing plan. Inserts are
+    batched into multi-row INSERT statements of BULK_INSERT_PAGE_SIZE rows.
+    
+    Args:
+        table: One of plans, documents or tasks
+        rows: Row objects keyed by column name
+        allow_partial: Insert the valid rows even if others are rejected
+        before_insert: Coroutine function run on the transaction's connection before inserting (optional)
+        
+    Returns:
+        The inserted rows and the rejected rows' errors
+        
+    Raises:
+        BulkValidationError: If any row is invalid and allow_partial is off; nothing is written
+    """
+    valid, errors = validate_bulk_rows(table, rows)
+    
+    async with app.state.db.transaction() as conn:
+        if table != "plans" and valid:
+            known = await existing_plan_ids(conn, (row["plan_id"] for _, row in valid))
+            for index, row in valid:
+                if row["plan_id"] not in known:
+                    errors.append({
+                        "index": index,
+                        "errors": [{"field": "plan_id", "message": f"Plan {row['plan_id']} does not exist"}]
+                    })
+            valid = [(index, row) for index, row in valid if row["plan_id"] in known]
+        errors.sort(key=lambda error: error["index"])
+        
+        if errors and not allow_partial:
+            raise BulkValidationError(errors)
+        if before_insert is not None:
+            await before_insert(conn)
+        inserted = await insert_rows(conn, table, [row for _, row in valid], page_size=BULK_INSERT_PAGE_SIZE)
+    
+    app.state.table_versions.invalidate()
+    return {"inserted": inserted, "rejected": errors}
+
+
+@app.post("/data/{table}/bulk", tags=["data"])
+async def bulk_insert_rows(
+    table: str,
+    rows: List[Any] = Body(..., description="Rows to insert, keyed by column name"),
+    allow_partial: bool = Query(False, description="Insert the valid rows even if some are rejected")
+):
+    """
+    Insert many plans, documents or tasks in one transaction.
+    
+    Every row is validated first. Unless allow_partial is set, any invalid
+    row rejects the whole batch with HTTP 422 and the errors of each bad
+    row, by index.
+    
+    Args:
+        table: One of plans, documents or tasks
+        rows: JSON array of rows; plans take name and description, documents
+            and tasks the columns of their table and an existing plan_id
+        allow_partial: Insert the valid rows and report the rejected ones (default: false)
+    
+    Returns:
+        The inserted rows and the rejected rows' errors
+    """
+    if table not in TABLES:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown table: {table}"
+        )
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_MAX_ROWS} rows can be written per request"
+        )
+    
+    try:
+        result = await bulk_write(table, rows, allow_partial)
+        
+        return {
+            "status": "success",
+            "message": f"Inserted {len(result['inserted'])} of {len(rows)} {table} rows",
+            "data": result["inserted"],
+            "rejected": result["rejected"]
+        }
+    
+    except BulkValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": f"{len(e.errors)} of {len(rows)} rows are invalid, nothing was written", "errors": e.errors}
+        )
+    except DatabaseUnavailableError as e:
+        logger.error(f"Database unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database connection is not available"
+        )
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        # Constraints the row models can't check; the whole batch was rolled back
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Rows rejected by the database, nothing was written: {str(e).strip()}"
+        )
+    except Exception as e:
+        logger.error(f"Database error when bulk inserting into {table}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to insert {table}: {str(e)}"
+        )
+
+async def extract_text_from_url(url: str) -> str:
+    """
+    Scrape text content from a URL
+    
+    Uses the shared HTTP session and the scrape cache, so repeat scrapes of
+    the same page are served locally or revalidated with a conditional GET.
+    
+    Args:
+        url: The URL to scrape
+        
+    Returns:
+        The extracted text content
+        
+    Raises:
+        ValueError: If the URL doesn't return HTTP 200 or the page is too large
+    """
+    with app.state.metrics.span("scrape"):
+        return await app.state.scraper.fetch_text(url)
 
-async def extract_text_from_pdf(file_path: str, ocr_client) -> str:
+def get_ocr_client():
     """
-    Extract text from a PDF file using Alibaba Cloud OCR
+    Return the Alibaba Cloud OCR client, creating it on first use.
+    
+    The OCR SDK is slow to import, so it is only loaded once a PDF needs it.
+    
+    Returns:
+        The OCR client, or None if credentials are not configured
+    """
+    if getattr(app.state, "ocr_client", None) is not None:
+        return app.state.ocr_client
+    if not (ALIBABA_ACCESS_KEY_ID and ALIBABA_ACCESS_KEY_SECRET):
+        return None
+    
+    from alibabacloud_ocr20191230.client import Client as OcrClient
+    from alibabacloud_tea_openapi import models as open_api_models
+    
+    config = open_api_models.Config(
+        access_key_id=ALIBABA_ACCESS_KEY_ID,
+        access_key_secret=ALIBABA_ACCESS_KEY_SECRET,
+        endpoint=ALIBABA_OCR_ENDPOINT,
+        region_id=ALIBABA_OCR_REGION
+    )
+    app.state.ocr_client = OcrClient(config)
+    logger.info("Alibaba Cloud OCR client initialized")
+    return app.state.ocr_client
+
+
+def ocr_response_text(response) -> Optional[str]:
+    """
+    Join the recognized words of a RecognizePdf response into text.
+    """
+    data = response.body.data if response.body else None
+    if data is None:
+        return None
+    if getattr(data, "content", None):
+        return data.content
+    words = [info.word for info in (data.words_info or []) if info.word]
+    return "\n".join(words) if words else None
+
+
+async def recognize_pdf_file(file_path: str, ocr_client) -> Optional[str]:
+    """
+    Run one Alibaba Cloud RecognizePdf call on a PDF file.
+    
+    The file is streamed to the OCR service from disk, so it is never held
+    in memory or base64-encoded as a whole.
+    
+    Returns:
+        The recognized text, or None if nothing was recognized
+        
+    Raises:
+        Exception: Any error from reading the file or calling the OCR API
+    """
+    from alibabacloud_ocr20191230.models import RecognizePdfAdvanceRequest
+    from alibabacloud_tea_util import models as util_models
+    
+    if ocr_client is None:
+        raise RuntimeError("OCR client not available")
+    
+    # Set runtime options
+    runtime = util_models.RuntimeOptions()
+    
+    def recognize():
+        with open(file_path, 'rb') as f:
+            # The SDK uploads the file object in chunks before calling RecognizePdf
+            request = RecognizePdfAdvanceRequest(file_urlobject=f)
+            return ocr_client.recognize_pdf_advance(request, runtime)
+    
+    # Call the OCR API off the event loop
+    with app.state.metrics.span("ocr"):
+        response = await app.state.executors.network.run(recognize)
+    return ocr_response_text(response)
+
+
+class NoTextExtractedError(Exception):
+    """Raised when a PDF yields no text, so nothing is cached, stored or indexed for it."""
+
+
+async def extract_text_from_pdf(file_path: str, ocr_client, sha256: Optional[str] = None) -> str:
+    """
+    Extract text from a PDF file, using Alibaba Cloud OCR only where needed
+    
+    Pages with an embedded text layer are read locally; the rest are OCR'd
+    page by page in parallel. Without pypdf, or for PDFs it can't parse,
+    the whole file is sent to OCR in one call.
     
     Args:
         file_path: Path to the PDF file
-        ocr_client: Alibaba Cloud OCR client
+        ocr_client: Alibaba Cloud OCR client (may be None if every page has a text layer)
+        sha256: Content hash of the file, used to cache OCR'd pages across retries
         
     Returns:
         The extracted text content
+        
+    Raises:
+        NoTextExtractedError: If neither the text layer nor OCR produced any text
+        Exception: Any error from reading the file or calling the OCR API
     """
+    text = None
+    with app.state.metrics.span("pdf_extract"):
+        if app.state.page_ocr is not None:
+            try:
+                text = await app.state.page_ocr.extract(file_path, sha256)
+            except UnreadablePdfError as e:
+                logger.warning(f"{str(e)}; sending the whole file to OCR")
+                text = await recognize_pdf_file(file_path, ocr_client)
+        else:
+            text = await recognize_pdf_file(file_path, ocr_client)
+    
+    if not text:
+        logger.warning(f"No text content extracted from {file_path}")
+        raise NoTextExtractedError(f"No text content extracted from {os.path.basename(file_path)}")
+    return text
+
+
+async def store_extracted_text(text_filename: str, extracted_text: str, skip_existing: bool = False) -> str:
+    """
+    Queue extracted text for upload to OSS and return its URL.
+    """
+    return await app.state.uploader.enqueue_bytes(text_filename, extracted_text.encode(), skip_existing)
+
+
+async def process_pdf(plan_id: int, pdf_file_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    OCR a saved PDF and store the extracted text in OSS.
+    
+    PDFs already seen (by SHA-256) reuse the cached text and OSS URL instead.
+    PDFs without any text are reported in ``ocr_status`` and get no
+    ``extracted_text``, so they aren't cached, persisted or indexed.
+    
+    Args:
+        plan_id: ID of the study plan
+        pdf_file_info: File information from the upload step; updated in place
+        
+    Returns:
+        The updated file information
+    """
+    filename = pdf_file_info["original_filename"]
+    sha256 = pdf_file_info.get("sha256")
+    extraction_cache = app.state.extraction_cache
+    ocr_client = get_ocr_client()
+    # Text-layer pages don't need OCR, so page-wise extraction can run without a client
+    can_extract = ocr_client is not None or app.state.page_ocr is not None
+    
+    async def extract():
+        # Extract text from PDF, using OCR for pages without a text layer
+        try:
+            pdf_path = await local_pdf_path(pdf_file_info)
+            extracted_text = await extract_text_from_pdf(pdf_path, ocr_client, sha256)
+        except NoTextExtractedError:
+            raise
+        except Exception as ocr_error:
+            logger.error(f"OCR processing error for {filename}: {str(ocr_error)}")
+            pdf_file_info["ocr_error"] = str(ocr_error)
+            raise
+        logger.debug(f"PDF extraction text for {filename}: {preview(extracted_text, DEBUG_LOG_MAX_CHARS)}")
+        return extracted_text, await store_pdf_text(plan_id, pdf_file_info, extracted_text)
+    
+    if extraction_cache is not None and sha256:
+        # Identical PDFs share one extraction, so re-uploads skip OCR and the OSS write
+        if not can_extract:
+            cached = await asyncio.to_thread(extraction_cache.get, sha256)
+            if cached is None:
+                pdf_file_info["ocr_status"] = "OCR client not available"
+                return pdf_file_info
+            await asyncio.to_thread(extraction_cache.add_ref, sha256, plan_id)
+            entry, hit = cached, True
+        else:
+            try:
+                entry, hit = await extraction_cache.get_or_extract(sha256, plan_id, extract)
+            except NoTextExtractedError as e:
+                pdf_file_info["ocr_status"] = str(e)
+                return pdf_file_info
+        
+        pdf_file_info["extracted_text"] = entry["text"]
+        pdf_file_info["extraction_cached"] = hit
+        if hit:
+            logger.info(f"Reusing cached extraction for {filename} ({sha256[:12]})")
+            oss_url = entry["oss_url"]
+            if oss_url is None:
+                # The first upload couldn't reach OSS; store the text now
+                oss_url = await store_pdf_text(plan_id, pdf_file_info, entry["text"])
+                if oss_url:
+                    await asyncio.to_thread(extraction_cache.put, sha256, entry["text"], oss_url)
+        else:
+            oss_url = entry["oss_url"]
+        if oss_url:
+            pdf_file_info["oss_text_url"] = oss_url
+        return pdf_file_info
+    
+    if not can_extract:
+        pdf_file_info["ocr_status"] = "OCR client not available"
+        return pdf_file_info
+    
     try:
-        # Read the file and encode it as base64
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
+        extracted_text, oss_url = await extract()
+    except NoTextExtractedError as e:
+        pdf_file_info["ocr_status"] = str(e)
+        return pdf_file_info
+    pdf_file_info["extracted_text"] = extracted_text
+    if oss_url:
+        pdf_file_info["oss_text_url"] = oss_url
+    return pdf_file_info
+
+
+async def local_pdf_path(pdf_file_info: Dict[str, Any]) -> str:
+    """
+    Return a local path of an uploaded PDF, fetching it back from OSS if
+    its local copy was evicted.
+    """
+    if "storage_key" not in pdf_file_info:
+        # Queued before uploads went to the PDF store
+        return pdf_file_info["saved_path"]
+    return await app.state.executors.network.run(app.state.pdf_store.ensure_local, pdf_file_info["storage_key"])
+
+
+async def store_pdf_text(plan_id: int, pdf_file_info: Dict[str, Any], extracted_text: str) -> Optional[str]:
+    """
+    Store a PDF's extracted text in OSS.
+    
+    Texts of hashed uploads are stored under their content hash so that every
+    plan using the same PDF points at one object.
+    
+    Returns:
+        The OSS URL, or None if OSS is unavailable or the upload couldn't be queued
+    """
+    if app.state.uploader is None:
+        return None
+    
+    try:
+        if pdf_file_info.get("sha256"):
+            text_filename = f"extracted_texts/pdf/{pdf_file_info['sha256']}.txt"
+            oss_url = await store_extracted_text(text_filename, extracted_text, skip_existing=True)
+        else:
+            # Create a unique text filename for OSS
+            text_filename = f"extracted_texts/{plan_id}/{uuid.uuid4()}_pdf_{pdf_file_info['original_filename']}.txt"
+            oss_url = await store_extracted_text(text_filename, extracted_text)
+        logger.info(f"PDF extracted text queued for OSS: {oss_url}")
+        return oss_url
+    except Exception as oss_error:
+        logger.error(f"Error storing PDF text in OSS: {str(oss_error)}")
+        pdf_file_info["oss_error"] = str(oss_error)
+        return None
+
+
+async def process_link(plan_id: int, url: str) -> Dict[str, Any]:
+    """
+    Scrape a link and store the extracted text in OSS.
+    
+    Args:
+        plan_id: ID of the study plan
+        url: The URL to scrape
         
-        # Encode the file content as base64
-        base64_content = base64.b64encode(file_content).decode('utf-8')
+    Returns:
+        The extracted text and, if stored, its OSS URL
+    """
+    extracted_text = await extract_text_from_url(url)
+    logger.debug(f"Link extraction text for {url}: {preview(extracted_text, DEBUG_LOG_MAX_CHARS)}")
+    result = {"text": extracted_text, "oss_url": None}
+    
+    # Store the extracted text in OSS
+    if app.state.uploader is not None:
+        try:
+            # Create a URL-safe filename by encoding the URL
+            encoded_url = base64.urlsafe_b64encode(url.encode()).decode()
+            text_filename = f"extracted_texts/{plan_id}/{uuid.uuid4()}_url_{encoded_url}.txt"
+            result["oss_url"] = await store_extracted_text(text_filename, extracted_text)
+            logger.info(f"URL extracted text queued for OSS: {result['oss_url']}")
+        except Exception as oss_error:
+            logger.error(f"Error storing URL text in OSS: {str(oss_error)}")
+    
+    return result
+
+
+def assemble_workflow_result(
+    payload: Dict[str, Any],
+    items: List[Optional[Dict[str, Any]]],
+    index: Optional[Dict[str, Any]] = None,
+    documents: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Build the workflow response data from per-item outcomes, in input order.
+    
+    Args:
+        payload: The job payload (plan_id, saved PDFs and links)
+        items: One outcome per PDF then per link, or None if not yet processed
+        index: Summary of the plan search index update, if it ran
+        documents: Summary of the documents table write, if it ran
         
-        # Create the OCR request
-        request = RecognizePdfRequest(
-            body=base64_content
-        )
+    Returns:
+        The workflow data with extracted texts, OSS URLs and failures
+    """
+    saved_pdfs = payload["pdfs"]
+    links_list = payload["links"]
+    
+    pdf_files = []
+    pdf_texts = {}  # Store extracted text from PDFs
+    pdf_oss_urls = {}  # Store OSS URLs for the extracted text
+    link_contents = {}
+    link_oss_urls = {}  # Store OSS URLs for the extracted text from links
+    failures = []
+    
+    for info, item in zip(saved_pdfs, items[:len(saved_pdfs)]):
+        if item and item["ok"]:
+            info = item["value"]
+            if "extracted_text" in info:
+                pdf_texts[info["original_filename"]] = info["extracted_text"]
+            if "oss_text_url" in info:
+                pdf_oss_urls[info["original_filename"]] = info["oss_text_url"]
+        elif item:
+            info = {**info, "ocr_error": item["error"]}
+        pdf_files.append(info)
+    
+    for url, item in zip(links_list, items[len(saved_pdfs):]):
+        if item and item["ok"]:
+            link_contents[url] = item["value"]["text"]
+            if item["value"]["oss_url"]:
+                link_oss_urls[url] = item["value"]["oss_url"]
+        elif item:
+            link_contents[url] = f"Error: {item['error']}"
+    
+    for item in items:
+        if item and not item["ok"]:
+            failures.append({"type": item["type"], "source": item["source"], "error": item["error"]})
+    
+    return {
+        "plan_id": payload["plan_id"],
+        "links": links_list,
+        "link_contents": link_contents,
+        "link_oss_urls": link_oss_urls,
+        "files": pdf_files,
+        "pdf_texts": pdf_texts,
+        "pdf_oss_urls": pdf_oss_urls,
+        "failures": failures,
+        "index": index,
+        "documents": documents
+    }
+
+
+async def run_workflow_job(job: Dict[str, Any], report_progress) -> Dict[str, Any]:
+    """
+    Process a queued workflow job: OCR its PDFs and scrape its links.
+    
+    Items that succeeded on an earlier attempt are kept and not re-run.
+    
+    Args:
+        job: The claimed job, including its payload and any partial result
+        report_progress: Coroutine function persisting per-item progress
         
-        # Set runtime options
-        runtime = util_models.RuntimeOptions()
+    Returns:
+        The per-item outcomes, stored as the job result
         
-        # Call the OCR API
-        response = ocr_client.recognize_general_with_options(request, runtime)
+    Raises:
+        RetryableJobError: If any item failed, carrying the partial outcomes
+    """
+    payload = job["payload"]
+    plan_id = payload["plan_id"]
+    sources = [("pdf", info["original_filename"]) for info in payload["pdfs"]] + \
+        [("link", url) for url in payload["links"]]
+    
+    previous = (job.get("result") or {}).get("items") or [None] * len(sources)
+    items: List[Optional[Dict[str, Any]]] = [
+        item if item and item["ok"] else None for item in previous
+    ]
+    
+    def progress() -> Dict[str, Any]:
+        return {
+            "total": len(sources),
+            "completed": sum(1 for item in items if item and item["ok"]),
+            "failed": sum(1 for item in items if item and not item["ok"]),
+            "items": [
+                {
+                    "type": kind,
+                    "source": source,
+                    "status": "pending" if item is None else ("succeeded" if item["ok"] else "failed")
+                }
+                for (kind, source), item in zip(sources, items)
+            ]
+        }
+    
+    def tracked(index: int, run):
+        # Record each item's outcome as soon as it finishes
+        async def wrapper():
+            try:
+                value = await run()
+            except Exception as e:
+                items[index] = {"type": sources[index][0], "source": sources[index][1], "ok": False, "error": str(e) or type(e).__name__}
+                await report_progress(progress())
+                raise
+            items[index] = {"type": sources[index][0], "source": sources[index][1], "ok": True, "value": value}
+            await report_progress(progress())
+            return value
+        return wrapper
+    
+    # Fan out OCR and scraping together; every PDF shares the OCR service's limit
+    ingest_items = []
+    for index, info in enumerate(payload["pdfs"]):
+        if items[index] is None:
+            run = partial(process_pdf, plan_id, dict(info))
+            ingest_items.append((index, IngestItem("pdf", info["original_filename"], "ocr", tracked(index, run))))
+    for offset, url in enumerate(payload["links"]):
+        index = len(payload["pdfs"]) + offset
+        if items[index] is None:
+            run = partial(process_link, plan_id, url)
+            ingest_items.append((index, IngestItem("link", url, host_of(url), tracked(index, run))))
+    
+    await report_progress(progress())
+    results = await run_ingestion([item for _, item in ingest_items], app.state.ingest_limits)
+    
+    # Timeouts are reported by the ingestion stage rather than the item itself
+    for (index, _), result in zip(ingest_items, results):
+        if not result.ok and items[index] is None:
+            items[index] = {"type": result.kind, "source": result.key, "ok": False, "error": result.error}
+    await report_progress(progress())
+    
+    # Index what succeeded now; unchanged chunks are skipped again on a retry
+    outcome = {"items": items, "index": await index_plan_texts(plan_id, payload, items)}
+    # Persisting replaces earlier rows of the same sources, so a retry doesn't duplicate them
+    outcome["documents"] = await persist_workflow_documents(job["id"], payload, items)
+    failed = [item for item in items if not item["ok"]]
+    logger.info(
+        f"Workflow processed for plan_id: {plan_id} with {len(payload['links'])} links and "
+        f"{len(payload['pdfs'])} PDF files ({len(failed)} failed)"
+    )
+    if failed:
+        raise RetryableJobError(f"{len(failed)} of {len(items)} items failed", result=outcome)
+    if outcome["documents"]["status"] == "unavailable":
+        raise RetryableJobError("Extracted documents could not be saved", result=outcome)
+    return outcome
+
+
+async def persist_workflow_documents(
+    job_id: str,
+    payload: Dict[str, Any],
+    items: List[Optional[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    Write a workflow's extracted texts to the documents table in one batch.
+    
+    Each PDF and link becomes one document whose metadata names its source
+    (the same "pdf:<filename>" / "link:<url>" keys as the search index).
+    Documents of the plan from the same sources are replaced in the same
+    transaction.
+    
+    Returns:
+        A summary with the written document IDs, or the error if the write failed
+    """
+    plan_id = payload["plan_id"]
+    rows = []
+    for info, item in zip(payload["pdfs"], items):
+        if item and item["ok"] and item["value"].get("extracted_text"):
+            value = item["value"]
+            rows.append({
+                "plan_id": plan_id,
+                "title": info["original_filename"],
+                # Postgres text can't hold NUL characters, which OCR and PDF text layers sometimes produce
+                "content": value["extracted_text"].replace("\x00", ""),
+                "type": "pdf",
+                "metadata": {
+                    "source": f"pdf:{info['original_filename']}",
+                    "sha256": info.get("sha256"),
+                    "oss_url": value.get("oss_text_url"),
+                    "workflow_job_id": job_id
+                }
+            })
+    for url, item in zip(payload["links"], items[len(payload["pdfs"]):]):
+        if item and item["ok"] and item["value"]["text"]:
+            rows.append({
+                "plan_id": plan_id,
+                "title": url,
+                "content": item["value"]["text"].replace("\x00", ""),
+                "type": "link",
+                "metadata": {"source": f"link:{url}", "url": url, "oss_url": item["value"]["oss_url"], "workflow_job_id": job_id}
+            })
+    if not rows:
+        return {"status": "empty", "document_ids": []}
+    
+    sources = [row["metadata"]["source"] for row in rows]
+    
+    async def replace_previous(conn: AsyncConnection) -> None:
+        await conn.execute(
+            "DELETE FROM public.documents WHERE plan_id = %s AND metadata->>'source' = ANY(%s)",
+            (plan_id, sources)
+        )
+    
+    try:
+        result = await bulk_write("documents", rows, before_insert=replace_previous)
+    except BulkValidationError as e:
+        # Not retryable: the plan doesn't exist or a row is malformed
+        logger.error(f"Documents of plan {plan_id} rejected: {e.errors}")
+        return {"status": "rejected", "document_ids": [], "errors": e.errors}
+    except (psycopg2.DataError, psycopg2.IntegrityError, psycopg2.errors.ProgramLimitExceeded) as e:
+        # Not retryable either: the database refuses these rows (e.g. a search vector over its size limit)
+        logger.error(f"Documents of plan {plan_id} rejected by the database: {str(e).strip()}")
+        return {"status": "rejected", "document_ids": [], "error": str(e).strip()}
+    except Exception as e:
+        logger.error(f"Error saving documents of plan {plan_id}: {str(e)}")
+        return {"status": "unavailable", "document_ids": [], "error": str(e)}
+    
+    document_ids = [row["id"] for row in result["inserted"]]
+    logger.info(f"Saved {len(document_ids)} documents for plan {plan_id}")
+    
+    if app.state.extraction_cache is not None:
+        # Replaced documents may have been the plan's only use of an extraction
+        try:
+            async with app.state.db.connection() as conn:
+                hashes = await plan_document_hashes(conn, plan_id)
+            released = await asyncio.to_thread(app.state.extraction_cache.set_plan_refs, plan_id, hashes)
+            if released:
+                logger.info(f"Released {released} extraction cache references of plan {plan_id}")
+        except Exception as e:
+            logger.warning(f"Failed to update extraction cache references of plan {plan_id}: {str(e)}")
+    return {"status": "saved", "document_ids": document_ids}
+
+
+async def index_plan_texts(
+    plan_id: int,
+    payload: Dict[str, Any],
+    items: List[Optional[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    Chunk and embed a workflow's extracted texts into the plan's search index.
+    
+    Each PDF and link is one source; re-indexing a source replaces its
+    chunks, and only chunks whose content changed are sent for embedding.
+    
+    Returns:
+        A summary of indexed sources, chunks and newly embedded chunks
+    """
+    if app.state.embedding_client is None:
+        return {"status": "disabled"}
+    
+    sources = []
+    for info, item in zip(payload["pdfs"], items):
+        if item and item["ok"] and item["value"].get("extracted_text"):
+            sources.append((f"pdf:{info['original_filename']}", item["value"]["extracted_text"]))
+    for url, item in zip(payload["links"], items[len(payload["pdfs"]):]):
+        if item and item["ok"] and item["value"]["text"]:
+            sources.append((f"link:{url}", item["value"]["text"]))
+    
+    summary = {"status": "indexed", "sources": 0, "chunks": 0, "embedded": 0, "errors": []}
+    for source, text in sources:
+        chunks = chunk_text(text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)
+        try:
+            counts = await app.state.vector_index.update_source(
+                plan_id,
+                source,
+                chunks,
+                app.state.metrics.timed("embed", app.state.embedding_client.embed),
+                app.state.executors.disk.run
+            )
+        except Exception as e:
+            logger.error(f"Error indexing {source} for plan {plan_id}: {str(e)}")
+            summary["errors"].append({"source": source, "error": str(e)})
+            continue
+        summary["sources"] += 1
+        summary["chunks"] += counts["chunks"]
+        summary["embedded"] += counts["embedded"]
+    
+    logger.info(
+        f"Indexed {summary['sources']} sources for plan {plan_id}: "
+        f"{summary['chunks']} chunks, {summary['embedded']} embedded"
+    )
+    return summary
+
+
+@app.get("/plans/{plan_id}/search", tags=["search"])
+async def search_plan(
+    plan_id: int,
+    q: str = Query(..., min_length=1, description="Search query"),
+    k: int = Query(5, ge=1, le=50, description="Number of results to return"),
+    mode: str = Query("semantic", pattern="^(semantic|lexical)$", description="semantic or lexical")
+):
+    """
+    Search a plan's materials.
+    
+    The default semantic mode embeds the query once and ranks the plan's
+    stored chunk vectors by cosine similarity. With mode=lexical the query
+    is matched against the documents table's full-text index in Postgres
+    instead, returning ranked documents with highlighted snippets and
+    making no external API calls.
+    
+    Args:
+        plan_id: ID of the study plan
+        q: The search query; lexical mode accepts web search syntax ("quoted phrases", -exclusions, or)
+        k: Number of results
+        mode: semantic (default) or lexical
         
-        # Extract text from the response
-        if response.body and response.body.data and response.body.data.content:
-            return response.body.data.content
-        else:
-            logger.warning(f"No text content extracted from {file_path}")
-            return f"No text content extracted from {os.path.basename(file_path)}"
+    Returns:
+        The top-k chunks (semantic) or documents (lexical) with their scores
+    """
+    if mode == "lexical":
+        return await search_plan_lexical(plan_id, q, k)
+    
+    if app.state.embedding_client is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search is not available: embedding API key is not configured"
+        )
+    
+    try:
+        with app.state.metrics.span("embed"):
+            query_vector = (await app.state.embedding_client.embed([q]))[0]
+        results = await app.state.executors.disk.run(app.state.vector_index.search, plan_id, query_vector, k)
     except Exception as e:
-        logger.error(f"Error extracting text from PDF {file_path}: {str(e)}")
-        return f"Error extracting text from {os.path.basename(file_path)}: {str(e)}"
+        logger.error(f"Error searching plan {plan_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}"
+        )
+    
+    return {
+        "status": "success",
+        "data": {
+            "plan_id": plan_id,
+            "query": q,
+            "results": [
+                {
+                    "source": row["source"],
+                    "chunk_index": row["chunk_index"],
+                    "text": row["text"],
+                    "score": row["score"]
+                }
+                for row in results
+            ]
+        }
+    }
 
 
-@app.post("/trigger-workflow", tags=["workflow"])
+async def search_plan_lexical(plan_id: int, q: str, k: int) -> Dict[str, Any]:
+    """
+    Rank a plan's documents with Postgres full-text search.
+    """
+    try:
+        with app.state.metrics.span("fulltext_search"):
+            async with app.state.db.connection() as conn:
+                rows = await search_documents(conn, plan_id, q, k, SEARCH_TEXT_CONFIG, SEARCH_HEADLINE_OPTIONS)
+    except DatabaseUnavailableError as e:
+        logger.error(f"Database unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database connection is not available"
+        )
+    except psycopg2.errors.UndefinedColumn:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Full-text search is not available: the documents search index has not been created"
+        )
+    except psycopg2.errors.UndefinedFunction:
+        # websearch_to_tsquery needs PostgreSQL 11
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Full-text search is not available on this database server"
+        )
+    except Exception as e:
+        logger.error(f"Error searching plan {plan_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Search failed: {str(e)}"
+        )
+    
+    return {
+        "status": "success",
+        "data": {
+            "plan_id": plan_id,
+            "query": q,
+            "mode": "lexical",
+            "results": [
+                {
+                    "document_id": row["id"],
+                    "title": row["title"],
+                    "type": row["type"],
+                    "source": row["source"],
+                    "snippet": row["snippet"],
+                    "score": row["rank"]
+                }
+                for row in rows
+            ]
+        }
+    }
+
+
+def workflow_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shape a stored job for the API, assembling its result in the workflow response format.
+    """
+    result = job.get("result") or {}
+    items = result.get("items")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": datetime.fromtimestamp(job["created_at"], timezone.utc).isoformat(),
+        "updated_at": datetime.fromtimestamp(job["updated_at"], timezone.utc).isoformat(),
+        "result": assemble_workflow_result(
+            job["payload"], items, result.get("index"), result.get("documents")
+        ) if items else None
+    }
+
+
+def workflow_trigger_response(job: Dict[str, Any], message: str) -> Dict[str, Any]:
+    return {
+        "status": "success",
+        "message": message,
+        "data": {
+            "job_id": job["id"],
+            "job_status": job["status"],
+            "plan_id": job["payload"]["plan_id"],
+            "status_url": f"/workflow/{job['id']}",
+            "events_url": f"/workflow/{job['id']}/events"
+        }
+    }
+
+
+@app.post("/trigger-workflow", tags=["workflow"], status_code=status.HTTP_202_ACCEPTED)
 async def trigger_workflow(
     plan_id: int = Form(...),
     links: str = Form("[]"),  # JSON string of links
-    files: List[UploadFile] = File(...)
+    files: List[UploadFile] = File(...),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Trigger a workflow with a plan ID, links, and PDF files.
     
+    The PDFs are saved and a job is queued; OCR and scraping run in the
+    background. Poll /workflow/{job_id} or stream /workflow/{job_id}/events
+    for progress. Repeating a request with the same Idempotency-Key header
+    returns the original job instead of queueing a new one.
+    
     Args:
         plan_id: ID of the study plan
         links: JSON string containing a list of links
         files: List of uploaded PDF files
+        idempotency_key: Client-supplied key making retries safe (optional)
         
     Returns:
-        Status of the workflow trigger operation
+        The queued job's ID and status URLs
     """
     try:
+        if idempotency_key:
+            existing = await asyncio.to_thread(app.state.job_queue.store.find_by_idempotency_key, idempotency_key)
+            if existing:
+                return JSONResponse(
+                    status_code=status.HTTP_200_OK,
+                    content=workflow_trigger_response(existing, "Workflow already triggered")
+                )
+        
         # Parse the links JSON string to a Python list
         try:
             links_list = json.loads(links)
@@ -466,125 +2182,73 @@ async def trigger_workflow(
                 links_list = []
         except json.JSONDecodeError:
             links_list = []
-            
-        # Process the uploaded PDF files
-        pdf_files = []
-        pdf_texts = {}  # Store extracted text from PDFs
-        pdf_oss_urls = {}  # Store OSS URLs for the extracted text
-        
-        for file in files:
-            # Check if the file is a PDF
-            if file.content_type == "application/pdf" or file.filename.lower().endswith('.pdf'):
-                # Read file content
-                content = await file.read()
-                
-                # Create a unique filename to avoid collisions
-                unique_filename = f"{uuid.uuid4()}_{file.filename}"
-                
-                # Create directory if it doesn't exist
-                os.makedirs("uploaded_pdfs", exist_ok=True)
-                
-                # Save the file to disk
-                file_path = f"uploaded_pdfs/{unique_filename}"
-                with open(file_path, "wb") as f:
-                    f.write(content)
-                
-                # Store file information
-                pdf_file_info = {
-                    "original_filename": file.filename,
-                    "saved_path": file_path,
-                    "size": len(content),
-                    "content_type": file.content_type
-                }
-                
-                # Extract text from PDF using OCR if OCR client is available
-                if hasattr(app.state, 'ocr_client') and app.state.ocr_client:
-                    try:
-                        extracted_text = await extract_text_from_pdf(file_path, app.state.ocr_client)
-                        pdf_file_info["extracted_text"] = extracted_text
-                        pdf_texts[file.filename] = extracted_text
-                        print("pdf extraction text: "+ extracted_text)
-                        
-                        # Store the extracted text in OSS
-                        if app.state.bucket:
-                            try:
-                                # Create a unique text filename for OSS
-                                text_filename = f"extracted_texts/{plan_id}/{uuid.uuid4()}_pdf_{file.filename}.txt"
-                                
-                                # Upload the extracted text to OSS
-                                app.state.bucket.put_object(text_filename, extracted_text)
-                                
-                                # Get the OSS URL
-                                oss_url = f"https://{ALIBABA_OSS_BUCKET}.{ALIBABA_OSS_ENDPOINT}/{text_filename}"
-                                pdf_file_info["oss_text_url"] = oss_url
-                                pdf_oss_urls[file.filename] = oss_url
-                                logger.info(f"PDF extracted text stored in OSS: {oss_url}")
-                            except Exception as oss_error:
-                                logger.error(f"Error storing PDF text in OSS: {str(oss_error)}")
-                                pdf_file_info["oss_error"] = str(oss_error)
-                        
-                    except Exception as ocr_error:
-                        logger.error(f"OCR processing error for {file.filename}: {str(ocr_error)}")
-                        pdf_file_info["ocr_error"] = str(ocr_error)
-                else:
-                    pdf_file_info["ocr_status"] = "OCR client not available"
-                
-                pdf_files.append(pdf_file_info)
-                
-                # Reset file pointer for potential future reads
-                await file.seek(0)
-        
-        # Process links and extract content
-        link_contents = {}
-        link_oss_urls = {}  # Store OSS URLs for the extracted text from links
-        
-        for url in links_list:
-            try:
-                extracted_text = await extract_text_from_url(url)
-                link_contents[url] = extracted_text
-                print("link extraction text: "+ extracted_text)
-                
-                # Store the extracted text in OSS
-                if app.state.bucket:
-                    try:
-                        # Create a URL-safe filename by encoding the URL
-                        encoded_url = base64.urlsafe_b64encode(url.encode()).decode()
-                        text_filename = f"extracted_texts/{plan_id}/{uuid.uuid4()}_url_{encoded_url}.txt"
-                        
-                        # Upload the extracted text to OSS
-                        app.state.bucket.put_object(text_filename, extracted_text)
-                        
-                        # Get the OSS URL
-                        oss_url = f"https://{ALIBABA_OSS_BUCKET}.{ALIBABA_OSS_ENDPOINT}/{text_filename}"
-                        link_oss_urls[url] = oss_url
-                        logger.info(f"URL extracted text stored in OSS: {oss_url}")
-                    except Exception as oss_error:
-                        logger.error(f"Error storing URL text in OSS: {str(oss_error)}")
-                
-            except Exception as url_error:
-                logger.error(f"Error processing URL {url}: {str(url_error)}")
-                link_contents[url] = f"Error: {str(url_error)}"
         
-        # Log the workflow trigger
-        logger.info(f"Workflow triggered for plan_id: {plan_id} with {len(links_list)} links and {len(pdf_files)} PDF files")
+        # Stream the uploaded PDF files to disk
+        saved_pdfs = []
         
-        # Here you would typically queue or start your processing workflow
-        # For now, we'll just return the collected data
+        # Uploads land in an incoming directory until all of them have been accepted
+        incoming_dir = os.path.join(PDF_STORE_DIR, "incoming")
+        os.makedirs(incoming_dir, exist_ok=True)
         
-        return {
-            "status": "success",
-            "message": "Workflow triggered successfully",
-            "data": {
-                "plan_id": plan_id,
-                "links": links_list,
-                "link_contents": link_contents,
-                "link_oss_urls": link_oss_urls,
-                "files": pdf_files,
-                "pdf_texts": pdf_texts,
-                "pdf_oss_urls": pdf_oss_urls
-            }
-        }
+        try:
+            for file in files:
+                # Check if the file is a PDF
+                if file.content_type == "application/pdf" or file.filename.lower().endswith('.pdf'):
+                    # Create a unique filename to avoid collisions; stale .tmp files are swept by compaction
+                    file_path = os.path.join(incoming_dir, f"{uuid.uuid4()}.tmp")
+                    
+                    # Copy in fixed-size chunks, hashing and enforcing the size limit as we go
+                    with app.state.metrics.span("upload_save"):
+                        saved = await save_upload(file, file_path, max_bytes=UPLOAD_MAX_FILE_BYTES)
+                    
+                    # Store file information
+                    saved_pdfs.append({
+                        "original_filename": file.filename,
+                        "saved_path": saved.path,
+                        "size": saved.size,
+                        "sha256": saved.sha256,
+                        "content_type": file.content_type
+                    })
+        except UploadTooLargeError as e:
+            # Don't leave the files saved so far behind when rejecting the request
+            for info in saved_pdfs:
+                os.remove(info["saved_path"])
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"{file.filename}: {str(e)}"
+            )
+        
+        # Move the PDFs into the content-addressed store and queue their upload to OSS,
+        # which keeps the originals once local copies are evicted
+        for info in saved_pdfs:
+            info["storage_key"] = f"{info['sha256']}.pdf"
+            info["saved_path"] = await app.state.executors.disk.run(
+                app.state.pdf_store.add, info["storage_key"], info["saved_path"]
+            )
+            if app.state.uploader is not None:
+                await app.state.uploader.enqueue_file(
+                    app.state.pdf_store.object_path_for(info["storage_key"]),
+                    info["saved_path"],
+                    skip_existing=True
+                )
+        
+        payload = {"plan_id": plan_id, "links": links_list, "pdfs": saved_pdfs}
+        job, created = await app.state.job_queue.submit("workflow", payload, idempotency_key)
+        
+        if not created:
+            # A concurrent request with the same key won; the stored PDFs are shared by content and left to compaction
+            return JSONResponse(
+                status_code=status.HTTP_200_OK,
+                content=workflow_trigger_response(job, "Workflow already triggered")
+            )
         
+        # Log the workflow trigger
+        logger.info(f"Workflow queued for plan_id: {plan_id} with {len(links_list)} links and {len(saved_pdfs)} PDF files (job {job['id']})")
+        
+        return workflow_trigger_response(job, "Workflow triggered successfully")
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error triggering workflow: {str(e)}")
         raise HTTPException(
@@ -593,10 +2257,112 @@ async def trigger_workflow(
         )
 
 
+@app.get("/workflow/{job_id}", tags=["workflow"])
+async def get_workflow_job(job_id: str):
+    """
+    Report a workflow job's status, per-item progress and, once available, its result.
+    
+    Args:
+        job_id: ID returned by /trigger-workflow
+        
+    Returns:
+        The job status, progress and assembled result
+    """
+    job = await app.state.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Workflow job {job_id} not found"
+        )
+    return {"status": "success", "data": workflow_job_view(job)}
+
+
+@app.get("/workflow/{job_id}/events", tags=["workflow"])
+async def stream_workflow_job(job_id: str):
+    """
+    Stream a workflow job's progress as server-sent events until it finishes.
+    
+    Args:
+        job_id: ID returned by /trigger-workflow
+    """
+    job = await app.state.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Workflow job {job_id} not found"
+        )
+    
+    async def events():
+        queue = app.state.job_queue.subscribe(job_id)
+        try:
+            # Re-read after subscribing so no update is missed in between
+            current = await app.state.job_queue.get(job_id)
+            view = workflow_job_view(current)
+            yield f"event: status\ndata: {json.dumps({k: v for k, v in view.items() if k != 'result'})}\n\n"
+            if current["status"] in TERMINAL_STATES:
+                return
+            
+            last_updated_at = current["updated_at"]
+            idle_seconds = 0.0
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=WORKFLOW_EVENTS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    event = None
+                    if not app.state.job_queue.runs_locally(job_id):
+                        # Another API worker may be running the job; read its progress from the store
+                        job = await app.state.job_queue.get(job_id)
+                        if job["updated_at"] != last_updated_at:
+                            last_updated_at = job["updated_at"]
+                            event = {"id": job_id, **{key: job[key] for key in ("status", "progress", "error", "attempts")}}
+                    if event is None:
+                        idle_seconds += WORKFLOW_EVENTS_POLL_SECONDS
+                        if idle_seconds >= 15:
+                            # Keep proxies from closing an idle stream
+                            idle_seconds = 0.0
+                            yield ": keep-alive\n\n"
+                        continue
+                idle_seconds = 0.0
+                yield f"event: update\ndata: {json.dumps(event)}\n\n"
+                if event.get("status") in TERMINAL_STATES:
+                    return
+        finally:
+            app.state.job_queue.unsubscribe(job_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 
 if __name__ == "__main__":
     # This allows running directly with python main.py for development
     # The actual deployment will use the uvicorn command from the script
     import uvicorn
     port = int(os.environ.get("BACKEND_PORT", "8000"))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    if MODEL_SERVER_MODE != "process" and API_WORKERS == 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    else:
+        if MODEL_SERVER_MODE != "process":
+            logger.warning("Each API worker will load its own copy of the model; set MODEL_SERVER_MODE=process")
+        # Start the model server once, before the API workers that share it
+        model_server = None
+        if MODEL_SERVER_MODE == "process" and MODEL_SERVER_AUTOSTART:
+            if not MODEL_SERVER_AUTHKEY:
+                # A fresh secret per launch; the API workers inherit it through the environment
+                MODEL_SERVER_AUTHKEY = secrets.token_urlsafe(32)
+                os.environ["MODEL_SERVER_AUTHKEY"] = MODEL_SERVER_AUTHKEY
+            model_server = start_model_server(
+                MODEL_SERVER_SOCKET,
+                MODEL_SERVER_AUTHKEY.encode(),
+                model_loader_kwargs(),
+                MODEL_SERVER_PROCESSES,
+            )
+        try:
+            uvicorn.run("main:app", host="0.0.0.0", port=port, workers=API_WORKERS)
+        finally:
+            if model_server is not None:
+                model_server.terminate()
+                model_server.join(timeout=30)
\ No newline at end of file
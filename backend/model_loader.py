@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from prompt_cache import PromptEmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+# Loader states reported by /ready
+STATE_DISABLED = "disabled"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class ModelLoader:
+    """
+    Load the FluxPipeline in the background and track its readiness.
+
+    ``torch`` and ``diffusers`` are only imported inside the loader thread, so
+    importing this module (and starting the API) stays cheap. After loading,
+    an optional warm-up inference runs so the first real request doesn't pay
+    for CUDA context creation, kernel selection and allocator growth.
+
+    With ``prompt_cache_max_bytes`` set, prompt embeddings are cached in
+    ``prompt_cache`` so repeated prompts skip the text encoders.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        torch_dtype: str = "bfloat16",
+        cpu_offload: bool = True,
+        attention_slicing: bool = False,
+        warmup: bool = True,
+        warmup_steps: int = 1,
+        enabled: bool = True,
+        prompt_cache_max_bytes: int = 0,
+    ):
+        self.model_id = model_id
+        self.torch_dtype = torch_dtype
+        self.cpu_offload = cpu_offload
+        self.attention_slicing = attention_slicing
+        self.warmup = warmup
+        self.warmup_steps = warmup_steps
+
+        self.state = STATE_LOADING if enabled else STATE_DISABLED
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.pipeline: Any = None
+        self.prompt_cache = PromptEmbeddingCache(prompt_cache_max_bytes) if prompt_cache_max_bytes > 0 else None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    def start(self) -> None:
+        """Schedule the model load on a worker thread without blocking startup."""
+        if self.state == STATE_DISABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._load(), name="model-loader")
+
+    async def stop(self) -> None:
+        # A running load can't be interrupted; just stop waiting for it
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    async def _load(self) -> None:
+        logger.info(f"Loading FluxPipeline model {self.model_id} in the background")
+        await asyncio.to_thread(self.load)
+
+    def load(self) -> None:
+        """Load and warm up the pipeline in the calling thread, updating ``state``."""
+        if self.state == STATE_DISABLED:
+            return
+        started = time.perf_counter()
+        try:
+            self.pipeline = self._load_pipeline()
+            if self.warmup:
+                warmup_started = time.perf_counter()
+                self._warm_up()
+                logger.info(f"FluxPipeline warm-up finished in {time.perf_counter() - warmup_started:.1f}s")
+        except Exception as e:
+            self.pipeline = None
+            self.state = STATE_FAILED
+            self.error = str(e)
+            logger.error(f"Failed to load FluxPipeline model: {str(e)}")
+            return
+
+        self.load_seconds = time.perf_counter() - started
+        self.state = STATE_READY
+        logger.info(f"FluxPipeline model ready after {self.load_seconds:.1f}s")
+
+    def _load_pipeline(self) -> Any:
+        import torch
+        from diffusers import FluxPipeline
+
+        dtype = getattr(torch, self.torch_dtype, None)
+        if not isinstance(dtype, torch.dtype):
+            raise ValueError(f"Unknown torch dtype: {self.torch_dtype}")
+
+        pipeline = FluxPipeline.from_pretrained(self.model_id, torch_dtype=dtype)
+
+        if self.cpu_offload:
+            # Keeps only the active sub-model on the GPU; slower but fits small cards
+            pipeline.enable_model_cpu_offload()
+        elif torch.cuda.is_available():
+            pipeline.to("cuda")
+
+        if self.attention_slicing:
+            pipeline.enable_attention_slicing()
+
+        return pipeline
+
+    def _warm_up(self) -> None:
+        import torch
+
+        self.pipeline(
+            "warm-up",
+            guidance_scale=0.0,
+            num_inference_steps=self.warmup_steps,
+            max_sequence_length=256,
+            generator=torch.Generator("cpu").manual_seed(0),
+        )
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "model_id": self.model_id,
+            "error": self.error,
+            "load_seconds": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+            "prompt_cache": self.prompt_cache.stats() if self.prompt_cache is not None else None,
+        }
+
+
+def run_pipeline(
+    pipeline: Any,
+    prompts: List[str],
+    seeds: List[int],
+    guidance_scale: float,
+    num_inference_steps: int,
+    max_sequence_length: int,
+    callback_on_step_end: Optional[Callable[..., Dict[str, Any]]] = None,
+    prompt_cache: Optional[PromptEmbeddingCache] = None,
+) -> List[Any]:
+    """
+    Run one batched pipeline call with a seeded generator per prompt, so
+    batching doesn't change each prompt's output. Blocking.
+
+    With a ``prompt_cache``, the pipeline gets cached prompt embeddings
+    instead of the prompts and only encodes the ones not seen before.
+    """
+    import torch
+
+    generators = [torch.Generator("cpu").manual_seed(seed) for seed in seeds]
+    if prompt_cache is not None and hasattr(pipeline, "encode_prompt"):
+        prompt_embeds, pooled_prompt_embeds = prompt_cache.embed(pipeline, prompts, max_sequence_length)
+        inputs = {"prompt_embeds": prompt_embeds, "pooled_prompt_embeds": pooled_prompt_embeds}
+    else:
+        inputs = {"prompt": prompts}
+    return pipeline(
+        **inputs,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        max_sequence_length=max_sequence_length,
+        generator=generators,
+        callback_on_step_end=callback_on_step_end,
+    ).images
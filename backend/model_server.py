@@ -0,0 +1,419 @@
+import asyncio
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing import AuthenticationError, get_context, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Dict, List, Optional
+
+from model_loader import (
+    ModelLoader,
+    STATE_DISABLED,
+    STATE_FAILED,
+    STATE_LOADING,
+    STATE_READY,
+    run_pipeline,
+)
+from prompt_cache import merge_stats
+
+logger = logging.getLogger(__name__)
+
+
+class ModelServerError(Exception):
+    """Raised when the model server can't be reached or a generation fails there."""
+
+
+def _share_image(image) -> Dict[str, Any]:
+    """Copy an image's pixels into a new shared memory block; the receiver unlinks it."""
+    rgb = image.convert("RGB")
+    pixels = rgb.tobytes()
+    block = shared_memory.SharedMemory(create=True, size=len(pixels))
+    block.buf[:len(pixels)] = pixels
+    # Ownership passes to the client, so this process must not unlink it at exit
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return {"shm": block.name, "size": rgb.size, "mode": "RGB"}
+
+
+def _unlink_image(info: Dict[str, Any]) -> None:
+    try:
+        block = shared_memory.SharedMemory(name=info["shm"])
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def _receive_image(info: Dict[str, Any]):
+    """Copy a shared image into a PIL image and free its block."""
+    from PIL import Image
+
+    block = shared_memory.SharedMemory(name=info["shm"])
+    try:
+        width, height = info["size"]
+        return Image.frombytes(info["mode"], (width, height), block.buf[:width * height * 3])
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _generate(loader: ModelLoader, request: Dict[str, Any]) -> Dict[str, Any]:
+    step_seconds: List[float] = []
+    started = step_started = time.perf_counter()
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        nonlocal step_started
+        now = time.perf_counter()
+        step_seconds.append(now - step_started)
+        step_started = now
+        return callback_kwargs
+
+    shared: List[Dict[str, Any]] = []
+    try:
+        images = run_pipeline(
+            loader.pipeline,
+            request["prompts"],
+            request["seeds"],
+            request["guidance_scale"],
+            request["num_inference_steps"],
+            request["max_sequence_length"],
+            on_step_end,
+            loader.prompt_cache,
+        )
+        seconds = time.perf_counter() - started
+        for image in images:
+            shared.append(_share_image(image))
+    except Exception as e:
+        for info in shared:
+            _unlink_image(info)
+        logger.error(f"Image generation failed: {str(e)}")
+        return {"ok": False, "error": str(e)}
+    return {
+        "ok": True,
+        "images": shared,
+        "seconds": seconds,
+        "step_seconds": step_seconds,
+        "prompt_cache": loader.prompt_cache.stats() if loader.prompt_cache is not None else None,
+    }
+
+
+def _model_worker(conn: Connection, loader_kwargs: Dict[str, Any]) -> None:
+    """Worker process: load the model once, then run batches sent by the dispatcher."""
+    loader = ModelLoader(**loader_kwargs)
+    logger.info(f"Model worker {os.getpid()} loading {loader.model_id}")
+    loader.load()
+    conn.send({"status": loader.status()})
+    if not loader.ready:
+        return
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            # The dispatcher has gone away
+            return
+        conn.send(_generate(loader, request))
+
+
+@dataclass
+class _Worker:
+    index: int
+    process: Any
+    conn: Connection
+    status: Dict[str, Any] = field(default_factory=lambda: {"state": STATE_LOADING})
+
+    @property
+    def state(self) -> str:
+        return self.status["state"]
+
+
+class ModelServer:
+    """
+    Serves image generation from ``processes`` model worker processes, each
+    holding one copy of the pipeline, to any number of API workers.
+
+    Clients connect over a Unix socket (``multiprocessing.connection`` with
+    an auth key), one connection per batch. A batch goes to the next idle
+    worker; when all are busy, it waits for one. Generated pixels are handed
+    back in shared memory blocks, so only their names cross the socket.
+    """
+
+    def __init__(self, address: str, authkey: bytes, loader_kwargs: Dict[str, Any], processes: int = 1):
+        self.address = address
+        self.authkey = authkey
+        self.loader_kwargs = loader_kwargs
+        self.processes = max(1, processes)
+        self._workers: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._listener: Optional[Listener] = None
+
+    @property
+    def state(self) -> str:
+        states = [worker.state for worker in self._workers]
+        for state in (STATE_READY, STATE_LOADING, STATE_DISABLED):
+            if state in states:
+                return state
+        return STATE_FAILED
+
+    def status(self) -> Dict[str, Any]:
+        ready = [worker for worker in self._workers if worker.state == STATE_READY]
+        errors = [worker.status.get("error") for worker in self._workers if worker.status.get("error")]
+        prompt_caches = [worker.status["prompt_cache"] for worker in ready if worker.status.get("prompt_cache")]
+        return {
+            **(ready[0].status if ready else self._workers[0].status if self._workers else {}),
+            "state": self.state,
+            "error": errors[0] if errors and not ready else None,
+            "workers": len(self._workers),
+            "ready_workers": len(ready),
+            # Each worker has its own cache; report them as one
+            "prompt_cache": merge_stats(prompt_caches) if prompt_caches else None,
+        }
+
+    def _start_workers(self) -> None:
+        context = get_context("spawn")
+        for index in range(self.processes):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_model_worker,
+                args=(child_conn, self.loader_kwargs),
+                name=f"model-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            worker = _Worker(index, process, parent_conn)
+            self._workers.append(worker)
+            threading.Thread(target=self._await_load, args=(worker,), daemon=True).start()
+
+    def _await_load(self, worker: _Worker) -> None:
+        try:
+            worker.status = worker.conn.recv()["status"]
+        except (EOFError, OSError):
+            worker.status = {"state": STATE_FAILED, "error": "Model worker exited while loading"}
+        logger.info(f"Model worker {worker.index} is {worker.state}")
+        if worker.state == STATE_READY:
+            self._idle.put(worker)
+
+    def _checkout(self, timeout: float) -> Optional[_Worker]:
+        deadline = time.monotonic() + timeout
+        while self.state == STATE_READY and time.monotonic() < deadline:
+            try:
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                continue
+        return None
+
+    def _generate(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        state = self.state
+        if state != STATE_READY:
+            return {"ok": False, "state": state, "error": f"Model is not available (state: {state})"}
+        worker = self._checkout(request.get("timeout", 600.0))
+        if worker is None:
+            return {"ok": False, "state": self.state, "error": "No model worker became available"}
+        try:
+            worker.conn.send(request)
+            reply = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            worker.status = {"state": STATE_FAILED, "error": f"Model worker exited: {str(e)}"}
+            logger.error(f"Model worker {worker.index} exited during generation")
+            return {"ok": False, "state": self.state, "error": worker.status["error"]}
+        if reply.get("prompt_cache"):
+            worker.status["prompt_cache"] = reply.pop("prompt_cache")
+        self._idle.put(worker)
+        return reply
+
+    def _handle(self, conn: Connection) -> None:
+        with conn:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            if request.get("op") == "status":
+                reply = self.status()
+            elif request.get("op") == "generate":
+                reply = self._generate(request)
+            else:
+                reply = {"ok": False, "error": f"Unknown operation: {request.get('op')}"}
+            try:
+                conn.send(reply)
+            except OSError:
+                # The client gave up waiting; nobody else will free these blocks
+                for info in reply.get("images", []):
+                    _unlink_image(info)
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        self._start_workers()
+        logger.info(f"Model server listening on {self.address} with {self.processes} worker processes")
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                logger.warning(f"Rejected model server connection: {str(e)}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.process.terminate()
+        for worker in self._workers:
+            worker.process.join(timeout=10)
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        logger.info("Model server stopped")
+
+
+def serve(address: str, authkey: bytes, loader_kwargs: Dict[str, Any], processes: int = 1) -> None:
+    """Run a model server until SIGTERM or SIGINT."""
+    server = ModelServer(address, authkey, loader_kwargs, processes)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def start_model_server(address: str, authkey: bytes, loader_kwargs: Dict[str, Any], processes: int = 1):
+    """Start a model server in a new process and return the process."""
+    process = get_context("spawn").Process(
+        target=serve,
+        args=(address, authkey, loader_kwargs, processes),
+        name="model-server",
+    )
+    process.start()
+    return process
+
+
+class RemoteModel:
+    """
+    Client for a model server, with the readiness interface of ``ModelLoader``
+    (``ready``, ``state``, ``error``, ``status()``), so endpoints don't care
+    where the model runs.
+
+    ``run_batch`` is the scheduler's blocking batch runner. Diffusion timings
+    measured in the server are reported to ``observe`` as stage spans.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        authkey: bytes,
+        timeout: float = 600.0,
+        poll_interval: float = 2.0,
+        observe: Optional[Callable[[str, float, str], None]] = None,
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.observe = observe
+        self.state = STATE_LOADING
+        self.error: Optional[str] = None
+        self._status: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._poll(), name="model-server-status")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self) -> None:
+        while True:
+            try:
+                status = await asyncio.to_thread(self._request, {"op": "status"}, 10.0)
+                self._status = status
+                self.state, self.error = status["state"], status.get("error")
+            except ModelServerError as e:
+                # The server may still be starting; keep reporting it as loading
+                self.state = STATE_LOADING
+                self.error = str(e)
+            # Poll often until ready, then just often enough to notice a failure
+            await asyncio.sleep(self.poll_interval if not self.ready else self.poll_interval * 5)
+
+    def _request(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        try:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ModelServerError(f"Model server at {self.address} is not reachable: {str(e)}") from e
+        try:
+            conn.send(message)
+            if not conn.poll(timeout):
+                raise ModelServerError(f"Model server did not reply within {timeout:.0f}s")
+            return conn.recv()
+        except (OSError, EOFError) as e:
+            raise ModelServerError(f"Model server connection failed: {str(e)}") from e
+        finally:
+            conn.close()
+
+    def run_batch(self, key, prompts: List[str], seeds: List[int]) -> List[Any]:
+        """Generate one batch on the model server. Blocking."""
+        request = {
+            "op": "generate",
+            "prompts": prompts,
+            "seeds": seeds,
+            "guidance_scale": key.guidance_scale,
+            "num_inference_steps": key.num_inference_steps,
+            "max_sequence_length": key.max_sequence_length,
+            "timeout": self.timeout,
+        }
+        reply = self._request(request, self.timeout)
+        if not reply["ok"]:
+            if reply.get("state"):
+                self.state = reply["state"]
+            raise ModelServerError(reply["error"])
+
+        images = []
+        try:
+            for info in reply["images"]:
+                images.append(_receive_image(info))
+        finally:
+            for info in reply["images"][len(images) + 1:]:
+                _unlink_image(info)
+
+        if self.observe is not None:
+            self.observe("diffusion", reply["seconds"], "ok")
+            for seconds in reply["step_seconds"]:
+                self.observe("diffusion_step", seconds, "ok")
+        return images
+
+    def status(self) -> Dict[str, Any]:
+        return {**self._status, "state": self.state, "error": self.error, "server": self.address}
+
+
+if __name__ == "__main__":
+    # Standalone server for API workers started separately (MODEL_SERVER_AUTOSTART=false)
+    import main
+
+    if not main.MODEL_SERVER_AUTHKEY:
+        raise SystemExit("MODEL_SERVER_AUTHKEY must be set; the API workers need the same value")
+    serve(
+        main.MODEL_SERVER_SOCKET,
+        main.MODEL_SERVER_AUTHKEY.encode(),
+        main.model_loader_kwargs(),
+        main.MODEL_SERVER_PROCESSES,
+    )
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UnreadablePdfError(Exception):
+    """Raised when a PDF can't be parsed locally, e.g. it is encrypted or malformed."""
+
+
+class RateLimiter:
+    """Token bucket limiting how many calls start per second, with bursts up to ``burst``."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self) -> None:
+        self.acquired += 1
+        if self.rate <= 0:
+            return
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+        waited = time.monotonic() - started
+        # Time spent queued behind other callers counts too
+        if waited >= 0.001:
+            self.throttled += 1
+            self.wait_seconds += waited
+
+    def stats(self) -> Dict[str, Any]:
+        """Return calls let through, how many had to wait and the total wait."""
+        return {
+            "rate_per_second": self.rate,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+def pypdf_available() -> bool:
+    try:
+        import pypdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def read_text_layer(path: str, min_chars: int) -> List[Optional[str]]:
+    """
+    Read each page's embedded text layer.
+
+    Returns:
+        One entry per page: its text, or None if the page has fewer than
+        ``min_chars`` characters of text and needs OCR (scans, images)
+    """
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted:
+            reader.decrypt("")
+        document_pages = list(reader.pages)
+    except Exception as e:
+        raise UnreadablePdfError(f"Could not parse {os.path.basename(path)}: {str(e)}") from e
+
+    pages = []
+    for page in document_pages:
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            logger.warning(f"Could not read text layer of page in {path}: {str(e)}")
+            text = ""
+        pages.append(text.strip() if len(text.strip()) >= min_chars else None)
+    return pages
+
+
+def split_pages(path: str, page_indexes: List[int], directory: str) -> Dict[int, str]:
+    """
+    Write the given pages of ``path`` to standalone single-page PDFs.
+
+    Returns:
+        Page index to path of its PDF in ``directory``
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(path)
+    page_paths = {}
+    for index in page_indexes:
+        writer = PdfWriter()
+        writer.add_page(reader.pages[index])
+        page_paths[index] = os.path.join(directory, f"page-{index}.pdf")
+        with open(page_paths[index], "wb") as f:
+            writer.write(f)
+    return page_paths
+
+
+class PageParallelOcr:
+    """
+    Extracts a PDF page by page, calling OCR only where there's no text layer.
+
+    Pages that need OCR are split into single-page PDFs (RecognizePdf reads
+    one page per call) and recognized concurrently, bounded by
+    ``max_concurrency`` and ``rate_limiter`` across all documents. When the
+    document hash is known, each OCR'd page is cached, so a retry after a
+    partial failure only re-does the pages that failed. Output is merged in
+    page order.
+    """
+
+    def __init__(
+        self,
+        recognize_file: Callable[[str], Awaitable[Optional[str]]],
+        run_disk: Callable[..., Awaitable[Any]],
+        rate_limiter: RateLimiter,
+        max_concurrency: int = 4,
+        min_native_chars: int = 20,
+        page_cache=None,
+    ):
+        self.recognize_file = recognize_file
+        self.run_disk = run_disk
+        self.rate_limiter = rate_limiter
+        self.min_native_chars = min_native_chars
+        self.page_cache = page_cache
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self.native_pages = 0
+        self.ocr_pages = 0
+        self.cached_pages = 0
+
+    async def extract(self, path: str, sha256: Optional[str] = None) -> str:
+        """
+        Return the document's text with pages separated by blank lines.
+
+        Raises:
+            UnreadablePdfError: If the PDF can't be parsed locally
+            Exception: The first page OCR error, after caching the pages that succeeded
+        """
+        pages: List[Optional[str]] = await self.run_disk(read_text_layer, path, self.min_native_chars)
+        missing = [index for index, text in enumerate(pages) if text is None]
+        self.native_pages += len(pages) - len(missing)
+
+        if missing and sha256 and self.page_cache is not None:
+            cached: Dict[int, str] = await asyncio.to_thread(self.page_cache.get_pages, sha256)
+            for index in list(missing):
+                if index in cached:
+                    pages[index] = cached[index]
+                    missing.remove(index)
+                    self.cached_pages += 1
+
+        if missing:
+            logger.info(f"OCR of {len(missing)}/{len(pages)} pages of {os.path.basename(path)}")
+            work_dir = tempfile.mkdtemp(prefix="ocr-pages-")
+            try:
+                page_paths = await self.run_disk(split_pages, path, missing, work_dir)
+                results = await asyncio.gather(
+                    *(self._ocr_page(page_paths[index], index, sha256) for index in missing),
+                    return_exceptions=True,
+                )
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            for index, text in zip(missing, results):
+                pages[index] = text
+
+        return "\n\n".join(text for text in pages if text)
+
+    async def _ocr_page(self, page_path: str, index: int, sha256: Optional[str]) -> str:
+        async with self._slots:
+            await self.rate_limiter.acquire()
+            text = (await self.recognize_file(page_path)) or ""
+        self.ocr_pages += 1
+        if sha256 and self.page_cache is not None:
+            await asyncio.to_thread(self.page_cache.put_page, sha256, index, text)
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pages read from text layers, OCR'd and served from the page cache, and the OCR rate limiter's counters."""
+        return {
+            "native_pages": self.native_pages,
+            "ocr_pages": self.ocr_pages,
+            "cached_pages": self.cached_pages,
+            "rate_limiter": self.rate_limiter.stats(),
+        }
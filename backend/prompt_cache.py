@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+
+def _tensor_bytes(tensor: Any) -> int:
+    return tensor.element_size() * tensor.nelement()
+
+
+class PromptEmbeddingCache:
+    """
+    LRU cache of FluxPipeline prompt embeddings.
+
+    Entries are keyed by prompt and ``max_sequence_length`` and hold the T5
+    ``prompt_embeds`` and CLIP ``pooled_prompt_embeds`` of one prompt. They
+    are kept on the CPU, so the cache never competes with the transformer
+    for GPU memory, and bounded by total tensor bytes. Prompts missing from
+    the cache are encoded together in one text encoder call. Safe to call
+    from worker threads.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Any, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "encode_seconds": 0.0,
+        }
+
+    def embed(self, pipeline: Any, prompts: List[str], max_sequence_length: int) -> Tuple[Any, Any]:
+        """
+        Look up or encode the embeddings of a batch of prompts. Blocking.
+
+        Args:
+            pipeline: FluxPipeline whose text encoders produce the embeddings
+            prompts: Prompts of the batch, duplicates allowed
+            max_sequence_length: T5 sequence length the prompts are padded to
+
+        Returns:
+            ``(prompt_embeds, pooled_prompt_embeds)`` for the whole batch in
+            prompt order, on the pipeline's execution device
+        """
+        import torch
+
+        found: Dict[str, Tuple[Any, Any]] = {}
+        with self._lock:
+            for prompt in dict.fromkeys(prompts):
+                entry = self._entries.get((prompt, max_sequence_length))
+                if entry is not None:
+                    self._entries.move_to_end((prompt, max_sequence_length))
+                    found[prompt] = entry
+
+        missing = [prompt for prompt in dict.fromkeys(prompts) if prompt not in found]
+        device = pipeline._execution_device
+        if missing:
+            started = time.perf_counter()
+            with torch.no_grad():
+                prompt_embeds, pooled_prompt_embeds, _ = pipeline.encode_prompt(
+                    prompt=missing,
+                    prompt_2=None,
+                    device=device,
+                    num_images_per_prompt=1,
+                    max_sequence_length=max_sequence_length,
+                )
+            seconds = time.perf_counter() - started
+            for index, prompt in enumerate(missing):
+                # Copy each row out so an entry doesn't keep the whole batch's storage alive
+                found[prompt] = (
+                    prompt_embeds[index:index + 1].to("cpu", copy=True),
+                    pooled_prompt_embeds[index:index + 1].to("cpu", copy=True),
+                )
+            with self._lock:
+                self._stats["encode_seconds"] += seconds
+                for prompt in missing:
+                    self._add((prompt, max_sequence_length), found[prompt])
+
+        with self._lock:
+            # Repeats of a prompt within the batch are encoded once, so they count as hits
+            self._stats["misses"] += len(missing)
+            self._stats["hits"] += len(prompts) - len(missing)
+
+        prompt_embeds = torch.cat([found[prompt][0] for prompt in prompts]).to(device)
+        pooled_prompt_embeds = torch.cat([found[prompt][1] for prompt in prompts]).to(device)
+        return prompt_embeds, pooled_prompt_embeds
+
+    def _add(self, key: Tuple[str, int], entry: Tuple[Any, Any]) -> None:
+        size = sum(_tensor_bytes(tensor) for tensor in entry)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._total_bytes -= sum(_tensor_bytes(tensor) for tensor in previous)
+        self._entries[key] = entry
+        self._total_bytes += size
+        while self._total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= sum(_tensor_bytes(tensor) for tensor in evicted)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, encoder time and current cache size."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "encode_seconds": round(self._stats["encode_seconds"], 3),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def merge_stats(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine the ``stats()`` of several caches, e.g. one per model worker."""
+    merged = {key: sum(item[key] for item in stats) for key in ("hits", "misses", "evictions", "entries", "bytes", "max_bytes")}
+    lookups = merged["hits"] + merged["misses"]
+    merged["encode_seconds"] = round(sum(item["encode_seconds"] for item in stats), 3)
+    merged["hit_rate"] = round(merged["hits"] / lookups, 4) if lookups else 0.0
+    return merged
@@ -0,0 +1,326 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from db import AsyncConnection
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """SQL identifiers for a table exposed through the data endpoints."""
+    name: str
+    plan_column: str  # Column filtered by ``plan_id``
+    version_column: str  # Timestamp bumped whenever a row changes
+
+
+# Only these tables can be read through the data endpoints
+TABLES: Dict[str, TableSpec] = {
+    "plans": TableSpec("public.plans", "id", "updated_at"),
+    # Documents are never updated in place, so creation time is their version
+    "documents": TableSpec("public.documents", "plan_id", "created_at"),
+    "tasks": TableSpec("public.tasks", "plan_id", "updated_at"),
+}
+
+# Columns the bulk endpoints may set; the rest are filled by column defaults
+WRITABLE_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "plans": ("name", "description"),
+    "documents": ("plan_id", "title", "content", "metadata", "summary", "type", "tag", "image"),
+    "tasks": ("title", "plan_id", "start_time", "start_date", "duration", "status"),
+}
+
+JSON_COLUMNS = {"metadata"}
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor can't be decoded."""
+
+
+def encode_cursor(table: str, last_id: int) -> str:
+    payload = json.dumps({"t": table, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(table: str, token: str) -> int:
+    """
+    Decode a cursor produced by ``encode_cursor`` for the same table.
+
+    Raises:
+        InvalidCursorError: If the token is malformed or belongs to another table
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = payload["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursorError("Malformed cursor") from None
+    if payload.get("t") != table or not isinstance(last_id, int):
+        raise InvalidCursorError(f"Cursor does not belong to table {table}")
+    return last_id
+
+
+def _select(
+    table: str,
+    plan_id: Optional[int],
+    after_id: Optional[int] = None,
+    updated_since: Optional[datetime] = None,
+) -> Tuple[str, List[Any]]:
+    spec = TABLES[table]
+    conditions = []
+    params: List[Any] = []
+    if plan_id is not None:
+        conditions.append(f"{spec.plan_column} = %s")
+        params.append(plan_id)
+    if updated_since is not None:
+        conditions.append(f"{spec.version_column} > %s")
+        params.append(updated_since)
+    if after_id is not None:
+        conditions.append("id > %s")
+        params.append(after_id)
+
+    sql = f"SELECT * FROM {spec.name}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    return sql, params
+
+
+async def fetch_page(
+    conn: AsyncConnection,
+    table: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    plan_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Fetch one keyset-paginated page of rows ordered by id.
+
+    Returns:
+        The rows and the cursor for the next page (None on the last page)
+    """
+    after_id = decode_cursor(table, cursor) if cursor else None
+    sql, params = _select(table, plan_id, after_id)
+
+    # Fetch one extra row to learn whether another page exists
+    rows = await conn.fetchall(sql + " LIMIT %s", params + [limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(table, rows[-1]["id"])
+    return rows, None
+
+
+async def fetch_all(
+    conn: AsyncConnection,
+    table: str,
+    plan_id: Optional[int] = None,
+    updated_since: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    sql, params = _select(table, plan_id, updated_since=updated_since)
+    return await conn.fetchall(sql, params)
+
+
+async def table_versions(
+    conn: AsyncConnection, plan_id: Optional[int] = None
+) -> Dict[str, Tuple[int, Optional[datetime]]]:
+    """
+    Row count and newest version timestamp of each of ``TABLES``, in one
+    round trip. No row data is read, so this is cheap enough to run on
+    every poll.
+
+    Returns:
+        Table name -> (row count, max version column value)
+    """
+    parts = []
+    params: List[Any] = []
+    for table, spec in TABLES.items():
+        sql = f"SELECT %s::text AS table_name, count(*) AS row_count, max({spec.version_column}) AS max_version FROM {spec.name}"
+        params.append(table)
+        if plan_id is not None:
+            sql += f" WHERE {spec.plan_column} = %s"
+            params.append(plan_id)
+        parts.append(sql)
+    rows = await conn.fetchall(" UNION ALL ".join(parts), params)
+    return {row["table_name"]: (row["row_count"], row["max_version"]) for row in rows}
+
+
+async def stream_table(
+    conn: AsyncConnection,
+    table: str,
+    plan_id: Optional[int] = None,
+    batch_size: int = 500,
+) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """Yield a table's rows in batches from a server-side cursor."""
+    sql, params = _select(table, plan_id)
+    async for rows in conn.stream(sql, params, batch_size=batch_size):
+        yield rows
+
+
+def _insert_rows(raw_conn, sql: str, values: List[Tuple[Any, ...]], page_size: int) -> List[Dict[str, Any]]:
+    with raw_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        # One multi-row INSERT per page; fetch=True collects RETURNING rows across pages
+        return execute_values(cursor, sql, values, page_size=page_size, fetch=True)
+
+
+async def insert_rows(
+    conn: AsyncConnection,
+    table: str,
+    rows: Sequence[Dict[str, Any]],
+    page_size: int = 500,
+) -> List[Dict[str, Any]]:
+    """
+    Insert rows into one of ``TABLES`` with multi-row INSERT statements.
+
+    Only ``WRITABLE_COLUMNS`` are written; missing keys are inserted as NULL.
+    Run it inside ``DatabasePool.transaction`` so a failing page rolls back
+    the whole batch.
+
+    Returns:
+        The inserted rows, in input order
+    """
+    if not rows:
+        return []
+    columns = WRITABLE_COLUMNS[table]
+    values = [
+        tuple(
+            Json(row.get(column)) if column in JSON_COLUMNS and row.get(column) is not None else row.get(column)
+            for column in columns
+        )
+        for row in rows
+    ]
+    sql = f"INSERT INTO {TABLES[table].name} ({', '.join(columns)}) VALUES %s RETURNING *"
+    return await conn.run(_insert_rows, conn.raw, sql, values, page_size)
+
+
+async def plan_document_hashes(conn: AsyncConnection, plan_id: int) -> Set[str]:
+    """Return the SHA-256s of the PDFs a plan's documents were extracted from."""
+    rows = await conn.fetchall(
+        "SELECT DISTINCT metadata->>'sha256' AS sha256 FROM public.documents WHERE plan_id = %s AND metadata->>'sha256' IS NOT NULL",
+        (plan_id,),
+    )
+    return {row["sha256"] for row in rows}
+
+
+async def existing_plan_ids(conn: AsyncConnection, plan_ids: Iterable[int]) -> Set[int]:
+    """Return which of ``plan_ids`` exist in the plans table."""
+    ids = sorted(set(plan_ids))
+    if not ids:
+        return set()
+    rows = await conn.fetchall("SELECT id FROM public.plans WHERE id = ANY(%s)", (ids,))
+    return {row["id"] for row in rows}
+
+
+# Characters of a document's content that go into its search vector; a tsvector over 1 MB is
+# rejected, which would fail the whole insert. Changing it requires dropping documents.search_vector.
+SEARCH_CONTENT_MAX_CHARS = 100_000
+
+
+class SearchUnsupportedError(Exception):
+    """Raised when the database can't hold the documents full-text column (generated columns need PostgreSQL 12)."""
+
+
+def document_search_column(text_config: str) -> str:
+    """
+    DDL adding a generated ``search_vector`` column to the documents table.
+    Postgres keeps the column current on every insert and update, so no
+    separate indexing step is needed.
+    """
+    return f"""
+    ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{text_config}'::regconfig, coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{text_config}'::regconfig, coalesce(summary, '')), 'B') ||
+            setweight(to_tsvector('{text_config}'::regconfig, left(coalesce(content, ''), {SEARCH_CONTENT_MAX_CHARS})), 'C')
+        ) STORED
+    """
+
+
+# Indexes of the documents table used by full-text search, by name
+DOCUMENT_SEARCH_INDEXES: Dict[str, str] = {
+    "documents_search_vector_idx": "CREATE INDEX IF NOT EXISTS documents_search_vector_idx ON public.documents USING GIN (search_vector)",
+    "documents_plan_id_idx": "CREATE INDEX IF NOT EXISTS documents_plan_id_idx ON public.documents (plan_id)",
+}
+
+# Serializes the migration across API workers starting at the same time ("aplus" in ASCII)
+_SEARCH_SCHEMA_LOCK_ID = 0x61706C7573
+
+
+async def ensure_document_search(conn: AsyncConnection, text_config: str) -> List[str]:
+    """
+    Create the documents full-text column and indexes if they don't exist yet. Run in a transaction.
+
+    The catalog is checked first and only missing objects are created, so
+    once the migration has run no DDL (and no ACCESS EXCLUSIVE lock on
+    documents) is taken again.
+
+    Returns:
+        The names of the objects created, empty if everything was in place
+
+    Raises:
+        SearchUnsupportedError: If the server predates PostgreSQL 12
+    """
+    if not text_config.replace("_", "").isalnum():
+        raise ValueError(f"Invalid text search configuration: {text_config}")
+    version = await conn.fetchone("SELECT current_setting('server_version_num')::int AS version")
+    if version["version"] < 120000:
+        raise SearchUnsupportedError(f"PostgreSQL 12 or later is required, the server reports {version['version']}")
+
+    await conn.execute("SELECT pg_advisory_xact_lock(%s)", (_SEARCH_SCHEMA_LOCK_ID,))
+    column = await conn.fetchone(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'documents' AND column_name = 'search_vector'
+        """
+    )
+    indexes = await conn.fetchall(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = 'documents' AND indexname = ANY(%s)",
+        (list(DOCUMENT_SEARCH_INDEXES),),
+    )
+    created = []
+    if column is None:
+        await conn.execute(document_search_column(text_config))
+        created.append("search_vector")
+    existing = {row["indexname"] for row in indexes}
+    for name, statement in DOCUMENT_SEARCH_INDEXES.items():
+        if name not in existing:
+            await conn.execute(statement)
+            created.append(name)
+    return created
+
+
+async def search_documents(
+    conn: AsyncConnection,
+    plan_id: int,
+    query: str,
+    limit: int,
+    text_config: str,
+    headline_options: str,
+) -> List[Dict[str, Any]]:
+    """
+    Rank a plan's documents against a web-style search query.
+
+    Matching and ranking only touch the GIN index and the stored vectors;
+    snippets are built with ``ts_headline`` for the top ``limit`` rows only.
+
+    Returns:
+        The matching documents, best first, with a highlighted snippet and rank
+    """
+    return await conn.fetchall(
+        """
+        SELECT id, title, type, metadata->>'source' AS source, rank,
+            ts_headline(%(config)s::regconfig, coalesce(content, ''), query, %(options)s) AS snippet
+        FROM (
+            SELECT id, title, type, metadata, content, query,
+                ts_rank_cd(search_vector, query) AS rank
+            FROM public.documents, websearch_to_tsquery(%(config)s::regconfig, %(query)s) AS query
+            WHERE plan_id = %(plan_id)s AND search_vector @@ query
+            ORDER BY rank DESC, id
+            LIMIT %(limit)s
+        ) AS top
+        ORDER BY rank DESC, id
+        """,
+        {"config": text_config, "query": query, "plan_id": plan_id, "limit": limit, "options": headline_options},
+    )
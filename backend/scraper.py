@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+)
+
+# Read buffer for response bodies
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ScrapeTooLargeError(ValueError):
+    """Raised when a scraped page exceeds the configured response size limit."""
+
+
+def create_http_session(
+    limit: int = 100,
+    limit_per_host: int = 8,
+    dns_cache_ttl: int = 300,
+    timeout: float = 30.0,
+) -> aiohttp.ClientSession:
+    """
+    Create the app-lifetime HTTP session with keep-alive and DNS caching.
+
+    Must be called from a running event loop; close it on shutdown.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=dns_cache_ttl,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers={"User-Agent": USER_AGENT},
+    )
+
+
+class ScrapeCache:
+    """
+    SQLite-backed cache of scraped pages: validators plus extracted text.
+
+    Least recently used pages are evicted beyond ``max_entries``. Methods are
+    blocking; ``Scraper`` calls them from worker threads.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Wait for other processes' write locks instead of failing straight away
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    text TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used_at)")
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def put(self, url: str, text: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO pages (url, etag, last_modified, text, fetched_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = excluded.etag, last_modified = excluded.last_modified, text = excluded.text,
+                    fetched_at = excluded.fetched_at, last_used_at = excluded.last_used_at
+                """,
+                (url, etag, last_modified, text, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) AS n FROM pages").fetchone()["n"]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY last_used_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def touch(self, url: str, revalidated: bool = False) -> None:
+        """Mark a page as used, and as freshly validated if ``revalidated``."""
+        now = time.time()
+        with self._lock, self._conn:
+            if revalidated:
+                self._conn.execute(
+                    "UPDATE pages SET fetched_at = ?, last_used_at = ? WHERE url = ?", (now, now, url)
+                )
+            else:
+                self._conn.execute("UPDATE pages SET last_used_at = ? WHERE url = ?", (now, url))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class Scraper:
+    """
+    Fetches pages through a shared session and caches their extracted text.
+
+    Pages fetched within ``fresh_seconds`` are served from the cache without
+    a request. Older ones are revalidated with If-None-Match /
+    If-Modified-Since, so an unchanged page costs one 304 and no parsing.
+    Bodies larger than ``max_bytes`` are rejected while streaming.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        extract: Callable[[str], Awaitable[str]],
+        cache: Optional[ScrapeCache] = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        fresh_seconds: float = 300.0,
+    ):
+        self.session = session
+        self.extract = extract
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    async def fetch_text(self, url: str) -> str:
+        """
+        Return the extracted text of ``url``.
+
+        Raises:
+            ValueError: If the URL doesn't return HTTP 200 (or 304 for a cached page)
+            ScrapeTooLargeError: If the body exceeds ``max_bytes``
+        """
+        cached = await asyncio.to_thread(self.cache.get, url) if self.cache else None
+        if cached is not None and time.time() - cached["fetched_at"] <= self.fresh_seconds:
+            self.hits += 1
+            await asyncio.to_thread(self.cache.touch, url)
+            return cached["text"]
+
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                self.revalidated += 1
+                await asyncio.to_thread(self.cache.touch, url, True)
+                return cached["text"]
+            if response.status != 200:
+                logger.warning(f"Failed to fetch URL {url}: HTTP {response.status}")
+                raise ValueError(f"Failed to fetch content from {url}: HTTP {response.status}")
+
+            html = await self._read_body(url, response)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        self.misses += 1
+        text = await self.extract(html)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, url, text, etag, last_modified)
+        return text
+
+    async def _read_body(self, url: str, response: aiohttp.ClientResponse) -> str:
+        limit_message = f"Response from {url} exceeds the {self.max_bytes} byte limit"
+        if self.max_bytes and response.content_length is not None and response.content_length > self.max_bytes:
+            raise ScrapeTooLargeError(limit_message)
+
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            body.extend(chunk)
+            if self.max_bytes and len(body) > self.max_bytes:
+                raise ScrapeTooLargeError(limit_message)
+
+        try:
+            encoding = response.get_encoding()
+        except Exception:
+            encoding = "utf-8"
+        return body.decode(encoding, errors="replace")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
+
+    def close(self) -> None:
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,449 @@
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Temporary files older than this are leftovers of interrupted writes
+STALE_TMP_SECONDS = 3600
+
+
+def shard_path(directory: str, name: str) -> str:
+    """
+    Place ``name`` two directory levels deep, by its first four characters.
+
+    With hash or uuid names, 65536 shards keep every directory small no
+    matter how many files are stored.
+    """
+    return os.path.join(directory, name[:2], name[2:4], name)
+
+
+def walk_files(directory: str) -> Iterator[os.DirEntry]:
+    """Yield every file under ``directory``, removing empty shard directories along the way."""
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            entries = list(os.scandir(current))
+        except FileNotFoundError:
+            continue
+        # Shard directories have two-character names; others (like an incoming directory) are kept
+        if not entries and current != directory and len(os.path.basename(current)) == 2:
+            try:
+                os.rmdir(current)
+            except OSError:
+                pass
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def _remove_file(path: str) -> int:
+    """Delete ``path`` and return the bytes freed (0 if it was already gone)."""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+class LocalFileStore:
+    """
+    Bounded local cache of files whose system of record is OSS.
+
+    Files are stored under a sharded layout (see ``shard_path``) and
+    tracked in a SQLite index with their size, last use and whether their
+    OSS copy has been confirmed. Eviction is least recently used first,
+    for files unused longer than ``max_age_seconds`` or while the store is
+    over ``max_bytes``. With a bucket, only files confirmed in OSS are
+    evicted, and ``ensure_local`` pulls evicted files back on demand.
+    Without one the local copy is the only one, and the limits apply to
+    every file. All methods are blocking and safe to call from worker
+    threads.
+
+    Files the index doesn't know about (written by earlier versions in a
+    flat layout, or by a crash between the write and the index update)
+    are adopted by ``sweep_batch`` as not uploaded and handed to
+    ``upload``; like every other file they are only evicted once their
+    OSS copy is confirmed. Legacy files keep their path, since jobs queued
+    by earlier versions refer to it.
+    """
+
+    # The index is in SQLite, so one process compacting the store covers all of them
+    shared_index = True
+
+    def __init__(
+        self,
+        name: str,
+        directory: str,
+        index_path: str,
+        max_bytes: int,
+        max_age_seconds: float,
+        bucket=None,
+        object_prefix: str = "",
+        upload: Optional[Callable[[str, str], None]] = None,
+    ):
+        index_directory = os.path.dirname(index_path)
+        if index_directory:
+            os.makedirs(index_directory, exist_ok=True)
+        os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bucket = bucket
+        self.object_prefix = object_prefix
+        # Blocking callback queuing (object_path, local_path) for upload to OSS
+        self.upload = upload
+
+        self._lock = threading.Lock()
+        # Wait for other processes' write locks instead of failing straight away
+        self._conn = sqlite3.connect(index_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._scan: Optional[Iterator[os.DirEntry]] = None
+        self._stats = {"evictions": 0, "evicted_bytes": 0, "restored": 0, "swept": 0}
+
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    uploaded INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            # Set for adopted files outside the sharded layout
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(files)")}
+            if "path" not in columns:
+                self._conn.execute("ALTER TABLE files ADD COLUMN path TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_lru ON files (uploaded, last_used_at)")
+
+    def path_for(self, key: str) -> str:
+        return shard_path(self.directory, key)
+
+    def object_path_for(self, key: str) -> str:
+        return f"{self.object_prefix}{key}"
+
+    def _file_path(self, row: sqlite3.Row) -> str:
+        return row["path"] or self.path_for(row["key"])
+
+    def _register(self, key: str, size: int, uploaded: bool = False, path: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO files (key, size, uploaded, created_at, last_used_at, path) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    size = excluded.size, last_used_at = excluded.last_used_at,
+                    uploaded = MAX(uploaded, excluded.uploaded), path = excluded.path
+                """,
+                (key, size, int(uploaded), now, now, path),
+            )
+
+    def add(self, key: str, source_path: str) -> str:
+        """
+        Move ``source_path`` into the store under ``key``.
+
+        Keys are content-addressed, so if ``key`` is already stored the new
+        copy is discarded.
+
+        Returns:
+            The stored file's path
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(source_path)
+        else:
+            os.replace(source_path, path)
+        self._register(key, os.path.getsize(path))
+        return path
+
+    def ensure_local(self, key: str) -> str:
+        """
+        Return the local path of ``key``, downloading it from OSS if it was evicted.
+
+        Raises:
+            FileNotFoundError: If the file is neither stored locally nor in OSS
+        """
+        path = self.path_for(key)
+        if os.path.exists(path):
+            with self._lock, self._conn:
+                self._conn.execute("UPDATE files SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            return path
+        if self.bucket is None:
+            raise FileNotFoundError(f"{key} is not in the {self.name} store")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            self.bucket.get_object_to_file(self.object_path_for(key), tmp_path)
+        except Exception as e:
+            _remove_file(tmp_path)
+            raise FileNotFoundError(f"{key} is not stored locally and could not be fetched from OSS: {str(e)}")
+        os.replace(tmp_path, path)
+        self._register(key, os.path.getsize(path), uploaded=True)
+        with self._lock:
+            self._stats["restored"] += 1
+        return path
+
+    def mark_uploaded(self, object_path: str) -> None:
+        """Record that a stored file's OSS copy is confirmed; other object paths are ignored."""
+        if not object_path.startswith(self.object_prefix):
+            return
+        key = object_path[len(self.object_prefix):]
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE files SET uploaded = 1 WHERE key = ?", (key,))
+
+    def _evictable_clause(self) -> str:
+        return "uploaded = 1" if self.bucket is not None else "1 = 1"
+
+    def evict_batch(self, max_files: int) -> Dict[str, int]:
+        """
+        Evict up to ``max_files`` expired or least recently used files.
+
+        Returns:
+            The number of files evicted and bytes freed, and how many more are due
+        """
+        now = time.time()
+        evictable = self._evictable_clause()
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            candidates = self._conn.execute(
+                f"SELECT key, path, size, last_used_at FROM files WHERE {evictable} ORDER BY last_used_at LIMIT ?",
+                (max_files + 1,),
+            ).fetchall()
+
+        victims = []
+        for row in candidates:
+            expired = self.max_age_seconds > 0 and now - row["last_used_at"] > self.max_age_seconds
+            if not expired and total <= self.max_bytes:
+                break
+            victims.append(row)
+            total -= row["size"]
+        more = len(victims) > max_files
+        victims = victims[:max_files]
+
+        # Only evict files nobody used since the snapshot; a newer last_used_at keeps the row
+        deleted = []
+        if victims:
+            with self._lock, self._conn:
+                for row in victims:
+                    cursor = self._conn.execute(
+                        "DELETE FROM files WHERE key = ? AND last_used_at = ?", (row["key"], row["last_used_at"])
+                    )
+                    if cursor.rowcount:
+                        deleted.append(self._file_path(row))
+
+        freed = 0
+        for path in deleted:
+            freed += _remove_file(path)
+        if deleted:
+            with self._lock:
+                self._stats["evictions"] += len(deleted)
+                self._stats["evicted_bytes"] += freed
+        return {"evicted": len(deleted), "freed_bytes": freed, "more": int(more)}
+
+    def sweep_batch(self, max_files: int) -> Dict[str, int]:
+        """
+        Check up to ``max_files`` files on disk against the index, resuming
+        where the previous batch stopped.
+
+        Stale temporary files are deleted. Files missing from the index are
+        adopted as not uploaded and queued for upload, and left to
+        ``evict_batch`` like any other file; nothing else is deleted here.
+        Without a bucket, files outside the sharded layout are left alone,
+        as they may be the only copy of data written by earlier versions.
+
+        Returns:
+            The number of files scanned and deleted, and whether the walk finished
+        """
+        if self._scan is None:
+            self._scan = walk_files(self.directory)
+
+        now = time.time()
+        scanned = removed = 0
+        finished = False
+        while scanned < max_files:
+            entry = next(self._scan, None)
+            if entry is None:
+                self._scan = None
+                finished = True
+                break
+            scanned += 1
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            age = now - stat.st_mtime
+
+            if entry.name.endswith((".tmp", ".part")):
+                if age > STALE_TMP_SECONDS:
+                    _remove_file(entry.path)
+                    removed += 1
+                continue
+
+            if entry.path == self.path_for(entry.name):
+                key, path = entry.name, None
+            elif self.bucket is not None:
+                # Legacy layout: keyed by its path under the store, which is also its OSS object name
+                key, path = os.path.relpath(entry.path, self.directory).replace(os.sep, "/"), entry.path
+            else:
+                continue
+            with self._lock:
+                known = self._conn.execute("SELECT 1 FROM files WHERE key = ?", (key,)).fetchone()
+            if known:
+                continue
+            self._register(key, stat.st_size, path=path)
+            if self.upload is not None:
+                self.upload(self.object_path_for(key), entry.path)
+
+        # Drop index rows whose file has disappeared
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, path FROM files ORDER BY RANDOM() LIMIT ?", (max(1, max_files // 10),)
+            ).fetchall()
+        missing = [(row["key"],) for row in rows if not os.path.exists(self._file_path(row))]
+        with self._lock, self._conn:
+            if missing:
+                self._conn.executemany("DELETE FROM files WHERE key = ?", missing)
+            self._stats["swept"] += removed
+        return {"scanned": scanned, "removed": removed, "finished": int(finished)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes,
+                    COALESCE(SUM(uploaded), 0) AS uploaded,
+                    COALESCE(SUM(CASE WHEN uploaded = 0 THEN size ELSE 0 END), 0) AS pending_upload_bytes
+                FROM files
+                """
+            ).fetchone()
+            return {
+                **dict(row),
+                "max_bytes": self.max_bytes,
+                "max_age_seconds": self.max_age_seconds,
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class StorageCompactor:
+    """
+    Background task applying quotas and TTLs to the local stores.
+
+    Each pass evicts and sweeps every store in batches of ``batch_size``
+    files, one executor call per batch with ``pause_seconds`` between
+    batches, so compaction never holds a disk worker for long or competes
+    with request traffic for I/O. Stores need ``evict_batch`` and
+    ``sweep_batch`` methods like ``LocalFileStore``'s.
+
+    With ``lock_dir``, a store whose ``shared_index`` is set is compacted by
+    one process at a time: the pass holds a per-store file lock, and other
+    processes skip the store while it is held.
+    """
+
+    def __init__(
+        self,
+        stores: Sequence[Any],
+        run_blocking: Callable[..., Awaitable[Any]],
+        interval_seconds: float = 600.0,
+        batch_size: int = 100,
+        pause_seconds: float = 0.5,
+        max_batches_per_pass: int = 100,
+        lock_dir: Optional[str] = None,
+    ):
+        self.stores = list(stores)
+        self.run_blocking = run_blocking
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, batch_size)
+        self.pause_seconds = pause_seconds
+        self.max_batches_per_pass = max(1, max_batches_per_pass)
+        self.lock_dir = lock_dir
+        self._task: Optional[asyncio.Task] = None
+        self.passes = 0
+        self.last_pass: Dict[str, Dict[str, int]] = {}
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="storage-compactor")
+        logger.info(f"Storage compaction started for {len(self.stores)} stores every {self.interval_seconds:.0f}s")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Storage compaction failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def _try_lock(self, store: Any) -> Optional[Any]:
+        """Take the cross-process compaction lock of ``store``; returns the open lock file, or None if it is held."""
+        lock_file = open(os.path.join(self.lock_dir, f"{store.name}.compaction.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    async def run_once(self) -> Dict[str, Dict[str, int]]:
+        """Run one compaction pass over every store."""
+        summary = {}
+        for store in self.stores:
+            lock_file = None
+            if self.lock_dir is not None and getattr(store, "shared_index", False):
+                lock_file = self._try_lock(store)
+                if lock_file is None:
+                    logger.debug(f"Skipping compaction of {store.name}, another process is compacting it")
+                    continue
+            try:
+                summary[store.name] = await self._compact(store)
+            finally:
+                # Closing the file releases the lock
+                if lock_file is not None:
+                    lock_file.close()
+        self.passes += 1
+        self.last_pass = summary
+        return summary
+
+    async def _compact(self, store: Any) -> Dict[str, int]:
+        totals = {"evicted": 0, "freed_bytes": 0, "scanned": 0, "removed": 0}
+        for method in (store.evict_batch, store.sweep_batch):
+            for _ in range(self.max_batches_per_pass):
+                result = await self.run_blocking(method, self.batch_size)
+                for key in totals:
+                    totals[key] += result.get(key, 0)
+                if not result.get("more") and (method == store.evict_batch or result.get("finished")):
+                    break
+                await asyncio.sleep(self.pause_seconds)
+        if totals["evicted"] or totals["removed"]:
+            logger.info(
+                f"Compacted {store.name}: evicted {totals['evicted']} files ({totals['freed_bytes']} bytes), "
+                f"removed {totals['removed']} stray files"
+            )
+        return totals
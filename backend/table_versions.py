@@ -0,0 +1,93 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+
+def as_utc(value: datetime) -> datetime:
+    """Treat naive timestamps as UTC so they compare with aware ones."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+@dataclass(frozen=True)
+class TableVersion:
+    """Row count and newest version timestamp of one table, optionally scoped to a plan."""
+    table: str
+    row_count: int
+    max_version: Optional[datetime]
+
+
+class TableVersionCache:
+    """
+    Short-lived cache of ``TableVersion`` aggregates per plan scope, the
+    validators behind /get-all-data's ETag.
+
+    Only the aggregates are cached, never rows. Writes made by this process
+    call ``invalidate`` so the next read recomputes them; ``ttl_seconds``
+    bounds staleness for writes made by other workers. At most
+    ``max_entries`` scopes are kept, least recently used dropped first.
+    """
+
+    def __init__(self, ttl_seconds: float = 5.0, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Optional[int], Tuple[float, List[TableVersion]]]" = OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(
+        self,
+        plan_id: Optional[int],
+        loader: Callable[[Optional[int]], Awaitable[List[TableVersion]]],
+    ) -> List[TableVersion]:
+        """
+        Return the versions of every table for ``plan_id`` (None for all
+        plans), computing them with ``loader(plan_id)`` if stale.
+        """
+        entry = self._entries.get(plan_id)
+        if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+            self._entries.move_to_end(plan_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._generation
+        versions = await loader(plan_id)
+        # Don't cache a load that raced with a write
+        if self._generation == generation:
+            self._entries[plan_id] = (time.monotonic(), versions)
+            self._entries.move_to_end(plan_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return versions
+
+    def invalidate(self) -> None:
+        """Drop every cached scope after a write; a row can belong to any of them."""
+        self._generation += 1
+        self._entries.clear()
+
+
+def combined_etag(versions: List[TableVersion], *qualifiers: Any) -> str:
+    """Weak ETag for a response built from several tables and request parameters."""
+    payload = json.dumps(
+        [[v.table, v.row_count, v.max_version.isoformat() if v.max_version else None] for v in versions]
+        + [list(map(str, qualifiers))]
+    )
+    return f'W/"{hashlib.sha1(payload.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against ``etag`` using weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == bare for tag in candidates)
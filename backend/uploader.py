@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import oss2
+
+logger = logging.getLogger(__name__)
+
+# Journal entry states
+UPLOAD_PENDING = "pending"
+UPLOAD_RUNNING = "uploading"
+UPLOAD_FAILED = "failed"
+
+
+class UploadJournal:
+    """
+    SQLite journal of OSS uploads that haven't completed yet.
+
+    An entry is removed only after its upload succeeds, so a restart picks up
+    whatever was still queued or in flight. Re-enqueueing an object path bumps
+    its revision; an upload of an older revision then doesn't clear the entry.
+
+    Several processes can share the journal. A claimed upload records its
+    ``owner`` and holds a lease that the owner renews while uploading; only
+    uploads whose lease has expired are put back on the queue. All methods
+    are blocking.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 120.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        # Wait for other processes' write locks instead of failing straight away
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    object_path TEXT PRIMARY KEY,
+                    local_path TEXT,
+                    data BLOB,
+                    skip_existing INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    revision INTEGER NOT NULL DEFAULT 1,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    owner TEXT,
+                    lease_expires_at REAL
+                )
+                """
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(uploads)")}
+            for column, column_type in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE uploads ADD COLUMN {column} {column_type}")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS uploads_due ON uploads (status, next_attempt_at)"
+            )
+
+    def add(
+        self,
+        object_path: str,
+        local_path: Optional[str] = None,
+        data: Optional[bytes] = None,
+        skip_existing: bool = False,
+    ) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO uploads (object_path, local_path, data, skip_existing, status, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (object_path) DO UPDATE SET
+                    local_path = excluded.local_path, data = excluded.data,
+                    skip_existing = excluded.skip_existing, status = excluded.status,
+                    revision = revision + 1, attempts = 0, error = NULL,
+                    next_attempt_at = excluded.next_attempt_at
+                """,
+                (object_path, local_path, data, int(skip_existing), UPLOAD_PENDING, now, now),
+            )
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest due upload as running under this journal's lease and return it."""
+        now = time.time()
+        # A single statement, so two processes can't claim the same upload
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                """
+                UPDATE uploads SET status = ?, attempts = attempts + 1, owner = ?, lease_expires_at = ?
+                WHERE object_path = (
+                    SELECT object_path FROM uploads WHERE status = ? AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT 1
+                )
+                RETURNING *
+                """,
+                (UPLOAD_RUNNING, self.owner, now + self.lease_seconds, UPLOAD_PENDING, now),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def next_attempt_delay(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) AS next_attempt_at FROM uploads WHERE status = ?", (UPLOAD_PENDING,)
+            ).fetchone()
+        if row is None or row["next_attempt_at"] is None:
+            return None
+        return max(0.0, row["next_attempt_at"] - time.time())
+
+    def complete(self, object_path: str, revision: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM uploads WHERE object_path = ? AND revision = ?", (object_path, revision)
+            )
+
+    def retry(self, object_path: str, revision: int, error: str, delay: Optional[float]) -> None:
+        """
+        Schedule another attempt after ``delay`` seconds, or give up when ``delay`` is None.
+
+        Only applies while this journal still holds the claim.
+        """
+        status = UPLOAD_FAILED if delay is None else UPLOAD_PENDING
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                UPDATE uploads SET status = ?, error = ?, next_attempt_at = ?
+                WHERE object_path = ? AND revision = ? AND owner = ?
+                """,
+                (status, error, time.time() + (delay or 0), object_path, revision, self.owner),
+            )
+
+    def renew_leases(self, uploads: Iterable[Tuple[str, int]]) -> None:
+        """Extend the leases of running uploads, given as (object path, revision), claimed by this journal."""
+        expires_at = time.time() + self.lease_seconds
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                UPDATE uploads SET lease_expires_at = ?
+                WHERE object_path = ? AND revision = ? AND owner = ? AND status = ?
+                """,
+                [(expires_at, object_path, revision, self.owner, UPLOAD_RUNNING) for object_path, revision in uploads],
+            )
+
+    def requeue_expired(self) -> int:
+        """Put running uploads whose lease has expired back on the queue."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                UPDATE uploads SET status = ?, next_attempt_at = ?
+                WHERE status = ? AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                """,
+                (UPLOAD_PENDING, now, UPLOAD_RUNNING, now),
+            )
+        return cursor.rowcount
+
+    def release(self) -> int:
+        """Put uploads this journal still has running back on the queue, for a clean shutdown."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE uploads SET status = ?, next_attempt_at = ? WHERE owner = ? AND status = ?",
+                (UPLOAD_PENDING, time.time(), self.owner, UPLOAD_RUNNING),
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM uploads GROUP BY status").fetchall()
+        counts = {UPLOAD_PENDING: 0, UPLOAD_RUNNING: 0, UPLOAD_FAILED: 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class OssUploader:
+    """
+    Write-behind uploader: callers get the object's URL immediately and the
+    upload runs in the background.
+
+    Uploads are journaled on disk and retried with exponential backoff and
+    jitter. Files at or above ``multipart_threshold`` go through
+    ``oss2.resumable_upload`` with ``num_threads`` parallel parts; its
+    checkpoints let an interrupted multipart upload resume after a restart.
+    Blocking SDK calls run through ``run_blocking``.
+
+    Leases of running uploads are renewed every ``lease_seconds / 3`` of the
+    journal, and uploads whose lease expired in any process sharing the
+    journal are requeued. A failing journal call is logged and retried after
+    ``error_backoff`` seconds rather than ending the worker.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        journal: UploadJournal,
+        url_prefix: str,
+        run_blocking: Callable[..., Awaitable[Any]],
+        workers: int = 4,
+        max_attempts: int = 8,
+        backoff_base: float = 2.0,
+        backoff_max: float = 600.0,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        part_size: int = 2 * 1024 * 1024,
+        num_threads: int = 4,
+        checkpoint_dir: str = "data",
+        error_backoff: float = 1.0,
+    ):
+        self.bucket = bucket
+        self.journal = journal
+        self.url_prefix = url_prefix.rstrip("/")
+        self.run_blocking = run_blocking
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.num_threads = num_threads
+        self.error_backoff = error_backoff
+        self.checkpoint_store = oss2.ResumableStore(root=checkpoint_dir, dir="oss-upload-checkpoints")
+
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._running: Set[Tuple[str, int]] = set()
+        self._listeners: List[Callable[[str], None]] = []
+        self._stats = {"uploaded": 0, "multipart": 0, "deduplicated": 0, "retries": 0, "failed": 0, "bytes": 0}
+
+    def url_for(self, object_path: str) -> str:
+        return f"{self.url_prefix}/{object_path}"
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """Call ``listener(object_path)`` after each object is confirmed in OSS, in a worker thread."""
+        self._listeners.append(listener)
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"oss-uploader-{i}") for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._keep_leases(), name="oss-upload-leases"))
+        logger.info(f"OSS uploader started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Unfinished uploads stay in the journal, ready for any process to resume
+        try:
+            released = await asyncio.to_thread(self.journal.release)
+            if released:
+                logger.info(f"Released {released} unfinished OSS uploads")
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release OSS uploads, they are requeued when their lease expires: {str(e)}")
+        logger.info("OSS uploader stopped")
+
+    async def enqueue_file(self, object_path: str, local_path: str, skip_existing: bool = False) -> str:
+        """
+        Queue ``local_path`` for upload to ``object_path`` and return its URL.
+
+        With ``skip_existing`` (for content-addressed names), an object that
+        already exists in OSS isn't uploaded again.
+        """
+        await asyncio.to_thread(self.journal.add, object_path, local_path, None, skip_existing)
+        self._wakeup.set()
+        return self.url_for(object_path)
+
+    async def enqueue_bytes(self, object_path: str, data: bytes, skip_existing: bool = False) -> str:
+        """Queue ``data`` for upload to ``object_path`` and return its URL."""
+        await asyncio.to_thread(self.journal.add, object_path, None, data, skip_existing)
+        self._wakeup.set()
+        return self.url_for(object_path)
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _upload(self, entry: Dict[str, Any]) -> Tuple[str, int]:
+        """Perform one upload; returns how it was done and the bytes sent."""
+        object_path = entry["object_path"]
+        if entry["skip_existing"] and self.bucket.object_exists(object_path):
+            return "deduplicated", 0
+        if entry["local_path"] is None:
+            self.bucket.put_object(object_path, entry["data"])
+            return "uploaded", len(entry["data"])
+
+        size = os.path.getsize(entry["local_path"])
+        if size >= self.multipart_threshold:
+            oss2.resumable_upload(
+                self.bucket,
+                object_path,
+                entry["local_path"],
+                store=self.checkpoint_store,
+                multipart_threshold=self.multipart_threshold,
+                part_size=self.part_size,
+                num_threads=self.num_threads,
+            )
+            return "multipart", size
+        self.bucket.put_object_from_file(object_path, entry["local_path"])
+        return "uploaded", size
+
+    async def _keep_leases(self) -> None:
+        while True:
+            try:
+                if self._running:
+                    await asyncio.to_thread(self.journal.renew_leases, list(self._running))
+                requeued = await asyncio.to_thread(self.journal.requeue_expired)
+                if requeued:
+                    logger.info(f"Requeued {requeued} OSS uploads with expired leases")
+                    self._wakeup.set()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew OSS upload leases: {str(e)}")
+            await asyncio.sleep(self.journal.lease_seconds / 3)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                # Clear before claiming so an enqueue during the claim still wakes us
+                self._wakeup.clear()
+                entry = await asyncio.to_thread(self.journal.claim_next)
+                if entry is None:
+                    delay = await asyncio.to_thread(self.journal.next_attempt_delay)
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay or 5.0, 5.0))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                claim = (entry["object_path"], entry["revision"])
+                self._running.add(claim)
+                try:
+                    await self._run(entry)
+                finally:
+                    # An unfinished upload's lease then runs out and it is requeued
+                    self._running.discard(claim)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"OSS upload worker error, retrying in {self.error_backoff:.1f}s: {str(e)}")
+                await asyncio.sleep(self.error_backoff)
+
+    async def _run(self, entry: Dict[str, Any]) -> None:
+        object_path, revision = entry["object_path"], entry["revision"]
+        try:
+            outcome, size = await self.run_blocking(self._upload, entry)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            missing = isinstance(e, FileNotFoundError)
+            if entry["attempts"] < self.max_attempts and not missing:
+                delay = self._backoff(entry["attempts"])
+                self._stats["retries"] += 1
+                logger.warning(
+                    f"Upload of {object_path} attempt {entry['attempts']} failed, retrying in {delay:.1f}s: {str(e)}"
+                )
+            else:
+                delay = None
+                self._stats["failed"] += 1
+                logger.error(f"Giving up on upload of {object_path} after {entry['attempts']} attempts: {str(e)}")
+            await asyncio.to_thread(self.journal.retry, object_path, revision, str(e), delay)
+            self._wakeup.set()
+            return
+
+        await asyncio.to_thread(self.journal.complete, object_path, revision)
+        self._stats[outcome] += 1
+        self._stats["bytes"] += size
+        if outcome != "deduplicated":
+            logger.info(f"Uploaded {object_path} to Alibaba Cloud OSS")
+        for listener in self._listeners:
+            try:
+                # Listeners update local indexes (SQLite), which would block the event loop
+                await asyncio.to_thread(listener, object_path)
+            except Exception as e:
+                logger.warning(f"Upload listener failed for {object_path}: {str(e)}")
+
+    async def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "journal": await asyncio.to_thread(self.journal.counts)}
+
+    def close(self) -> None:
+        self.journal.close()
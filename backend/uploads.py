@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+
+# Copy buffer size; peak memory per upload is bounded by this, not the file size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an uploaded file exceeds the configured size limit."""
+
+
+@dataclass
+class SavedUpload:
+    path: str
+    size: int
+    sha256: str
+
+
+def _copy_stream(source: BinaryIO, path: str, max_bytes: int, chunk_size: int) -> SavedUpload:
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = f"{path}.part"
+    try:
+        with open(tmp_path, "wb") as destination:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                destination.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return SavedUpload(path, size, digest.hexdigest())
+
+
+async def save_upload(
+    file: UploadFile,
+    path: str,
+    max_bytes: int = 0,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> SavedUpload:
+    """
+    Stream an uploaded file to ``path`` in fixed-size chunks, hashing it on the way.
+
+    Starlette has already spooled the request body to a temporary file, so the
+    copy runs in a worker thread straight from that file. Nothing larger than
+    ``chunk_size`` is held in memory. The spooled body itself is bounded by
+    ``RequestSizeLimitMiddleware``.
+
+    Args:
+        file: The uploaded file
+        path: Destination path; written atomically via a ``.part`` file
+        max_bytes: Maximum allowed size in bytes (0 for unlimited)
+        chunk_size: Copy buffer size
+
+    Returns:
+        The saved path, size and SHA-256 hex digest
+
+    Raises:
+        UploadTooLargeError: If the file is larger than ``max_bytes``; nothing is left on disk
+    """
+    # Reject early when the size is already known from the multipart parser
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"File exceeds the {max_bytes} byte upload limit")
+    await file.seek(0)
+    return await asyncio.to_thread(_copy_stream, file.file, path, max_bytes, chunk_size)
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware capping the request body size of upload endpoints.
+
+    Starlette spools a multipart body to disk before the endpoint sees it,
+    so per-file limits only apply after the whole request has been written
+    out. A ``Content-Length`` over ``max_bytes`` is rejected with 413 before
+    anything is read; bodies without one (chunked) are counted as they
+    stream in and cut off with 413 once they pass the limit.
+    """
+
+    def __init__(self, app, max_bytes: int, paths: Iterable[str]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body exceeds the {self.max_bytes} byte upload limit"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({"detail": detail}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the body parser; FastAPI passes HTTPException through to the 413 response
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
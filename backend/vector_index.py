@@ -0,0 +1,181 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chunking import Chunk
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex:
+    """
+    Per-plan chunk embeddings stored as a memory-mapped float32 matrix.
+
+    Each plan has ``plan_<id>.json`` (the text, source and content hash of
+    each chunk, plus a generation number) and ``plan_<id>.<generation>.npy``
+    (one unit vector per chunk). An update writes a new matrix file and then
+    atomically replaces the JSON, so readers always see a matching pair.
+    Updates of a plan hold ``plan_<id>.lock``, so API workers in several
+    processes take turns. Searches map the matrix read-only, so the vectors
+    stay in the page cache rather than the heap; the mappings of the
+    ``max_loaded_plans`` most recently used plans are kept open.
+    """
+
+    def __init__(self, directory: str, dimensions: int, max_loaded_plans: int = 256):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.max_loaded_plans = max(1, max_loaded_plans)
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # plan_id -> ((inode, mtime) of the JSON file, generation, rows, matrix), least recently used first
+        self._loaded: "OrderedDict[int, Tuple[Tuple[int, int], int, List[Dict[str, Any]], Optional[np.ndarray]]]" = (
+            OrderedDict()
+        )
+        self._write_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def _rows_path(self, plan_id: int) -> str:
+        return os.path.join(self.directory, f"plan_{plan_id}.json")
+
+    def _matrix_path(self, plan_id: int, generation: int) -> str:
+        return os.path.join(self.directory, f"plan_{plan_id}.{generation}.npy")
+
+    def _lock_plan(self, plan_id: int) -> Any:
+        """Block until the cross-process write lock of a plan is held; returns the open lock file."""
+        lock_file = open(os.path.join(self.directory, f"plan_{plan_id}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            lock_file.close()
+            raise
+        return lock_file
+
+    def _load(self, plan_id: int) -> Tuple[int, List[Dict[str, Any]], Optional[np.ndarray]]:
+        rows_path = self._rows_path(plan_id)
+        try:
+            stat = os.stat(rows_path)
+        except FileNotFoundError:
+            return 0, [], None
+        # The JSON is replaced on every update, so a new inode means another process wrote it
+        version = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._lock:
+            loaded = self._loaded.get(plan_id)
+            if loaded is not None and loaded[0] == version:
+                self._loaded.move_to_end(plan_id)
+                return loaded[1:]
+
+        with open(rows_path, encoding="utf-8") as f:
+            index = json.load(f)
+        generation, rows = index["generation"], index["rows"]
+        matrix = np.load(self._matrix_path(plan_id, generation), mmap_mode="r") if rows else None
+        if matrix is not None and matrix.shape != (len(rows), self.dimensions):
+            logger.warning(f"Vector index for plan {plan_id} doesn't match its rows, ignoring it")
+            return generation, [], None
+
+        with self._lock:
+            self._loaded[plan_id] = (version, generation, rows, matrix)
+            self._loaded.move_to_end(plan_id)
+            while len(self._loaded) > self.max_loaded_plans:
+                self._loaded.popitem(last=False)
+        return generation, rows, matrix
+
+    def load(self, plan_id: int) -> Tuple[List[Dict[str, Any]], Optional[np.ndarray]]:
+        """Return a plan's chunk rows and its memory-mapped matrix (None if the plan has no index)."""
+        _, rows, matrix = self._load(plan_id)
+        return rows, matrix
+
+    def save(self, plan_id: int, rows: List[Dict[str, Any]], matrix: np.ndarray) -> None:
+        previous, _, _ = self._load(plan_id)
+        generation = previous + 1
+        rows_path = self._rows_path(plan_id)
+        with open(self._matrix_path(plan_id, generation), "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(f"{rows_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "rows": rows}, f)
+        os.replace(f"{rows_path}.tmp", rows_path)
+        with self._lock:
+            self._loaded.pop(plan_id, None)
+        # Readers that already mapped the old matrix keep their mapping after the unlink
+        try:
+            os.remove(self._matrix_path(plan_id, previous))
+        except FileNotFoundError:
+            pass
+
+    def search(self, plan_id: int, query: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Return the ``k`` chunks most similar to the unit vector ``query``, best first.
+        """
+        rows, matrix = self.load(plan_id)
+        if matrix is None or not rows:
+            return []
+        scores = matrix @ query.astype(np.float32)
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{**rows[i], "score": round(float(scores[i]), 6)} for i in top]
+
+    async def update_source(
+        self,
+        plan_id: int,
+        source: str,
+        chunks: List[Chunk],
+        embed: Callable[[List[str]], Awaitable[np.ndarray]],
+        run_blocking: Callable[..., Awaitable[Any]],
+    ) -> Dict[str, int]:
+        """
+        Replace the chunks of ``source`` in a plan's index.
+
+        Chunks whose content hash is already in the plan's index reuse the
+        stored vector; only new or changed chunks are sent to ``embed``.
+        The plan's file lock is held from reading the index to saving it.
+
+        Returns:
+            How many chunks the source has, and how many were embedded
+        """
+        async with self._write_locks[plan_id]:
+            lock_file = await run_blocking(self._lock_plan, plan_id)
+            try:
+                rows, matrix = await run_blocking(self.load, plan_id)
+                existing = {row["sha256"]: i for i, row in enumerate(rows)}
+
+                # Identical new chunks are embedded once
+                new_chunks: Dict[str, Chunk] = {}
+                for chunk in chunks:
+                    if chunk.sha256 not in existing:
+                        new_chunks.setdefault(chunk.sha256, chunk)
+                new_index = {sha256: i for i, sha256 in enumerate(new_chunks)}
+                new_texts = [chunk.text for chunk in new_chunks.values()]
+                new_vectors = await embed(new_texts) if new_texts else None
+
+                kept = [i for i, row in enumerate(rows) if row["source"] != source]
+                vectors = [np.asarray(matrix[kept])] if kept else []
+                out_rows = [rows[i] for i in kept]
+                source_vectors = []
+                for chunk in chunks:
+                    if chunk.sha256 in existing:
+                        source_vectors.append(np.asarray(matrix[existing[chunk.sha256]]))
+                    else:
+                        source_vectors.append(new_vectors[new_index[chunk.sha256]])
+                    out_rows.append({
+                        "source": source,
+                        "chunk_index": chunk.index,
+                        "sha256": chunk.sha256,
+                        "tokens": chunk.tokens,
+                        "text": chunk.text,
+                    })
+                if source_vectors:
+                    vectors.append(np.stack(source_vectors))
+
+                combined = np.concatenate(vectors) if vectors else np.zeros((0, self.dimensions), dtype=np.float32)
+                await run_blocking(self.save, plan_id, out_rows, combined)
+                return {"chunks": len(chunks), "embedded": len(new_texts)}
+            finally:
+                # Closing the file releases the lock
+                lock_file.close()
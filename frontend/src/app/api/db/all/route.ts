@@ -1,28 +1,46 @@
-import { NextResponse } from 'next/server';
+import { NextRequest, NextResponse } from 'next/server';
 
 // Environment variable for the backend URL
 // You may need to add this to your .env.local file
 const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8090';
 
-export async function GET() {
+export async function GET(request: NextRequest) {
   try {
+    // Forward conditional-GET and delta-sync parameters to the backend
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+    };
+    const ifNoneMatch = request.headers.get('if-none-match');
+    if (ifNoneMatch) {
+      headers['If-None-Match'] = ifNoneMatch;
+    }
+    const query = request.nextUrl.searchParams.toString();
+
     // Fetch data from the backend endpoint that retrieves all data
-    const response = await fetch(`${BACKEND_URL}/get-all-data`, {
+    const response = await fetch(`${BACKEND_URL}/get-all-data${query ? `?${query}` : ''}`, {
       method: 'GET',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers,
       // Ensure fresh data by disabling cache for this request
       cache: 'no-store'
     });
 
+    const etag = response.headers.get('etag');
+    if (response.status === 304) {
+      return new NextResponse(null, {
+        status: 304,
+        headers: etag ? { ETag: etag } : undefined,
+      });
+    }
+
     if (!response.ok) {
       throw new Error(`Backend responded with status: ${response.status}`);
     }
 
     const data = await response.json();
     
-    return NextResponse.json(data);
+    return NextResponse.json(data, {
+      headers: etag ? { ETag: etag, 'Cache-Control': 'no-cache' } : undefined,
+    });
   } catch (error: any) {
     console.error('Error fetching data:', error);
     return NextResponse.json(
@@ -21,16 +21,21 @@ export async function POST(request: NextRequest) {
     // Get the image data
     const imageBuffer = await response.arrayBuffer();
     
-    // Extract the storage URL from header
-    const storageUrl = response.headers.get('X-Storage-URL') || '';
+    // Pass through the image type and the storage URLs of the image and its variants
+    const headers: Record<string, string> = {
+      'Content-Type': response.headers.get('Content-Type') || 'image/png',
+      'X-Storage-URL': response.headers.get('X-Storage-URL') || '',
+    };
+    response.headers.forEach((value, name) => {
+      if (name.toLowerCase().startsWith('x-variant-')) {
+        headers[name] = value;
+      }
+    });
 
     // Return the image with appropriate headers
     return new NextResponse(imageBuffer, {
       status: 200,
-      headers: {
-        'Content-Type': 'image/png',
-        'X-Storage-URL': storageUrl,
-      },
+      headers,
     });
   } catch (error) {
     console.error('Error generating image:', error);